@@ -11,14 +11,13 @@ function img_to_graph {
     echo "Processing $1"
     # these are the beta values required for the potential plots
     betas="${GRABCUT_BETAS:-0 1 2 5 10 20}"
-    mkdir -p "results/graphs/grabcut/$1"
-    for beta in $betas; do
-        python src/img_to_graph.py "data/images/$1.jpg" \
+    # all beta values are handled in one go, the images are
+    # only read once and the edges only computed once
+    python src/img_to_graph.py "data/images/$1.jpg" \
         --hed "data/hed/$1.jpg" \
         -s "data/seeds/$1.png" \
-        -o "results/graphs/grabcut/$1/$beta.h5" \
-        --beta "$beta"
-    done
+        -o "results/graphs/grabcut/$1/{beta}.h5" \
+        --betas "$betas"
 }
 
 function all {
@@ -31,10 +30,8 @@ function all {
         # these are the beta values used elsewhere
         # (2 and 5 for Karger/RW and 10 for watershed)
         betas="${USPS_BETAS:-2 5 10}"
-        for beta in $betas; do
-            echo "Processing USPS with beta=$beta"
-            python src/usps_graph.py "$beta"
-        done
+        echo "Processing USPS with betas $betas"
+        python src/usps_graph.py $betas
     else
         echo "Invalid dataset: $1"
         echo "Expected 'grabcut' or 'usps'"
@@ -6,12 +6,30 @@ set -e
 function karger {
 	echo "Karger for $1"
 	JULIA_NUM_THREADS=4 julia src/julia/calculate_potential.jl \
-		"$1" "${KARGER_RUNS:-100}"
+		"$1" "${KARGER_RUNS:-100}" $KARGER_TOL
 }
 
 function karger_multi {
 	echo "Karger for $1"
-	JULIA_NUM_THREADS=4 julia src/julia/calculate_all_potentials.jl "$1" "${KARGER_RUNS:-100}"
+	JULIA_NUM_THREADS=4 julia src/julia/calculate_all_potentials.jl "$1" "${KARGER_RUNS:-100}" $KARGER_TOL
+}
+
+# Python version of karger/karger_multi, which handles all graphs
+# of a dataset in a single process (first argument is the dataset,
+# the remaining ones are the graph names)
+function karger_python {
+	if [[ "$1" == usps ]]; then
+		multi="--multi"
+	else
+		multi=""
+	fi
+	shift
+	if [[ -n "$KARGER_TOL" ]]; then
+		tol="--tol $KARGER_TOL"
+	else
+		tol=""
+	fi
+	python src/calculate_karger_potential.py $multi $tol -N "${KARGER_RUNS:-100}" "$@"
 }
 
 function rw {
@@ -44,10 +62,16 @@ function power_watershed_multi {
 
 # argument should be a directory, either 'grabcut' or 'usps'
 function all {
-	for file in $(find results/graphs/$1 -type f -path "*.h5" -printf "%P\n" | sed 's/\.h5$//1')
+	files=$(find results/graphs/$1 -type f -path "*.h5" -printf "%P\n" | sed 's/\.h5$//1')
+	if [[ "${KARGER_ENGINE:-julia}" == python ]]; then
+		karger_python "$1" $(for file in $files; do echo "$1/$file"; done)
+	fi
+	for file in $files
 	do
 		if [[ "$1" == grabcut ]]; then
-			karger "$1/$file"
+			if [[ "${KARGER_ENGINE:-julia}" == julia ]]; then
+				karger "$1/$file"
+			fi
 			rw "$1/$file"
 			# we use the beta=10 version for watershed
 			# doesn't really matter which one, the point is that
@@ -57,7 +81,9 @@ function all {
 				power_watershed "$1/$file"
 			fi
 		elif [[ "$1" == usps ]]; then
-			karger_multi "$1/$file"
+			if [[ "${KARGER_ENGINE:-julia}" == julia ]]; then
+				karger_multi "$1/$file"
+			fi
 			rw_multi "$1/$file"
 			if [[ "$file" == */10 ]]; then
 				watershed "$1/$file"
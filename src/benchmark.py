@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import numpy as np
+import scipy
+from scipy import sparse
+from sklearn.neighbors import kneighbors_graph
+from python import random_walker as rw
+from python.image import graph_from_hed
+from python.karger import karger_potential, power_watershed, numba_loaded
+
+SOLVER_MODES = ('bf', 'factorized', 'cg', 'cg_j', 'cg_mg', 'cg_block', 'cg_gmg', 'cg_dd')
+
+
+def grid_graph(size, nlabels, rng, beta=10, seed_fraction=0.005):
+    """Grid graph of a random HED map with random seeds of each label."""
+    n, edges, weights = graph_from_hed(rng.random((size, size)), beta=beta)
+    return n, edges, weights, random_seeds(n, nlabels, rng, seed_fraction), (size, size)
+
+
+def knn_graph(n, nlabels, rng, beta=5, dim=16, k=10, seeds_per_label=5):
+    """kNN graph like the USPS one, of points from one cluster per label."""
+    centers = rng.normal(size=(nlabels, dim)) * 3
+    truth = rng.integers(nlabels, size=n)
+    data = centers[truth] + rng.normal(size=(n, dim))
+    graph = kneighbors_graph(data, k, mode="distance", include_self=False)
+    rows, cols, vals = sparse.find(graph)
+    vals = vals ** 2
+    weights = np.exp(-beta * vals / np.max(vals))
+    seeds = np.zeros(n, dtype=np.int64)
+    for label in range(nlabels):
+        nodes = rng.choice(np.flatnonzero(truth == label), seeds_per_label, replace=False)
+        seeds[nodes] = label + 1
+    return n, np.stack([rows, cols]), weights, seeds, None
+
+
+def random_seeds(n, nlabels, rng, fraction):
+    seeds = np.zeros(n, dtype=np.int64)
+    nodes = rng.choice(n, max(nlabels, int(fraction * n)), replace=False)
+    # make sure every label has at least one seed
+    seeds[nodes] = np.concatenate(
+        [np.arange(1, nlabels + 1), rng.integers(1, nlabels + 1, nodes.size - nlabels)])
+    return seeds
+
+
+class IterationCounter:
+    """Counts the CG iterations of the solver modes.
+
+    scipy's cg is called through a wrapper with a callback (which is called
+    once per iteration) and _block_cg with a matrix that counts its
+    products. So for the scipy modes, this is the sum of the iterations
+    over all labels, for 'cg_block' the number of block iterations. The
+    original functions are restored on exit.
+    """
+
+    def __enter__(self):
+        self.iterations = 0
+        self._cg, self._block_cg = rw.cg, rw._block_cg
+
+        def cg(*args, **kwargs):
+            def callback(xk):
+                self.iterations += 1
+            return self._cg(*args, callback=callback, **kwargs)
+
+        def block_cg(A, *args, **kwargs):
+            return self._block_cg(_CountingMatrix(A, self), *args, **kwargs)
+
+        rw.cg, rw._block_cg = cg, block_cg
+        return self
+
+    def __exit__(self, *exc):
+        rw.cg, rw._block_cg = self._cg, self._block_cg
+
+
+class _CountingMatrix:
+    def __init__(self, A, counter):
+        self.A = A
+        self.shape = A.shape
+        self.counter = counter
+
+    def __matmul__(self, X):
+        self.counter.iterations += 1
+        return self.A @ X
+
+
+def measure(func, repeat):
+    """Minimum time over repeat runs, peak memory and CG iterations of func."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    # memory and iterations are measured in a separate run, so that the
+    # overhead of tracemalloc doesn't affect the times
+    with IterationCounter() as counter:
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {"time": min(times), "peak_memory": peak, "iterations": counter.iterations}
+
+
+def run_graph(name, graph, nlabels, modes, karger_samples, repeat, tol):
+    n, edges, weights, seeds, shape = graph
+    info = {"graph": name, "n": int(n), "m": int(weights.shape[0]), "nlabels": nlabels}
+    results = []
+
+    def add(task, mode, func):
+        result = dict(info, task=task, mode=mode, **measure(func, repeat))
+        print("{} ({} labels) {}{}: {:.4f}s, {} bytes, {} iterations".format(
+            name, nlabels, task, "" if mode is None else " " + mode,
+            result["time"], result["peak_memory"], result["iterations"]))
+        results.append(result)
+
+    add("build_laplacian", None, lambda: rw._build_laplacian(edges, weights, n))
+    add("build_linear_system", None,
+        lambda: rw._build_linear_system(edges, weights, seeds, nlabels))
+    if shape is not None:
+        add("build_linear_system", "grid",
+            lambda: rw._build_linear_system(None, weights, seeds, nlabels, shape))
+
+    lap_sparse, B = rw._build_linear_system(edges, weights, seeds, nlabels)
+    for mode in modes:
+        if mode == 'cg_gmg' and shape is None:
+            # only for grids
+            continue
+        # no cache_key, so that 'factorized' doesn't use the cache
+        add("solve", mode, lambda: rw._solve_linear_system(lap_sparse, B, tol, mode,
+                                                           grid=(shape, seeds)))
+
+    add("power_watershed", None, lambda: power_watershed(n, edges, weights, seeds))
+    if karger_samples:
+        add("karger", None, lambda: karger_potential(n, edges, weights, seeds,
+                                                     karger_samples, n_jobs=1))
+    return results
+
+
+def compare(results, baseline, threshold, min_time):
+    """Print the change in time relative to the baseline and return the
+    results that are slower by more than the threshold factor."""
+    def task_id(result):
+        return (result["graph"], result["nlabels"], result["task"], result["mode"])
+
+    old = {task_id(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        if task_id(result) not in old:
+            continue
+        before = old[task_id(result)]["time"]
+        ratio = result["time"] / before
+        regression = ratio > threshold and result["time"] > min_time
+        print("{} {:.4f}s -> {:.4f}s ({:+.0%}){}".format(
+            " ".join(str(x) for x in task_id(result) if x is not None),
+            before, result["time"], ratio - 1, "  REGRESSION" if regression else ""))
+        if regression:
+            regressions.append(result)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark the random walker solvers, graph construction and Karger')
+    parser.add_argument('--grid-sizes', type=int, nargs='*', default=[64, 128, 256],
+                        help='side lengths of the grid graphs')
+    parser.add_argument('--knn-sizes', type=int, nargs='*', default=[1000, 4000],
+                        help='number of nodes of the kNN graphs')
+    parser.add_argument('--labels', type=int, nargs='+', default=[2, 5],
+                        help='numbers of labels')
+    parser.add_argument('--modes', type=str, nargs='+', default=['bf', 'cg', 'cg_j', 'cg_mg'],
+                        choices=SOLVER_MODES, help='solver modes to benchmark')
+    parser.add_argument('--karger-samples', type=int, default=20,
+                        help='number of Karger samples (0 to skip Karger)')
+    parser.add_argument('--tol', type=float, default=1e-3,
+                        help='tolerance of the CG modes')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of runs, the fastest one is reported')
+    parser.add_argument('-o', type=str, default='results/benchmark.json', metavar='PATH',
+                        help='output file')
+    parser.add_argument('--baseline', type=str, metavar='PATH',
+                        help='earlier output to compare to')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown factor relative to the baseline that counts '
+                             'as a regression')
+    parser.add_argument('--min-time', type=float, default=0.01,
+                        help='faster tasks are never counted as regressions, '
+                             'since their times are too noisy')
+    args = parser.parse_args()
+
+    # the same graphs in every run, so that results are comparable
+    rng = np.random.default_rng(0)
+    results = []
+    for nlabels in args.labels:
+        for size in args.grid_sizes:
+            graph = grid_graph(size, nlabels, rng)
+            results += run_graph(f"grid_{size}", graph, nlabels, args.modes,
+                                 args.karger_samples, args.repeat, args.tol)
+        for size in args.knn_sizes:
+            graph = knn_graph(size, nlabels, rng)
+            results += run_graph(f"knn_{size}", graph, nlabels, args.modes,
+                                 args.karger_samples, args.repeat, args.tol)
+
+    environment = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "pyamg": rw.amg_loaded,
+        "scikit-sparse": rw.cholmod_loaded,
+        "numba": numba_loaded,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+    os.makedirs(os.path.dirname(args.o) or ".", exist_ok=True)
+    with open(args.o, 'w', encoding='utf-8') as f:
+        json.dump({"environment": environment, "results": results}, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_time)
+        if regressions:
+            print(f"{len(regressions)} regressions compared to {args.baseline}")
+            sys.exit(1)
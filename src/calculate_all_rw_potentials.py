@@ -1,21 +1,26 @@
 import os
+import sys
 import argparse
 import h5py
-import numpy as np
-from python.random_walker import random_walker
+from python.random_walker import random_walker, random_walker_stream
+from python import cache, storage
 
 parser = argparse.ArgumentParser(description='Calculate the RW potential of a graph')
 parser.add_argument('path', type=str, metavar='PATH',
                     help='filename of the seeded graph file')
 parser.add_argument('-o', type=str, metavar='PATH',
                     help='output file')
+parser.add_argument('--stream', action='store_true',
+                    help='solve one label at a time and write its potential right away, '
+                         'so that the memory doesn\'t grow with the number of labels')
 args = parser.parse_args()
 
-with h5py.File(args.path, "r") as f:
-    n, edges, weights = f["n"][()], f["edges"][()], f["weights"][()]
-    seeds = f["seeds"][()]
+key = cache.key("rw_multi", [args.path], mode="factorized")
+if cache.fetch(args.o, key):
+    print(f"{args.o} is up to date")
+    sys.exit()
 
-rw_pot = random_walker(n, edges, weights, seeds, mode="bf")
+n, edges, weights, seeds, _ = storage.read_graph(args.path)
 
 os.makedirs(os.path.dirname(args.o), exist_ok=True)
 
@@ -25,7 +30,15 @@ try:
 except OSError:
     pass
 
-with h5py.File(args.o, "w") as f:
-    for i in range(rw_pot.shape[0]):
-        f.create_dataset("potential/" + str(i + 1), data=rw_pot[i])
-    f.create_dataset("segmentation", data=1 + np.argmax(rw_pot, axis=0))
+if args.stream:
+    # the same datasets as write_potentials writes
+    with h5py.File(args.o, "w") as f:
+        def sink(label, potential):
+            storage.write_potential(f, "potential/" + str(label), potential)
+        segmentation = random_walker_stream(n, edges, weights, seeds, mode="factorized",
+                                            sink=sink)
+        storage.write_labels(f, "segmentation", segmentation)
+else:
+    rw_pot = random_walker(n, edges, weights, seeds, mode="factorized")
+    storage.write_potentials(args.o, rw_pot, multi=True)
+cache.store(args.o, key)
@@ -0,0 +1,57 @@
+import argparse
+import h5py
+from python.karger import karger_potential, karger_potential_adaptive
+from python import cache, storage
+
+parser = argparse.ArgumentParser(description='Calculate the Karger potential of graphs')
+parser.add_argument('names', type=str, nargs='+', metavar='NAME',
+                    help='names of the seeded graphs, relative to results/graphs '
+                         'and without .h5 (e.g. grabcut/banana1/10)')
+parser.add_argument('-N', type=int, default=100,
+                    help='number of samples (the maximum number with --tol)')
+parser.add_argument('--tol', type=float, default=None,
+                    help='sample until the standard error of all potentials is '
+                         'below this value (or -N samples are used)')
+parser.add_argument('--stability', type=float, default=None,
+                    help='with --tol, also stop once at most this fraction of the '
+                         'nodes changed their label in the last round of samples')
+parser.add_argument('--multi', action='store_true',
+                    help='write the potentials of all labels and the segmentation '
+                         '(instead of only the potential of label 1)')
+parser.add_argument('-j', type=int, default=None,
+                    help='number of worker processes (default: all cores)')
+args = parser.parse_args()
+
+for name in args.names:
+    print(f"Karger for {name}")
+    graph_path = "results/graphs/" + name + ".h5"
+    result_path = "results/karger_potentials/" + name + ".h5"
+    # the samples don't depend on the number of workers, so -j isn't part of the key
+    params = {"N": args.N, "seed": 0, "multi": args.multi}
+    if args.tol is not None:
+        params.update(tol=args.tol, stability=args.stability)
+    key = cache.key("karger", [graph_path], **params)
+    if cache.fetch(result_path, key):
+        print(f"{result_path} is up to date")
+        continue
+
+    n, edges, weights, seeds, _ = storage.read_graph(graph_path)
+
+    if args.tol is None:
+        pots = karger_potential(n, edges, weights, seeds, args.N, n_jobs=args.j)
+    else:
+        pots, info = karger_potential_adaptive(
+            n, edges, weights, seeds, tol=args.tol, stability=args.stability,
+            max_samples=args.N, n_jobs=args.j)
+        print("{} samples, standard error {:.4f}".format(info["samples"],
+                                                         info["standard_error"]))
+
+    # the result file contains (or references) the graph as well, just
+    # like the one written by julia/calculate_potential.jl
+    storage.start_result(result_path, graph_path)
+    storage.write_potentials(result_path, pots, multi=args.multi)
+    if args.tol is not None:
+        with h5py.File(result_path, "a") as f:
+            f.attrs["samples"] = info["samples"]
+            f.attrs["standard_error"] = info["standard_error"]
+    cache.store(result_path, key)
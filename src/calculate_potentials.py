@@ -0,0 +1,232 @@
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import h5py
+from python.random_walker import random_walker
+import numpy as np
+from python.karger import (karger_potential, karger_potential_adaptive, watershed,
+                           power_watershed)
+from python.reduction import reduce_graph
+from python import cache, storage, telemetry
+
+# directory inside results/ for each method
+RESULT_DIRS = {
+    "rw": "rw_potentials",
+    "karger": "karger_potentials",
+    "watershed": "watershed",
+    "power_watershed": "power_watershed",
+}
+
+
+def quantize_weights(weights):
+    """Discretize the weights to 8 bit, exactly like
+    julia/calculate_power_watershed_multi.jl does."""
+    # the minimum of the original weights is added after the normalization
+    low = weights.min()
+    weights = weights / (weights.max() - low) + low
+    return np.round(weights * 255)
+
+
+def read_graph(path):
+    with telemetry.stage("load"):
+        return storage.read_graph(path)
+
+
+def write_potentials(path, pots):
+    """Write potentials like calculate_rw_potential.py (for two labels)
+    or calculate_all_rw_potentials.py (for more labels)."""
+    with telemetry.stage("write"):
+        storage.write_potentials(path, pots)
+
+
+def reduce(method, n, edges, weights, seeds, shape):
+    """Reduce the graph for method (see python/reduction.py), returns the
+    reduced graph and the reduction, to expand the results with."""
+    with telemetry.stage("graph_reduction", nodes=n):
+        # series elimination is only exact for the random walker, and the
+        # watershed only depends on the strongest of parallel edges
+        reduction = reduce_graph(n, edges, weights, seeds, series=method == "rw",
+                                 combine="max" if method == "watershed" else "sum")
+    # the reduced graph is no longer a grid
+    return (reduction.n, reduction.edges, reduction.weights, reduction.seeds,
+            None), reduction
+
+
+def run(method, graph_path, result_path, karger_runs, karger_tol=None, profile=None,
+        reduction=False):
+    """Run method on one graph, returns False if the result was up to date.
+
+    If profile is the name of the graph, the run is recorded with
+    telemetry and (result, records) is returned instead. With reduction,
+    the graph is reduced before solving (except for the power watershed,
+    for which the reduction isn't exact).
+    """
+    if profile is None:
+        return _run(method, graph_path, result_path, karger_runs, karger_tol, reduction)
+    with telemetry.Recorder(graph=profile, method=method) as recorder:
+        with telemetry.stage("total"):
+            result = _run(method, graph_path, result_path, karger_runs, karger_tol,
+                          reduction)
+    return result, recorder.records
+
+
+def _run(method, graph_path, result_path, karger_runs, karger_tol, reduction):
+    params = {"N": karger_runs, "seed": 0} if method == "karger" else {}
+    if method == "karger" and karger_tol is not None:
+        params["tol"] = karger_tol
+    reduction = reduction and method != "power_watershed"
+    if reduction:
+        # Karger draws different samples on the reduced graph
+        params["reduced"] = True
+    key = cache.key(method, [graph_path], **params)
+    if cache.fetch(result_path, key):
+        return False
+
+    n, edges, weights, seeds, shape = read_graph(graph_path)
+    os.makedirs(os.path.dirname(result_path), exist_ok=True)
+    if reduction:
+        (n, edges, weights, seeds, shape), reduction = reduce(
+            method, n, edges, weights, seeds, shape)
+
+    def expand(values):
+        return reduction.expand(values) if reduction else values
+
+    if method == "rw":
+        mode = "bf" if seeds.max() <= 2 else "factorized"
+        pots = expand(random_walker(n, edges, weights, seeds, mode=mode, shape=shape))
+        # Remove the hdf5 file if it exists, to avoid errors from h5py
+        try:
+            os.remove(result_path)
+        except OSError:
+            pass
+        write_potentials(result_path, pots)
+        cache.store(result_path, key)
+        return True
+
+    # the Karger and watershed results contain (or reference) the graph
+    # as well, just like the ones written by the Julia scripts
+    storage.start_result(result_path, graph_path)
+    if method == "karger":
+        # we already run one graph per worker, so no nested pool
+        with telemetry.stage("karger", samples=karger_runs, tol=karger_tol):
+            if karger_tol is None:
+                pots = karger_potential(n, edges, weights, seeds, karger_runs, n_jobs=1)
+            else:
+                pots, info = karger_potential_adaptive(
+                    n, edges, weights, seeds, tol=karger_tol, max_samples=karger_runs,
+                    n_jobs=1)
+        pots = expand(pots)
+        write_potentials(result_path, pots)
+        if karger_tol is not None:
+            # the number of samples that were actually used and the error bar
+            with h5py.File(result_path, "a") as f:
+                f.attrs["samples"] = info["samples"]
+                f.attrs["standard_error"] = info["standard_error"]
+    elif method == "power_watershed":
+        if seeds.max() > 2:
+            # like julia/calculate_power_watershed_multi.jl
+            with telemetry.stage("power_watershed"):
+                pots = power_watershed(n, edges, quantize_weights(weights), seeds)
+            write_potentials(result_path, pots)
+        else:
+            # like julia/calculate_power_watershed.jl, the potential is the
+            # one of label 2 (0 for seeds of label 1 and 1 for label 2)
+            with telemetry.stage("power_watershed"):
+                pots = power_watershed(n, edges, weights, seeds)
+            write_potentials(result_path, pots[1:])
+    elif method == "watershed":
+        with telemetry.stage("watershed"):
+            segmentation = expand(watershed(n, edges, weights, seeds)).astype(float)
+        with telemetry.stage("write"), h5py.File(result_path, "a") as f:
+            storage.write_labels(f, "potential", segmentation)
+    cache.store(result_path, key)
+    return True
+
+
+def print_profile(records, slowest=10):
+    """Print where the time went, summarized over all graphs."""
+    print("\nstage (method)            count    total [s]      max [s]  peak [MB]")
+    for entry in telemetry.summarize(records, by=("method", "stage")):
+        if entry["stage"] == "cg":
+            print(f"cg ({entry['method']}): {entry['count']} solves, "
+                  f"{entry['iterations']} iterations, "
+                  f"{entry['not_converged']} not converged")
+            continue
+        name = f"{entry['stage']} ({entry['method']})"
+        print(f"{name:<24} {entry['count']:7d} {entry['time']:12.3f} "
+              f"{entry['max_time']:12.3f} {entry.get('peak', 0) / 1e6:10.1f}")
+
+    totals = [entry for entry in telemetry.summarize(records, by=("stage", "method", "graph"))
+              if entry["stage"] == "total"]
+    print("\nslowest graphs:")
+    for entry in totals[:slowest]:
+        print(f"{entry['time']:10.3f}s  {entry['method']}: {entry['graph']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Calculate the potentials of all graphs of a dataset in one process')
+    parser.add_argument('dataset', type=str, metavar='DIR',
+                        help='directory with the graphs, e.g. results/graphs/usps')
+    parser.add_argument('--methods', type=str, nargs='+', default=["rw", "karger", "watershed"],
+                        choices=list(RESULT_DIRS), help='methods to run')
+    parser.add_argument('-j', type=int, default=None,
+                        help='number of worker processes (default: all cores)')
+    parser.add_argument('-N', type=int, default=100,
+                        help='number of samples for Karger (the maximum number with --tol)')
+    parser.add_argument('--tol', type=float, default=None,
+                        help='draw Karger samples until the standard error of all '
+                             'potentials is below this value')
+    parser.add_argument('--watershed-beta', type=str, default="10",
+                        help='the watersheds don\'t depend on beta, so they are only '
+                             'run for the graphs with this beta value')
+    parser.add_argument('--profile', type=str, metavar='PATH',
+                        help='record the time and memory of each stage and the CG '
+                             'iterations and write the records to this JSON file')
+    parser.add_argument('--reduce', action='store_true',
+                        help='reduce the graphs before solving (collapse the seeds, drop '
+                             'components without seeds and eliminate leaves), see '
+                             'python/reduction.py. Not used for the power watershed')
+    args = parser.parse_args()
+
+    # graph files are results/graphs/<dataset>/.../<beta>.h5 and results
+    # are written to results/<method dir>/<dataset>/.../<beta>.h5
+    graphs_root = os.path.dirname(os.path.normpath(args.dataset))
+    results_root = os.path.dirname(graphs_root)
+    tasks = []
+    for root, _, files in os.walk(args.dataset):
+        for file in sorted(files):
+            if not file.endswith(".h5"):
+                continue
+            graph_path = os.path.join(root, file)
+            name = os.path.relpath(graph_path, graphs_root)
+            for method in args.methods:
+                if "watershed" in method and file != args.watershed_beta + ".h5":
+                    continue
+                result_path = os.path.join(results_root, RESULT_DIRS[method], name)
+                tasks.append((method, graph_path, result_path))
+
+    records = []
+    with ProcessPoolExecutor(args.j) as executor:
+        futures = {}
+        for method, graph_path, result_path in tasks:
+            profile = os.path.relpath(graph_path, graphs_root) if args.profile else None
+            future = executor.submit(run, method, graph_path, result_path, args.N, args.tol,
+                                     profile, args.reduce)
+            futures[future] = (method, graph_path, result_path)
+        for i, future in enumerate(as_completed(futures), start=1):
+            method, _, result_path = futures[future]
+            # re-raise exceptions from the workers
+            result = future.result()
+            if args.profile:
+                result, run_records = result
+                records += run_records
+            status = "" if result else " (up to date)"
+            print(f"[{i}/{len(tasks)}] {method}: {result_path}{status}")
+
+    if args.profile:
+        os.makedirs(os.path.dirname(args.profile) or ".", exist_ok=True)
+        with open(args.profile, 'w', encoding='utf-8') as f:
+            json.dump(records, f, indent=4)
+        print_profile(records)
@@ -1,8 +1,8 @@
 import os
+import sys
 import argparse
-import h5py
-import numpy as np
 from python.random_walker import random_walker
+from python import cache, storage
 
 parser = argparse.ArgumentParser(description='Calculate the RW potential of a graph')
 parser.add_argument('path', type=str, metavar='PATH',
@@ -11,11 +11,14 @@ parser.add_argument('-o', type=str, metavar='PATH',
                     help='output file')
 args = parser.parse_args()
 
-with h5py.File(args.path, "r") as f:
-    n, edges, weights = f["n"][()], f["edges"][()], f["weights"][()]
-    seeds = f["seeds"][()]
+key = cache.key("rw", [args.path], mode="bf")
+if cache.fetch(args.o, key):
+    print(f"{args.o} is up to date")
+    sys.exit()
 
-rw_pot = random_walker(n, edges, weights, seeds, mode="bf")
+n, edges, weights, seeds, shape = storage.read_graph(args.path)
+
+rw_pot = random_walker(n, edges, weights, seeds, mode="bf", shape=shape)
 
 os.makedirs(os.path.dirname(args.o), exist_ok=True)
 
@@ -25,5 +28,5 @@ try:
 except OSError:
     pass
 
-with h5py.File(args.o, "w") as f:
-    f.create_dataset("potential", data=rw_pot[0])
+storage.write_potentials(args.o, rw_pot, multi=False)
+cache.store(args.o, key)
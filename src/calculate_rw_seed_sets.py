@@ -0,0 +1,55 @@
+import os
+import argparse
+import h5py
+import numpy as np
+from scipy import sparse
+from python.random_walker import random_walker_seed_sets
+from python import cache, storage
+
+parser = argparse.ArgumentParser(
+    description='Calculate the RW potentials for all seed sets of a graph '
+                '(as written by usps_graph.py --compact)')
+parser.add_argument('path', type=str, metavar='PATH',
+                    help='filename of the graph with seed sets')
+parser.add_argument('-o', type=str, metavar='DIR',
+                    help='output directory, the potentials for each seed set and '
+                         'beta are written to DIR/<seed set>/<beta>.h5')
+parser.add_argument('--betas', type=str, nargs='+',
+                    help='beta values to use (default: all in the file)')
+parser.add_argument('--mode', type=str, default='factorized',
+                    choices=['factorized', 'cg_block'],
+                    help='see random_walker_seed_sets')
+args = parser.parse_args()
+
+with h5py.File(args.path, "r") as f:
+    n, edges = f["n"][()], f["edges"][()].astype(np.int64)
+    names = [name.decode() for name in f["seeds/names"][()]]
+    seed_sets = sparse.csr_matrix(
+        (f["seeds/labels"][()], f["seeds/indices"][()], f["seeds/indptr"][()]),
+        shape=(len(names), n)).toarray()
+    betas = args.betas or [beta.decode() for beta in f["betas"][()]]
+    weights = {beta: f["weights/" + beta][()].astype(np.float64) for beta in betas}
+
+for beta in betas:
+    paths = [os.path.join(args.o, name, beta + ".h5") for name in names]
+    # the file contains the weights for all betas, so the key only
+    # depends on the data actually used for this beta and seed set
+    keys = [cache.key("rw_seed_sets", [edges, weights[beta], seeds], n=int(n),
+                      mode=args.mode)
+            for seeds in seed_sets]
+    if all([cache.fetch(path, key) for path, key in zip(paths, keys)]):
+        print(f"RW for beta {beta} is up to date")
+        continue
+    print(f"RW for all seed sets with beta {beta}")
+    rw_pots = random_walker_seed_sets(n, edges, weights[beta], seed_sets,
+                                      mode=args.mode)
+    for path, key, rw_pot in zip(paths, keys, rw_pots):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Remove the hdf5 file if it exists, to avoid errors from h5py
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+        storage.write_potentials(path, rw_pot, multi=True)
+        cache.store(path, key)
@@ -1,29 +1,20 @@
 import os
 import json
-import h5py
+import argparse
+from multiprocessing import Pool
 import numpy as np
 import skimage.io
-from sklearn import metrics
+from python import cache, storage
+from python.metrics import SCORES, contingency_tables, scores, RunningMean
 
-
-def entropy(x):
-    p1 = np.sum(x) / len(x)
-    p = np.array([p1, 1 - p1])
-    return -np.sum(p * np.log(p))
-
-
-def VOI(x, y):
-    return entropy(x) + entropy(y) - 2 * metrics.mutual_info_score(x, y)
-
-
-scores = {
-    "RAI": metrics.adjusted_rand_score,
-    "accuracy": (lambda x, y: np.sum(x == y) / len(x)),
-    "VOI": VOI
-    }
-
-methods = ["karger", "RW", "watershed", "power_watershed"]
-data = {method: {score: [] for score in scores} for method in methods}
+# directory inside results/ and a function turning the result file into
+# a binary segmentation for each method
+methods = {
+    "karger": ("karger_potentials", lambda f: f["potential"][:] < 0.5),
+    "RW": ("rw_potentials", lambda f: f["potential"][:] < 0.5),
+    "watershed": ("watershed", lambda f: f["potential"][:] - 1),
+    "power_watershed": ("power_watershed", lambda f: f["potential"][:] < 0.5),
+}
 betas = {
     "karger": 10,
     "RW": 20,
@@ -31,28 +22,85 @@ betas = {
     "power_watershed": 10,
 }
 
-segmentations = {}
-
-for path in (f.name for f in os.scandir("results/karger_potentials/grabcut") if f.is_dir()):
-    gt = (skimage.io.imread("data/ground_truth/" + path + ".bmp", as_gray=True).ravel() > 0)
-    with h5py.File("results/karger_potentials/grabcut/" + path + "/" + str(betas["karger"]) + ".h5", "r") as f:
-        segmentations["karger"] = (f["potential"][:] < 0.5).ravel()
-        seeds = f["seeds"][()]
-    with h5py.File("results/rw_potentials/grabcut/" + path + "/" + str(betas["RW"]) + ".h5", "r") as f:
-        segmentations["RW"] = (f["potential"][:] < 0.5).ravel()
-    with h5py.File("results/watershed/grabcut/" + path + "/" + str(betas["watershed"]) + ".h5", "r") as f:
-        segmentations["watershed"] = (f["potential"][:] - 1).ravel()
-    with h5py.File("results/power_watershed/grabcut/" + path + "/" + str(betas["power_watershed"]) + ".h5", "r") as f:
-        segmentations["power_watershed"] = (f["potential"][:] < 0.5).ravel()
-
-    mask = (seeds == 0)
-    for method, seg in segmentations.items():
-        for score, func in scores.items():
-            data[method][score].append(func(seg[mask], gt[mask]))
-
-N = 49
-error = {k: {k_: np.std(v_)/np.sqrt(N) for k_, v_ in v.items()} for k, v in data.items()}
-data = {k: {k_: np.mean(v_) for k_, v_ in v.items()} for k, v in data.items()}
-
-with open('results/grabcut.json', 'w', encoding='utf-8') as f:
-    json.dump({"data": data, "errors": error}, f, ensure_ascii=False, indent=4)
+
+def result_file(method, path, beta):
+    return f"results/{methods[method][0]}/grabcut/{path}/{beta}.h5"
+
+
+def evaluate(task):
+    """Scores of all (method, beta) runs for one image.
+
+    Returns a dict mapping (method, beta) to a dict of scores. Runs whose
+    results don't exist are left out.
+    """
+    path, runs = task
+    gt_file = "data/ground_truth/" + path + ".bmp"
+    runs = [(method, beta) for method, beta in runs
+            if os.path.exists(result_file(method, path, beta))]
+    # the seeds are the same for all betas
+    seeds_files = [f"results/graphs/grabcut/{path}/{beta}.h5" for _, beta in runs]
+    seeds_file = next((f for f in seeds_files if os.path.exists(f)), None)
+    if seeds_file is None:
+        return {}
+    keys = [cache.key("grabcut_metrics", [result_file(method, path, beta), seeds_file, gt_file])
+            for method, beta in runs]
+
+    def compute():
+        gt = (skimage.io.imread(gt_file, as_gray=True).ravel() > 0)
+        with storage.File(seeds_file) as f:
+            mask = (f["seeds"][()] == 0)
+        segmentations = []
+        for method, beta in runs:
+            with storage.File(result_file(method, path, beta)) as f:
+                segmentations.append(methods[method][1](f).ravel()[mask])
+        values = scores(contingency_tables(gt[mask], segmentations))
+        return [{score: float(values[score][i]) for score in SCORES}
+                for i in range(len(runs))]
+
+    # all runs of an image are computed in one go, but cached separately,
+    # so that changing one beta or method doesn't invalidate the others
+    return dict(zip(runs, cache.memoize_all(keys, compute)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Calculate the metrics for the Grabcut dataset')
+    parser.add_argument('--betas', type=str, nargs='+',
+                        help='evaluate all methods for all of these beta values '
+                             '(default: only the optimal beta of each method)')
+    parser.add_argument('-j', type=int, default=None,
+                        help='number of worker processes (default: all cores)')
+    parser.add_argument('-o', type=str, default=None, metavar='PATH',
+                        help='output file (default: results/grabcut.json, or '
+                             'results/grabcut_betas.json with --betas)')
+    args = parser.parse_args()
+
+    if args.betas:
+        runs = [(method, beta) for method in methods for beta in args.betas]
+        output = args.o or 'results/grabcut_betas.json'
+    else:
+        runs = [(method, str(beta)) for method, beta in betas.items()]
+        output = args.o or 'results/grabcut.json'
+
+    paths = [f.name for f in os.scandir("results/karger_potentials/grabcut") if f.is_dir()]
+    stats = {run: RunningMean() for run in runs}
+    # the images are spread over the workers, and the means are
+    # updated as soon as the scores of an image are there
+    with Pool(args.j) as pool:
+        for result in pool.imap_unordered(evaluate, [(path, runs) for path in paths]):
+            for run, values in result.items():
+                stats[run].add(np.array([values[score] for score in SCORES]))
+
+    data, error = {}, {}
+    for (method, beta), stat in stats.items():
+        if stat.count == 0:
+            continue
+        mean = dict(zip(SCORES, stat.mean.tolist()))
+        se = dict(zip(SCORES, stat.standard_error.tolist()))
+        if args.betas:
+            data.setdefault(method, {})[beta] = mean
+            error.setdefault(method, {})[beta] = se
+        else:
+            data[method], error[method] = mean, se
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({"data": data, "errors": error}, f, ensure_ascii=False, indent=4)
@@ -1,9 +1,9 @@
-import os
+import sys
 import argparse
-import h5py
 import skimage.io
 import numpy as np
-from python.image import graph_from_hed
+from python.image import graph_from_hed_betas
+from python import cache, storage
 
 parser = argparse.ArgumentParser(description='Convert images into graphs')
 parser.add_argument('path', type=str, metavar='PATH',
@@ -13,11 +13,40 @@ parser.add_argument('--hed', type=str, metavar='PATH',
 parser.add_argument('-s', type=str, metavar='PATH',
                     help='filename of the seeds image')
 parser.add_argument('-o', type=str, metavar='PATH',
-                    help='output file')
+                    help='output file. If several betas are given and it contains '
+                         '{beta}, one graph per beta is written (with {beta} '
+                         'replaced by the beta value), otherwise a single file '
+                         'with one weights/<beta> dataset per beta')
 parser.add_argument('--beta', type=float, default=130,
                     help='beta parameter for the weights')
+parser.add_argument('--betas', type=str,
+                    help='list of beta values to compute the weights for, '
+                         'e.g. "0 1 2" (overrides --beta)')
 args = parser.parse_args()
 
+sweep = args.betas is not None
+if sweep:
+    betas = args.betas.split()
+else:
+    betas = [args.beta]
+
+# the outputs with their betas, if several betas are written to one
+# file, they are all computed again whenever one of them changes
+inputs = [args.path, args.hed, args.s]
+if not sweep or "{beta}" in args.o:
+    outputs = {(args.o.format(beta=beta) if sweep else args.o): [beta]
+               for beta in betas}
+else:
+    outputs = {args.o: betas}
+keys = {path: cache.key("graph", inputs, betas=[float(beta) for beta in output_betas])
+        for path, output_betas in outputs.items()}
+outputs = {path: output_betas for path, output_betas in outputs.items()
+           if not cache.fetch(path, keys[path])}
+betas = [beta for output_betas in outputs.values() for beta in output_betas]
+if not betas:
+    print(f"Graphs for {args.path} are up to date")
+    sys.exit()
+
 image = skimage.io.imread(args.path).astype(float)
 image /= image.max()
 hed = skimage.io.imread(args.hed).astype(float)
@@ -25,18 +54,17 @@ hed /= hed.max()
 seeds = skimage.io.imread(args.s, as_gray=True)
 seeds = np.digitize(seeds, np.array([0.01, 0.4]))
 
-n, edges, weights = graph_from_hed(hed, beta=args.beta)
-
-os.makedirs(os.path.dirname(args.o), exist_ok=True)
-# Remove the hdf5 file if it exists, to avoid errors from h5py
-try:
-    os.remove(args.o)
-except OSError:
-    pass
-
-with h5py.File(args.o, "w") as f:
-    f.create_dataset("image", data=image)
-    f.create_dataset("n", data=n)
-    f.create_dataset("edges", data=edges)
-    f.create_dataset("weights", data=weights)
-    f.create_dataset("seeds", data=seeds.ravel())
+n, edges, weights = graph_from_hed_betas(hed, [float(beta) for beta in betas])
+
+
+def write_graph(path, weights):
+    storage.write_graph(path, n, edges, weights, seeds, image=image)
+    cache.store(path, keys[path])
+
+
+weights = dict(zip(betas, weights))
+for path, output_betas in outputs.items():
+    if not sweep or "{beta}" in args.o:
+        write_graph(path, weights[output_betas[0]])
+    else:
+        write_graph(path, {beta: weights[beta] for beta in output_betas})
@@ -1,10 +1,13 @@
 using HDF5
 using Random
 include("./karger.jl")
+include("./storage.jl")
 using .Karger
 
-# USAGE: julia src/julia/calculate_potential.jl filename N
+# USAGE: julia src/julia/calculate_potential.jl filename N [tol]
 # where N is the number of samples to use and filename just the name (without path or .h5).
+# If tol is given, samples are drawn until the standard error of all potentials is
+# below tol, using at most N samples.
 # The file has to be an HDF5 file with fields n, edges, weights and seeds. The output
 # will be written in a file with the same name in the "potentials" directory
 
@@ -13,11 +16,19 @@ Random.seed!(0)
 graph_path = "results/graphs/" * ARGS[1] * ".h5"
 result_path = "results/karger_potentials/" * ARGS[1] * ".h5"
 
-n = h5read(graph_path, "n")
-edges = h5read(graph_path, "edges")
-weights = h5read(graph_path, "weights")
-seeds = h5read(graph_path, "seeds")
+n, edges, weights, seeds = read_graph(graph_path)
 g = Graph(n, transpose(edges) .+ 1, weights)
-mkpath(dirname(result_path))
-cp(graph_path, result_path, force=true)
-h5write(result_path, "potential", potential(g, parse(Int, ARGS[2]), seeds)[1])
+start_result(graph_path, result_path)
+if length(ARGS) > 2
+    pots, N, se = potential_adaptive(g, parse(Int, ARGS[2]), seeds, parse(Float64, ARGS[3]))
+    println("$N samples, standard error $se")
+else
+    pots = potential(g, parse(Int, ARGS[2]), seeds)
+end
+h5write(result_path, "potential", pots[1])
+if length(ARGS) > 2
+    h5open(result_path, "r+") do f
+        attributes(f)["samples"] = N
+        attributes(f)["standard_error"] = se
+    end
+end
@@ -1,5 +1,6 @@
 using HDF5
 include("./karger.jl")
+include("./storage.jl")
 using .Karger
 
 # USAGE: julia src/julia/calculate_power_watershed.jl filename
@@ -10,11 +11,7 @@ using .Karger
 graph_path = "results/graphs/" * ARGS[1] * ".h5"
 result_path = "results/power_watershed/" * ARGS[1] * ".h5"
 
-n = h5read(graph_path, "n")
-edges = h5read(graph_path, "edges")
-weights = h5read(graph_path, "weights")
-seeds = h5read(graph_path, "seeds")
+n, edges, weights, seeds = read_graph(graph_path)
 g = Graph(n, transpose(edges) .+ 1, weights)
-mkpath(dirname(result_path))
-cp(graph_path, result_path, force=true)
+start_result(graph_path, result_path)
 h5write(result_path, "potential", power_watershed(g, seeds))
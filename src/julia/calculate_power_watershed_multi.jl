@@ -1,5 +1,6 @@
 using HDF5
 include("./karger.jl")
+include("./storage.jl")
 using .Karger
 
 # USAGE: julia src/julia/calculate_power_watershed.jl filename
@@ -10,9 +11,7 @@ using .Karger
 graph_path = "results/graphs/" * ARGS[1] * ".h5"
 result_path = "results/power_watershed/" * ARGS[1] * ".h5"
 
-n = h5read(graph_path, "n")
-edges = h5read(graph_path, "edges")
-weights = h5read(graph_path, "weights")
+n, edges, weights, seeds = read_graph(graph_path)
 min_weight = minimum(weights)
 max_weight = maximum(weights)
 # normalize weights to range [0, 1]
@@ -22,10 +21,8 @@ weights .+= min_weight
 weights .*= 255
 weights .= round.(weights)
 
-seeds = h5read(graph_path, "seeds")
 g = Graph(n, transpose(edges) .+ 1, weights)
-mkpath(dirname(result_path))
-cp(graph_path, result_path, force=true)
+start_result(graph_path, result_path)
 
 pots = power_watershed_multi(g, seeds)
 segmentation = Vector{Int}(undef, n)
@@ -101,6 +101,36 @@ function potential(g :: Graph, N :: Int, seeds :: Vector{Int})
     return Dict(seed => sum(probs[seed], dims=2) for seed in sd.seed_list)
 end
 
+function potential_adaptive(g :: Graph, max_N :: Int, seeds :: Vector{Int}, tol :: Float64; batch :: Int = 32)
+    # Like potential, but samples in batches until the standard error of
+    # the potentials is below tol for all nodes, or max_N samples are used.
+    # Each potential is the mean of N Bernoulli samples, so its standard
+    # error is sqrt(p(1 - p)/N). Returns the potentials, the number of
+    # samples and the largest standard error.
+    sd = init_seeds(seeds)
+    counts = Dict(seed => zeros(Int, g.n, nthreads()) for seed in sd.seed_list)
+    scores = [Vector{Float64}(undef, size(g.edges, 2)) for i in 1:nthreads()]
+    N = 0
+    se = Inf
+    probs = Dict{Int, Matrix{Float64}}()
+    while N < max_N
+        samples = min(batch, max_N - N)
+        @threads for i in 1:samples
+            uf = karger_initialized!(g, seeds, sd, scores[threadid()])
+            for j in 1:g.n
+                counts[seeds[find(uf, j)]][j, threadid()] += 1
+            end
+        end
+        N += samples
+        probs = Dict(seed => sum(counts[seed], dims=2) ./ N for seed in sd.seed_list)
+        se = maximum(maximum(sqrt.(p .* (1 .- p) ./ N)) for p in values(probs))
+        if se <= tol
+            break
+        end
+    end
+    return probs, N, se
+end
+
 function watershed(g :: Graph, seeds :: Vector{Int})
     m = size(g.edges, 2)
     sd = init_seeds(seeds)
@@ -581,5 +611,5 @@ function power_watershed_multi(g :: Graph, seeds :: Vector{Int})
     return Dict(seed => potentials[:, seed] for seed in seed_list)
 end
 
-export Graph, karger, sample_cuts, potential, watershed, power_watershed, power_watershed_multi
+export Graph, karger, sample_cuts, potential, potential_adaptive, watershed, power_watershed, power_watershed_multi
 end
@@ -0,0 +1,35 @@
+using HDF5
+
+# Reading graph files and creating result files in both layouts,
+# see src/python/storage.py for a description of the compact one.
+
+compact() = get(ENV, "COMPACT_STORAGE", "0") ∉ ("", "0")
+
+function read_graph(path)
+    h5open(path, "r") do f
+        n = read(f, "n")
+        # edges are int32 and weights may be float32 in the compact layout
+        edges = Int.(read(f, "edges"))
+        weights = Float64.(read(f, "weights"))
+        if f["seeds"] isa HDF5.Group
+            # sparse seeds, node indices start at 0
+            seeds = zeros(Int, n)
+            seeds[read(f, "seeds/nodes") .+ 1] .= read(f, "seeds/labels")
+        else
+            seeds = read(f, "seeds")
+        end
+        return n, edges, weights, seeds
+    end
+end
+
+function start_result(graph_path, result_path)
+    # result files contain the graph, or reference it in the compact layout
+    mkpath(dirname(result_path))
+    if compact()
+        h5open(result_path, "w") do f
+            attributes(f)["graph"] = relpath(graph_path, dirname(abspath(result_path)))
+        end
+    else
+        cp(graph_path, result_path, force=true)
+    end
+end
@@ -0,0 +1,192 @@
+"""
+Content-addressed cache for the results of the pipeline.
+
+Every artifact (a graph, potentials, metric values) gets a key, which is a
+hash of the contents of its input files and of all parameters that
+influence it (beta, mode, number of Karger runs, ...). HDF5 outputs carry
+their key in the "cache_key" attribute, so a stage can check whether its
+output is still valid and skip the work if it is. Copies of all artifacts
+are kept in results/.cache/, so that going back to earlier parameters
+(e.g. a beta value that was removed and added again) only copies the old
+result back instead of recomputing it.
+
+The cache is limited to CACHE_SIZE gigabytes (environment variable,
+default 10), the least recently used artifacts are evicted first.
+Setting NO_CACHE=1 recomputes everything.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+
+import h5py
+import numpy as np
+
+CACHE_DIR = os.path.join("results", ".cache")
+ATTRIBUTE = "cache_key"
+
+
+def enabled():
+    return os.environ.get("NO_CACHE", "0") in ("", "0")
+
+
+def max_size():
+    """Maximum size of the cache in bytes."""
+    return float(os.environ.get("CACHE_SIZE", 10)) * 1e9
+
+
+# digests of files that have already been hashed by this process
+_digests = {}
+
+
+def digest(path):
+    """Hash of the contents of a file."""
+    stat = os.stat(path)
+    file_id = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if file_id not in _digests:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        _digests[file_id] = h.hexdigest()
+    return _digests[file_id]
+
+
+def key(stage, inputs=(), **params):
+    """Key of an artifact of the given stage.
+
+    inputs are the filenames of the input files, whose contents are hashed,
+    or arrays. params are all parameters of the stage, they need to be
+    serializable as JSON.
+    """
+    h = hashlib.sha256(stage.encode())
+    for x in inputs:
+        if isinstance(x, np.ndarray):
+            h.update(str((x.dtype, x.shape)).encode())
+            h.update(np.ascontiguousarray(x).tobytes())
+        else:
+            h.update(digest(x).encode())
+    h.update(json.dumps(params, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def _entry(key, extension=".h5"):
+    return os.path.join(CACHE_DIR, key[:2], key + extension)
+
+
+def _touch(path):
+    # the modification time is used to find the least recently used entries
+    os.utime(path)
+
+
+def valid(path, key):
+    """Whether path is an HDF5 file that was written for this key."""
+    try:
+        with h5py.File(path, "r") as f:
+            return f.attrs.get(ATTRIBUTE) == key
+    except OSError:
+        return False
+
+
+def fetch(path, key):
+    """Make sure path contains the artifact with the given key if possible.
+
+    Returns True if path is already valid or could be restored from the
+    cache (in which case the stage can be skipped), False otherwise.
+    """
+    if not enabled():
+        return False
+    entry = _entry(key)
+    if valid(path, key):
+        if os.path.exists(entry):
+            _touch(entry)
+        return True
+    if not os.path.exists(entry):
+        return False
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    shutil.copyfile(entry, path)
+    _touch(entry)
+    return True
+
+
+def store(path, key):
+    """Mark the HDF5 file at path as the artifact with the given key and
+    add a copy to the cache."""
+    with h5py.File(path, "a") as f:
+        f.attrs[ATTRIBUTE] = key
+    if not enabled():
+        return
+    entry = _entry(key)
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    # write to a temporary file first, so that parallel processes never
+    # see an incomplete entry
+    tmp = entry + ".tmp" + str(os.getpid())
+    shutil.copyfile(path, tmp)
+    os.replace(tmp, entry)
+    evict()
+
+
+def _load(entry):
+    """The value cached at entry. Raises FileNotFoundError if there is none,
+    which can also happen if another process evicted it just now."""
+    _touch(entry)
+    with open(entry, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _dump(entry, value):
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = entry + ".tmp" + str(os.getpid())
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(value, f)
+    os.replace(tmp, entry)
+
+
+def memoize(key, func):
+    """Return func(), with the result cached under key.
+
+    For small results like metric values, which have to be JSON serializable.
+    """
+    return memoize_all([key], lambda: [func()])[0]
+
+
+def memoize_all(keys, func):
+    """Like memoize, for a func that returns a list with the values for
+    all keys at once. func is only called if any of them isn't cached."""
+    entries = [_entry(key, ".json") for key in keys]
+    if enabled():
+        try:
+            return [_load(entry) for entry in entries]
+        except FileNotFoundError:
+            pass
+    values = list(func())
+    if enabled():
+        for entry, value in zip(entries, values):
+            _dump(entry, value)
+    return values
+
+
+def evict():
+    """Remove the least recently used entries until the cache fits into
+    max_size()."""
+    entries = []
+    for root, _, files in os.walk(CACHE_DIR):
+        for file in files:
+            path = os.path.join(root, file)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # removed by another process in the meantime
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    limit = max_size()
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
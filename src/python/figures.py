@@ -0,0 +1,228 @@
+"""
+Potential and segmentation figures of the Grabcut images (see
+render_figures.py, plot_potentials.py and plot_segmentation.py).
+
+The figures are drawn on matplotlib's Agg canvas without pyplot, so they
+don't need a display. Building a figure (subplots, titles, colorbar) takes
+much longer than drawing it, so PotentialFigure and SegmentationFigure
+build it once and render each image by replacing the data of the images
+and the contours only. The layout is only recomputed when the shape of
+the image changes.
+
+Each PNG carries a hash of its inputs in its metadata (like the results
+in cache.py), so that figures whose inputs haven't changed are skipped.
+"""
+
+import os
+
+import numpy as np
+import skimage.io
+from matplotlib import rc_context, rcParams
+from matplotlib.artist import Artist
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image
+
+from . import cache, storage
+
+# PNG metadata key of the hash of the inputs of a figure
+METADATA_KEY = "cache_key"
+
+SUBPLOT_PARAMS = ("left", "bottom", "right", "top", "wspace", "hspace")
+
+
+def up_to_date(path, key):
+    """Whether the figure at path was rendered for this key."""
+    if not cache.enabled():
+        return False
+    try:
+        with Image.open(path) as image:
+            return image.text.get(METADATA_KEY) == key
+    except OSError:
+        return False
+
+
+def _remove_contour(contour):
+    # a ContourSet is a single artist since matplotlib 3.8, before that
+    # each level is a separate collection
+    if isinstance(contour, Artist):
+        contour.remove()
+    else:
+        for collection in contour.collections:
+            collection.remove()
+
+
+class _Figure:
+    """Figure with a fixed layout, whose images and contours are replaced
+    for each rendered image."""
+
+    font_size = None
+
+    def __init__(self, figsize):
+        self.figure = Figure(figsize=figsize)
+        FigureCanvasAgg(self.figure)
+        self.shape = None
+        self.contours = {}
+
+    def _image(self, ax, title, **kwargs):
+        ax.axis("off")
+        ax.set_title(title)
+        return ax.imshow(np.zeros((1, 1)), interpolation="none", **kwargs)
+
+    def _set_image(self, image, data):
+        h, w = data.shape[:2]
+        image.set_data(data)
+        image.set_extent((-0.5, w - 0.5, h - 0.5, -0.5))
+        # the limits of a new figure, independent of the images before
+        image.axes.set_xlim(-0.5, w - 0.5)
+        image.axes.set_ylim(h - 0.5, -0.5)
+
+    def _set_contour(self, ax, data, level):
+        if ax in self.contours:
+            _remove_contour(self.contours[ax])
+        self.contours[ax] = ax.contour(data, levels=np.array([level]), colors="lime",
+                                       linewidths=3)
+
+    def _layout(self):
+        self.figure.tight_layout()
+
+    def _relayout(self):
+        # tight_layout depends on the layout it starts from (because of the
+        # fixed aspect ratio of the images), so start from that of a new
+        # figure, which is what the figures have always been rendered with
+        self.figure.subplots_adjust(**{name: rcParams["figure.subplot." + name]
+                                       for name in SUBPLOT_PARAMS})
+        self._layout()
+
+    def render(self, data, path, key=None):
+        """Draw the figure for data (as returned by the load function of the
+        figure) and save it to path, with the key in its metadata."""
+        with rc_context({'font.size': self.font_size}):
+            self.update(*data)
+            shape = data[0].shape
+            if shape != self.shape:
+                self._relayout()
+                self.shape = shape
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.figure.savefig(path, metadata={METADATA_KEY: key} if key else None)
+
+
+def potential_inputs(karger, rw, watershed, betas):
+    """Files that the potential figure of an image is made from."""
+    return ([karger + "/" + beta + ".h5" for beta in betas]
+            + [rw + "/" + beta + ".h5" for beta in betas]
+            + [watershed + "/10.h5"])
+
+
+def load_potentials(karger, rw, watershed, betas):
+    """Image, seeds, Karger and RW potentials (for each beta) and watershed
+    segmentation of an image, from the result directories of the image."""
+    karger_pots, rw_pots = [], []
+    for beta in betas:
+        with storage.File(karger + "/" + beta + ".h5") as f:
+            karger_pots.append(f["potential"][()])
+            if len(karger_pots) == 1:
+                image = f["image"][()]
+                seeds = f["seeds"][()].reshape(image.shape[:2])
+        with storage.File(rw + "/" + beta + ".h5") as f:
+            rw_pots.append(f["potential"][()])
+    with storage.File(watershed + "/10.h5") as f:
+        watershed_seg = f["potential"][()]
+    return image, seeds, karger_pots, rw_pots, watershed_seg
+
+
+class PotentialFigure(_Figure):
+    """Karger and RW potentials for several betas, the watershed and the
+    seeds of an image."""
+
+    font_size = 22
+
+    def __init__(self, betas):
+        self.betas = betas
+        with rc_context({'font.size': self.font_size}):
+            super().__init__((5 * len(betas), 8))
+            columns = len(betas) + 1
+            self.karger, self.rw = [], []
+            for i, beta in enumerate(betas):
+                ax = self.figure.add_subplot(2, columns, i + 1)
+                self.karger.append(self._image(ax, "Karger, β = " + beta, cmap="bwr_r",
+                                               vmin=0, vmax=1))
+                ax = self.figure.add_subplot(2, columns, i + 2 + len(betas))
+                self.rw.append(self._image(ax, "RW, β = " + beta, cmap="bwr_r",
+                                           vmin=0, vmax=1))
+            ax = self.figure.add_subplot(2, columns, columns)
+            self.watershed = self._image(ax, "Watershed (RW/\n Karger with $\\beta \\to \\infty$)",
+                                         cmap="bwr_r", vmin=0, vmax=1)
+            ax = self.figure.add_subplot(2, columns, 2 * columns)
+            self.image = self._image(ax, "Seeds")
+            self.seeds = ax.imshow(np.ma.masked_all((1, 1)), interpolation="none",
+                                   cmap="bwr_r")
+            cbar_ax = self.figure.add_axes([0.94, 0.14, 0.02, 0.72])
+            self.figure.colorbar(self.watershed, cax=cbar_ax)
+
+    def update(self, image, seeds, karger_pots, rw_pots, watershed):
+        shape = image.shape[:2]
+        for artist, pot in zip(self.karger, karger_pots):
+            self._set_image(artist, pot.reshape(shape))
+        for artist, pot in zip(self.rw, rw_pots):
+            self._set_image(artist, pot.reshape(shape))
+        self._set_image(self.watershed, 2 - watershed.reshape(shape))
+        self._set_image(self.image, image)
+        self._set_image(self.seeds, -np.ma.masked_where(seeds == 0, seeds))
+        # the colors of the seeds are scaled to their labels, like imshow does
+        self.seeds.autoscale()
+
+    def _layout(self):
+        self.figure.tight_layout(rect=[0, 0, 0.9, 1])
+
+
+def segmentation_inputs(karger, rw, watershed, pw, hed):
+    """Files that the segmentation figure of an image is made from."""
+    return [karger + ".h5", rw + ".h5", watershed + ".h5", pw + ".h5", hed]
+
+
+def load_segmentations(karger, rw, watershed, pw, hed):
+    """Image, seeds, HED edges, Karger, RW and power watershed potentials
+    and watershed segmentation of an image (the result files without .h5)."""
+    with storage.File(karger + ".h5") as f:
+        karger_pot = f["potential"][()]
+        image = f["image"][()]
+        seeds = f["seeds"][()].reshape(image.shape[:2])
+    with storage.File(rw + ".h5") as f:
+        rw_pot = f["potential"][()]
+    with storage.File(pw + ".h5") as f:
+        pw_pot = f["potential"][()]
+    with storage.File(watershed + ".h5") as f:
+        watershed_seg = f["potential"][()]
+    hed = skimage.io.imread(hed, as_gray=True)
+    return image, seeds, hed, karger_pot, rw_pot, pw_pot, watershed_seg
+
+
+class SegmentationFigure(_Figure):
+    """An image with its seeds, HED edges and the segmentations of all
+    methods."""
+
+    font_size = 14
+
+    def __init__(self):
+        with rc_context({'font.size': self.font_size}):
+            super().__init__((15, 2.7))
+            axes = [self.figure.add_subplot(1, 6, i + 1) for i in range(6)]
+            titles = ["Seeds", "Edges (HED)", "Karger", "RW", "PW", "Watershed"]
+            self.images = [self._image(ax, title) for ax, title in zip(axes, titles)]
+            self.seeds = axes[0].imshow(np.ma.masked_all((1, 1)), interpolation="none",
+                                        cmap="gray")
+            self.hed = axes[1].imshow(np.zeros((1, 1)), interpolation="none", cmap="gray")
+            self.axes = axes
+
+    def update(self, image, seeds, hed, karger_pot, rw_pot, pw_pot, watershed):
+        shape = image.shape[:2]
+        for artist in self.images:
+            self._set_image(artist, image)
+        self._set_image(self.seeds, np.ma.masked_where(seeds == 0, seeds))
+        self.seeds.autoscale()
+        self._set_image(self.hed, hed)
+        self.hed.autoscale()
+        for ax, pot in zip(self.axes[2:5], [karger_pot, rw_pot, pw_pot]):
+            self._set_contour(ax, pot.reshape(shape) > 0.5, 0.5)
+        self._set_contour(self.axes[5], watershed.reshape(shape), 1.5)
@@ -37,19 +37,50 @@ IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 POSSIBILITY OF SUCH DAMAGE.
 """
 
-def graph_from_hed(hed, beta=130, eps=1e-8):
-    n_x, n_y = hed.shape
-    n = n_x * n_y
+def _grid_edges(n_x, n_y):
     vertices = np.arange(n_x * n_y).reshape((n_x, n_y))
     edges_right = np.vstack((vertices[:, :-1].ravel(),
                              vertices[:, 1:].ravel()))
     edges_down = np.vstack((vertices[:-1].ravel(), vertices[1:].ravel()))
-    edges = np.hstack((edges_right, edges_down))
+    return np.hstack((edges_right, edges_down))
+
+
+def _hed_intensities(hed):
     intensities_right = hed[:, :-1].ravel() + hed[:, 1:].ravel()
     intensities_down = hed[:-1].ravel() + hed[1:].ravel()
     intensities = np.concatenate((intensities_right, intensities_down))
     intensities /= np.max(intensities)
-    weights = np.exp(-beta * (intensities ** 2))
+    return intensities
+
+
+def graph_from_hed(hed, beta=130, eps=1e-8):
+    n, edges, weights = graph_from_hed_betas(hed, [beta], eps=eps)
+    return n, edges, weights[0]
+
+
+def weights_from_hed(hed, beta=130, eps=1e-8):
+    """The weights of graph_from_hed(hed, beta, eps), without the edges.
+
+    This is all the 'cg_mf' mode of random_walker needs (together with
+    hed.shape), which saves the memory for the edges.
+    """
+    weights = np.exp(-beta * (_hed_intensities(hed) ** 2))
+    weights += eps
+    return weights
+
+
+def graph_from_hed_betas(hed, betas, eps=1e-8):
+    """Like graph_from_hed, but for several beta values at once.
+
+    The edges and intensities are only computed once, the returned weights
+    have shape (len(betas), number of edges).
+    """
+    n_x, n_y = hed.shape
+    n = n_x * n_y
+    edges = _grid_edges(n_x, n_y)
+    squared_intensities = _hed_intensities(hed) ** 2
+    betas = np.asarray(betas, dtype=float)
+    weights = np.exp(-betas[:, None] * squared_intensities)
     weights += eps
 
     return n, edges, weights
@@ -0,0 +1,187 @@
+"""
+Random walker for interactive segmentation.
+
+When a user adds a few scribbles at a time, most of the random walker
+system stays the same. RandomWalkerSession keeps the graph Laplacian, a
+factorization of the system and the last solution around, and on every
+change of the seeds only updates what depends on the changed nodes.
+
+The reduced system of the unlabeled nodes is built and factorized once.
+New seeds only remove a few rows and columns from it, which are masked out
+in CG (so no matrix is rebuilt or sliced for an update), and the
+factorization of the system for the earlier seeds is an excellent
+preconditioner for the new one (the difference is of low rank): CG started
+from the previous potentials converges in a few iterations, each of which
+costs one solve with the factorization. Only when seeds are removed, or
+the seeds have changed so much that CG doesn't converge within
+max_iterations, the system is built and factorized again, which costs as
+much as a fresh random_walker(..., mode='factorized') call.
+
+For an even faster but approximate update, only the potentials in a
+neighbourhood of the changed seeds can be re-solved (see update_seeds).
+"""
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator
+
+from .random_walker import _build_laplacian, _block_cg, _factorize, warn
+from .image import _grid_edges
+
+
+class RandomWalkerSession:
+    """Random walker on a fixed graph with seeds that change over time.
+
+    labels are the initial seeds, with 0 for unlabeled nodes and labels
+    1, ..., nlabels otherwise (as for random_walker). If edges is None,
+    the graph is a grid of the given shape as built by graph_from_hed.
+    tol is the tolerance of CG and max_iterations the number of CG
+    iterations after which the system is factorized again instead.
+    """
+
+    def __init__(self, n, edges, weights, labels, tol=1.e-3, shape=None,
+                 max_iterations=20):
+        if edges is None:
+            edges = _grid_edges(*shape)
+        self.n = int(n)
+        self.tol = tol
+        self.max_iterations = max_iterations
+        self.lap = _build_laplacian(edges, weights, self.n)
+        self.lap.sort_indices()
+        self.labels = np.zeros(self.n, dtype=np.int64)
+        self.nlabels = 0
+        # potentials of all nodes, shape (nlabels, n)
+        self.potentials = np.zeros((0, self.n))
+        # -L @ Y, where Y[j, k] = 1 if node j is a seed with label k + 1,
+        # so that the rhs for the unlabeled nodes is _seed_sum[unlabeled]
+        self._seed_sum = np.zeros((self.n, 0))
+        # the reduced system for the unlabeled nodes at the time it was
+        # factorized, the solve function of the factorization and the
+        # mask of these nodes
+        self._system = None
+        self._solve = None
+        self._factorized = None
+        self.update_seeds(labels)
+
+    def add_seeds(self, nodes, label, radius=None):
+        """Add seeds with the given label at nodes and update the potentials."""
+        labels = self.labels.copy()
+        labels[nodes] = label
+        return self.update_seeds(labels, radius)
+
+    def update_seeds(self, labels, radius=None):
+        """Change the seeds to labels and update the potentials.
+
+        If radius is given, only the potentials within radius hops of
+        the changed nodes are re-computed, with the potentials of all
+        other nodes fixed to their previous values. This is faster, but
+        the change of the potentials usually reaches much further than
+        the radius (up to the next boundary in the image, a new scribble
+        can flip the potentials of a whole region), so the result can be
+        far off: on a 321x481 Grabcut-sized grid, a local update with
+        radius 10 takes about 10 ms but can be off by almost 1, while a
+        full update (radius=None) is exact up to tol and takes between
+        50 ms and about 0.6 s, depending on how much the scribble changes
+        (a fresh factorized solve takes about 0.8 s). So the local update
+        is only meant for immediate feedback while the user is drawing,
+        followed by a full update.
+        Returns the new potentials.
+        """
+        labels = np.asarray(labels, dtype=np.int64).ravel()
+        changed = np.flatnonzero(labels != self.labels)
+        if changed.size == 0:
+            return self.potentials
+
+        nlabels = max(self.nlabels, int(labels.max()))
+        if nlabels > self.nlabels:
+            extra = nlabels - self.nlabels
+            self.potentials = np.vstack(
+                [self.potentials, np.zeros((extra, self.n))])
+            self._seed_sum = np.hstack(
+                [self._seed_sum, np.zeros((self.n, extra))])
+            self.nlabels = nlabels
+
+        # update the rhs with the change of the seed indicator at the
+        # changed nodes (the Laplacian is symmetric, so rows = columns)
+        delta = np.zeros((changed.size, nlabels))
+        old, new = self.labels[changed], labels[changed]
+        delta[old > 0, old[old > 0] - 1] -= 1
+        delta[new > 0, new[new > 0] - 1] += 1
+        self._seed_sum -= self.lap[changed].T @ delta
+
+        self.labels = labels
+        seeded = labels > 0
+        self.potentials[:, seeded] = 0
+        self.potentials[labels[seeded] - 1, seeded] = 1
+
+        if radius is None:
+            self._solve_global()
+        else:
+            self._solve_local(self._neighbourhood(changed, radius))
+        return self.potentials
+
+    def segmentation(self):
+        return np.argmax(self.potentials, axis=0) + 1
+
+    def _neighbourhood(self, nodes, radius):
+        """All nodes within radius hops of nodes."""
+        indptr, indices = self.lap.indptr, self.lap.indices
+        region = np.zeros(self.n, dtype=bool)
+        region[nodes] = True
+        frontier = nodes
+        for _ in range(radius):
+            starts, ends = indptr[frontier], indptr[frontier + 1]
+            lengths = ends - starts
+            # indices of all entries in the rows of the frontier
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+            neighbours = indices[offsets + np.arange(lengths.sum())]
+            frontier = np.unique(neighbours[~region[neighbours]])
+            if frontier.size == 0:
+                break
+            region[frontier] = True
+        return np.flatnonzero(region)
+
+    def _solve_local(self, region):
+        """Re-solve for the unlabeled nodes in region, all other nodes fixed."""
+        region = region[self.labels[region] == 0]
+        if region.size == 0:
+            return
+        rows = self.lap[region]
+        # the residual of the harmonic equations in the region, from the
+        # current potentials of all nodes (including the new seeds)
+        residual = -(rows @ self.potentials.T)
+        lap_region = rows[:, region]
+        M = sparse.diags(1.0 / lap_region.diagonal())
+        correction, info = _block_cg(lap_region, residual, self.tol, M=M)
+        self._warn(info)
+        self.potentials[:, region] += correction.T
+
+    def _solve_global(self):
+        unlabeled = self.labels == 0
+        if not unlabeled.any() or self.nlabels == 0:
+            return
+        # the factorized system only covers the nodes that were unlabeled
+        # back then, so it can't be used once seeds have been removed
+        if self._solve is not None and not np.any(unlabeled & ~self._factorized):
+            factorized = self._factorized
+            # the nodes that have become seeds are masked out
+            mask = np.broadcast_to(unlabeled[factorized][:, None],
+                                   (np.count_nonzero(factorized), self.nlabels))
+            size = mask.shape[0]
+            M = LinearOperator((size, size), matvec=self._solve, matmat=self._solve)
+            X, info = _block_cg(self._system, self._seed_sum[factorized], self.tol,
+                                M=M, maxiter=self.max_iterations,
+                                X0=self.potentials[:, factorized].T * mask, mask=mask)
+            if not np.any(info > 0):
+                self.potentials[:, unlabeled] = X[mask[:, 0]].T
+                return
+        self._system = self.lap[unlabeled][:, unlabeled]
+        self._solve = _factorize(self._system)
+        self._factorized = unlabeled
+        self.potentials[:, unlabeled] = self._solve(self._seed_sum[unlabeled]).T
+
+    @staticmethod
+    def _warn(info):
+        if np.any(info > 0):
+            warn("Conjugate gradient convergence to tolerance not achieved "
+                 "for labels {}.".format(list(np.flatnonzero(info) + 1)))
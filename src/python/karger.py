@@ -0,0 +1,447 @@
+"""
+Karger's algorithm with seeds, a Python port of the sampler in julia/karger.jl.
+
+Each sample draws exponential scores with rate w for every edge, which is
+equivalent to contracting random edges with probability proportional to their
+weights, and then contracts edges in order of increasing score with a
+union-find (Kruskal order). Seeds are pre-contracted per label and two
+clusters containing different seeds are never merged.
+
+Instead of sampling one cut at a time, samples are processed in batches: the
+scores for a whole batch are drawn and sorted with a single numpy call, and
+the batches are spread over a process pool. karger_potential_adaptive keeps
+sampling until the potentials are accurate enough instead of using a fixed
+number of samples.
+
+power_watershed is a port of the power watershed in julia/karger.jl: edges are
+merged like in the watershed, in order of descending weight, but for plateaus
+(connected edges of equal weight) the random walker is solved on the plateau.
+
+Installing numba compiles the union-find and improves the performance
+significantly. Without it, a numpy implementation is used that runs the
+union-find for all samples of a batch in lockstep.
+"""
+
+import os
+from contextlib import contextmanager
+from multiprocessing import Pool
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+try:
+    from numba import njit
+    numba_loaded = True
+except ImportError:
+    numba_loaded = False
+
+
+def _find(parent, node):
+    # path halving
+    while parent[node] != node:
+        parent[node] = parent[parent[node]]
+        node = parent[node]
+    return node
+
+
+def _contract(orders, edges, seeds, parent_init, num_clusters, nlabels):
+    """Run seeded Kruskal for each row of orders and count the labels.
+
+    nlabels is the number of different labels of the seeds, i.e. each
+    sample stops once there are nlabels clusters left. Returns an
+    (seeds.max() + 1, n) array where counts[l, j] is the number of samples
+    in which node j ended up in the cluster of label l (l = 0 means the
+    node was not connected to any seed).
+    """
+    n = seeds.shape[0]
+    m = edges.shape[1]
+    counts = np.zeros((seeds.max() + 1, n), dtype=np.int64)
+    parent = np.empty_like(parent_init)
+    for s in range(orders.shape[0]):
+        parent[:] = parent_init
+        clusters = num_clusters
+        for k in range(m):
+            if clusters == nlabels:
+                break
+            e = orders[s, k]
+            u_root = _find(parent, edges[0, e])
+            v_root = _find(parent, edges[1, e])
+            if u_root == v_root:
+                continue
+            if seeds[u_root] > 0:
+                if seeds[v_root] > 0:
+                    # u and v's labels are both fixed and they can't be contracted
+                    continue
+                # u has a fixed label, so merge v into u
+                parent[v_root] = u_root
+            else:
+                # merge u into v
+                parent[u_root] = v_root
+            clusters -= 1
+        for j in range(n):
+            counts[seeds[_find(parent, j)], j] += 1
+    return counts
+
+
+def _contract_lockstep(orders, edges, seeds, parent_init, num_clusters, nlabels):
+    """Array-based version of _contract, used if numba is not available.
+
+    All samples of the batch are processed together, one edge position
+    at a time, so that each step is a handful of numpy operations on
+    arrays of length batch size.
+    """
+    batch, m = orders.shape
+    n = seeds.shape[0]
+    rows = np.arange(batch)
+    # offsetting the node ids by n * sample lets all samples share one
+    # flat parent array
+    offsets = rows * n
+    parent = (parent_init[None, :] + offsets[:, None]).ravel()
+    flat_seeds = np.tile(seeds, batch)
+    clusters = np.full(batch, num_clusters)
+
+    def find(nodes):
+        while True:
+            up = parent[nodes]
+            not_root = up != nodes
+            if not not_root.any():
+                return nodes
+            # path halving
+            parent[nodes[not_root]] = parent[up[not_root]]
+            nodes = np.where(not_root, parent[nodes], nodes)
+
+    for k in range(m):
+        active = clusters > nlabels
+        if not active.any():
+            break
+        e = orders[rows, k]
+        u_root = find(edges[0, e] + offsets)
+        v_root = find(edges[1, e] + offsets)
+        u_fixed = flat_seeds[u_root] > 0
+        v_fixed = flat_seeds[v_root] > 0
+        merge = active & (u_root != v_root) & ~(u_fixed & v_fixed)
+        # if u has a fixed label, merge v into u, otherwise u into v
+        child = np.where(u_fixed, v_root, u_root)[merge]
+        parent[child] = np.where(u_fixed, u_root, v_root)[merge]
+        clusters -= merge
+
+    roots = find(np.arange(batch * n))
+    labels = flat_seeds[roots].reshape(batch, n)
+    counts = np.zeros((seeds.max() + 1, n), dtype=np.int64)
+    for lab in range(seeds.max() + 1):
+        counts[lab] = np.sum(labels == lab, axis=0)
+    return counts
+
+
+def _merge(order, edges, fixed, parent):
+    """Watershed merging of the edges in order (in place).
+
+    Clusters whose root has fixed[root] > 0 are never merged with each
+    other, unfixed clusters are merged into the fixed one.
+    """
+    for k in range(order.shape[0]):
+        e = order[k]
+        u_root = _find(parent, edges[0, e])
+        v_root = _find(parent, edges[1, e])
+        if u_root == v_root:
+            continue
+        if fixed[u_root] > 0:
+            if fixed[v_root] > 0:
+                continue
+            parent[v_root] = u_root
+        else:
+            parent[u_root] = v_root
+
+
+def _find_all(parent, nodes):
+    """Roots of an array of nodes."""
+    roots = np.empty_like(nodes)
+    for k in range(nodes.shape[0]):
+        roots[k] = _find(parent, nodes[k])
+    return roots
+
+
+def _find_all_lockstep(parent, nodes):
+    # path halving for all nodes at once
+    while True:
+        up = parent[nodes]
+        not_root = up != nodes
+        if not not_root.any():
+            return nodes
+        parent[nodes[not_root]] = parent[up[not_root]]
+        nodes = np.where(not_root, parent[nodes], nodes)
+
+
+if numba_loaded:
+    _find = njit(cache=True)(_find)
+    _contract = njit(cache=True)(_contract)
+    _merge = njit(cache=True)(_merge)
+    _find_all = njit(cache=True)(_find_all)
+else:
+    _contract = _contract_lockstep
+    _find_all = _find_all_lockstep
+
+
+def _init_seeds(n, seeds):
+    """Pre-contract all seeds with the same label.
+
+    The root of each label's cluster is its first seed, so that
+    seeds[root] gives the label of a cluster.
+    """
+    parent = np.arange(n)
+    labels, first = np.unique(seeds, return_index=True)
+    roots = np.zeros(labels.max() + 1, dtype=np.int64)
+    roots[labels] = first
+    seeded = seeds > 0
+    parent[seeded] = roots[seeds[seeded]]
+    num_clusters = n - np.count_nonzero(seeded) + np.count_nonzero(labels > 0)
+    return parent, num_clusters
+
+
+# Graph data of the pool workers, set once by _init_worker so that it
+# doesn't have to be sent along with every batch
+_graph = None
+
+
+def _init_worker(edges, weights, seeds, parent, num_clusters, nlabels):
+    global _graph
+    _graph = (edges, weights, seeds, parent, num_clusters, nlabels)
+
+
+def _sample_counts(task):
+    n_samples, seed_seq, batch_size = task
+    edges, weights, seeds, parent, num_clusters, nlabels = _graph
+    rng = np.random.default_rng(seed_seq)
+    counts = np.zeros((seeds.max() + 1, seeds.shape[0]), dtype=np.int64)
+    for start in range(0, n_samples, batch_size):
+        batch = min(batch_size, n_samples - start)
+        # standard_exponential samples from the exponential distribution with
+        # scale 1. We want to sample from p(score > t) = exp(-wt), so we have
+        # to divide by w.
+        scores = rng.standard_exponential((batch, weights.shape[0]))
+        scores /= weights
+        orders = np.argsort(scores, axis=1)
+        counts += _contract(orders, edges, seeds, parent, num_clusters, nlabels)
+    return counts
+
+
+def _prepare(n, edges, weights, seeds):
+    n = int(n)
+    edges = np.ascontiguousarray(edges, dtype=np.int64)
+    weights = np.ascontiguousarray(weights, dtype=np.float64)
+    seeds = np.ascontiguousarray(seeds, dtype=np.int64).ravel()
+    # the number of labels that have seeds, which can be less than the
+    # highest label (the potentials still have one row per label up to it)
+    nlabels = np.unique(seeds[seeds > 0]).size
+    parent, num_clusters = _init_seeds(n, seeds)
+    return edges, weights, seeds, parent, num_clusters, nlabels
+
+
+def _tasks(n_samples, batch_size, seed_seq):
+    # the samples are split into tasks independently of n_jobs, so that the
+    # result for a given seed doesn't depend on the number of workers.
+    # spawn numbers the children consecutively, so spawning the tasks in
+    # several rounds gives the same samples as spawning them at once.
+    task_sizes = [batch_size] * (n_samples // batch_size)
+    if n_samples % batch_size:
+        task_sizes.append(n_samples % batch_size)
+    seed_seqs = seed_seq.spawn(len(task_sizes))
+    return [(size, seq, batch_size) for size, seq in zip(task_sizes, seed_seqs)]
+
+
+@contextmanager
+def _counter(graph, n_jobs):
+    """Yields a function that returns the summed counts of a list of tasks,
+    computed by a pool of n_jobs workers if n_jobs > 1."""
+    if n_jobs > 1:
+        with Pool(n_jobs, initializer=_init_worker, initargs=graph) as pool:
+            yield lambda tasks: sum(pool.imap_unordered(_sample_counts, tasks))
+    else:
+        _init_worker(*graph)
+        yield lambda tasks: sum(_sample_counts(task) for task in tasks)
+
+
+def karger_potential(n, edges, weights, seeds, n_samples, n_jobs=None,
+                     batch_size=8, seed=0):
+    """Estimate the Karger potentials by sampling n_samples seeded cuts.
+
+    Labels are expected to be 1, ..., nlabels (0 for unseeded nodes), as for
+    random_walker. Returns an (nlabels, n) array whose i-th row is the
+    fraction of samples in which each node was cut to label i + 1.
+    n_jobs is the number of worker processes (all cores by default).
+    """
+    graph = _prepare(n, edges, weights, seeds)
+    tasks = _tasks(n_samples, batch_size, np.random.SeedSequence(seed))
+    if n_jobs is None:
+        n_jobs = os.cpu_count()
+    with _counter(graph, min(n_jobs, len(tasks))) as count:
+        counts = count(tasks)
+    return counts[1:] / n_samples
+
+
+def standard_error(pots, n_samples):
+    """Standard error of potentials estimated from n_samples samples.
+
+    Each potential is the mean of n_samples Bernoulli variables, so its
+    variance is p (1 - p) / n_samples.
+    """
+    return np.sqrt(pots * (1 - pots) / n_samples)
+
+
+def karger_potential_adaptive(n, edges, weights, seeds, tol=0.01, stability=None,
+                              min_samples=32, max_samples=10000, n_jobs=None,
+                              batch_size=8, seed=0):
+    """Like karger_potential, but the number of samples is chosen adaptively.
+
+    Samples are drawn in rounds until the standard error of every potential
+    is at most tol, or (if stability is given) until at most a fraction
+    stability of the nodes changed their label (the argmax of the potentials)
+    in the last round, or max_samples are used. After each round, the number
+    of samples that are needed to reach tol is estimated from the current
+    standard error (it decreases like 1 / sqrt(samples)), but the number of
+    samples is at most doubled per round.
+
+    Returns the potentials and a dict with the number of samples used, the
+    largest standard error and the fraction of nodes that changed their label
+    in the last round. The potentials are the same as those of
+    karger_potential with that number of samples (for the same seed and
+    batch_size).
+    """
+    graph = _prepare(n, edges, weights, seeds)
+    seed_seq = np.random.SeedSequence(seed)
+    if n_jobs is None:
+        n_jobs = os.cpu_count()
+    # a multiple of batch_size, so that the tasks of all rounds are full
+    round_size = -(-max(min_samples, n_jobs * batch_size) // batch_size) * batch_size
+    n_samples = 0
+    counts = 0
+    segmentation = None
+    with _counter(graph, n_jobs) as count:
+        while True:
+            size = min(round_size, max_samples - n_samples)
+            counts = counts + count(_tasks(size, batch_size, seed_seq))
+            n_samples += size
+            pots = counts[1:] / n_samples
+
+            error = float(standard_error(pots, n_samples).max())
+            new_segmentation = np.argmax(pots, axis=0)
+            changed = 1.0 if segmentation is None else float(
+                np.mean(new_segmentation != segmentation))
+            segmentation = new_segmentation
+            if (error <= tol or (stability is not None and changed <= stability)
+                    or n_samples >= max_samples):
+                break
+            needed = n_samples * (error / tol) ** 2 - n_samples
+            round_size = int(min(max(needed, batch_size), n_samples))
+            round_size = -(-round_size // batch_size) * batch_size
+
+    return pots, {"samples": n_samples, "standard_error": error, "changed": changed}
+
+
+def watershed(n, edges, weights, seeds):
+    """Seeded watershed, i.e. Karger's algorithm with beta -> infinity.
+
+    Edges are contracted deterministically in order of descending weight.
+    Returns the label of each node (0 for nodes not connected to any seed).
+    """
+    edges, _, seeds, parent, num_clusters, nlabels = _prepare(n, edges, weights, seeds)
+
+    order = np.argsort(-np.asarray(weights), kind='stable')
+    counts = _contract(order[None, :], edges, seeds, parent, num_clusters,
+                       nlabels)
+    # each node was assigned to exactly one label in the single sample
+    return np.argmax(counts, axis=0)
+
+
+def power_watershed(n, edges, weights, seeds, mode='bf', tol=1.e-3):
+    """Power watershed, like power_watershed_multi in julia/karger.jl.
+
+    Edges are processed in order of descending weight. Runs of a single
+    edge weight are merged like in the watershed, for plateaus (several
+    edges with the same weight) the connected components of the plateau
+    are computed and the random walker is solved on each component that
+    contains clusters with different potentials, with the fixed clusters
+    as seeds. The random walker problems of all components of a plateau
+    are solved together as one block-diagonal system with
+    random_walker's solver (mode and tol are as for random_walker).
+
+    Returns an (nlabels, n) array with the potential of each label, like
+    karger_potential (all zero for nodes that aren't connected to a seed).
+    """
+    from .random_walker import _build_laplacian, _solve_linear_system
+
+    edges, weights, seeds, parent, _, _ = _prepare(n, edges, weights, seeds)
+    n = seeds.shape[0]
+    # the potentials are indexed by label
+    nlabels = int(seeds.max())
+    # fixed[root] is the index of the potential of a fixed cluster in
+    # potentials (0 for unfixed clusters), the seeds are fixed to their label
+    fixed = np.zeros(n, dtype=np.int64)
+    fixed[parent[seeds > 0]] = seeds[seeds > 0]
+    potentials = np.zeros((nlabels + 1 + n, nlabels))
+    potentials[1:nlabels + 1] = np.eye(nlabels)
+    num_potentials = nlabels + 1
+
+    order = np.argsort(-weights, kind='stable')
+    sorted_weights = weights[order]
+    starts = np.flatnonzero(np.r_[True, sorted_weights[1:] != sorted_weights[:-1]])
+    ends = np.r_[starts[1:], order.size]
+    # edges before a plateau are merged in one go
+    merged = 0
+    for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+        _merge(order[merged:start], edges, fixed, parent)
+        merged = end
+
+        roots = _find_all(parent, edges[:, order[start:end]].ravel()).reshape(2, -1)
+        roots = roots[:, roots[0] != roots[1]]
+        if roots.size == 0:
+            continue
+        # the plateau as a graph between the clusters
+        nodes, local = np.unique(roots, return_inverse=True)
+        local = local.reshape(roots.shape)
+        k = nodes.size
+        adjacency = sparse.coo_matrix((np.ones(local.shape[1]), (local[0], local[1])),
+                                      shape=(k, k))
+        num_components, component = csgraph.connected_components(adjacency, directed=False)
+        is_fixed = fixed[nodes] > 0
+        node_pots = potentials[fixed[nodes]]
+
+        # components without fixed clusters are merged into one cluster
+        _, first = np.unique(component, return_index=True)
+        has_fixed = np.bincount(component, weights=is_fixed, minlength=num_components) > 0
+        merge = ~has_fixed[component]
+        parent[nodes[merge]] = nodes[first[component[merge]]]
+
+        # if all fixed clusters of a component have the same potential, that
+        # is the solution, so the unfixed ones are merged into a fixed one
+        low = np.full((num_components, nlabels), np.inf)
+        high = np.full((num_components, nlabels), -np.inf)
+        np.minimum.at(low, component[is_fixed], node_pots[is_fixed])
+        np.maximum.at(high, component[is_fixed], node_pots[is_fixed])
+        constant = has_fixed & np.all(low == high, axis=1)
+        representative = np.zeros(num_components, dtype=np.int64)
+        representative[component[is_fixed]] = nodes[is_fixed]
+        merge = constant[component] & ~is_fixed
+        parent[nodes[merge]] = representative[component[merge]]
+
+        solve = has_fixed[component] & ~constant[component]
+        unseeded = solve & ~is_fixed
+        if not unseeded.any():
+            continue
+        # random walker on all remaining components at once
+        index = np.cumsum(solve) - 1
+        plateau_edges = index[local[:, solve[local[0]]]]
+        lap = _build_laplacian(plateau_edges, np.ones(plateau_edges.shape[1]),
+                               np.count_nonzero(solve))
+        unseeded_local = unseeded[solve]
+        B = -lap[unseeded_local][:, ~unseeded_local] @ node_pots[solve & is_fixed]
+        X = _solve_linear_system(lap[unseeded_local][:, unseeded_local],
+                                 sparse.csr_matrix(B), tol, mode)
+        new = np.count_nonzero(unseeded)
+        fixed[nodes[unseeded]] = np.arange(num_potentials, num_potentials + new)
+        potentials[num_potentials:num_potentials + new] = X.T
+        num_potentials += new
+    _merge(order[merged:], edges, fixed, parent)
+
+    return potentials[fixed[_find_all(parent, np.arange(n))]].T
@@ -0,0 +1,174 @@
+"""
+kNN graphs of large datasets, like the USPS graph (see usps_graph.py).
+
+The k nearest neighbours are computed in blocks of rows, so that the full
+distance matrix is never needed: each block of points is compared to all
+points with one matrix product (||x||^2 + ||y||^2 - 2 x.y), which is also
+much faster than comparing points one by one. The blocks are spread over
+a process pool. With approximate=True, the neighbours are found with the
+approximate index of pynndescent instead, which scales to millions of
+points (pynndescent is optional, like numba for karger.py).
+
+The weights are exp(-beta d^2 / max d^2), where d are the distances of
+all edges. write_graph computes them in chunks while writing the graph
+file, for any number of betas, so only the edges and their distances are
+kept in memory.
+"""
+
+import os
+from multiprocessing import Pool
+
+import h5py
+import numpy as np
+
+from . import storage
+
+try:
+    from pynndescent import NNDescent
+    pynndescent_loaded = True
+except ImportError:
+    pynndescent_loaded = False
+
+# Size of the block of the distance matrix that each worker computes at once
+BLOCK_BYTES = 2 ** 27
+
+# Data of the pool workers, set once by _init_worker
+_data = None
+
+
+def _init_worker(data, squared_norms, k):
+    global _data
+    _data = (data, squared_norms, k)
+
+
+def _block_neighbours(block):
+    start, stop = block
+    data, squared_norms, k = _data
+    distances = data[start:stop] @ data.T
+    distances *= -2
+    distances += squared_norms[start:stop, None]
+    distances += squared_norms[None, :]
+    # a point is not its own neighbour
+    rows = np.arange(stop - start)
+    distances[rows, start + rows] = np.inf
+    neighbours = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    distances = np.take_along_axis(distances, neighbours, axis=1)
+    order = np.argsort(distances, axis=1, kind='stable')
+    neighbours = np.take_along_axis(neighbours, order, axis=1)
+    distances = np.take_along_axis(distances, order, axis=1)
+    # rounding errors can make the distances of (almost) equal points negative
+    return neighbours, np.maximum(distances, 0)
+
+
+def _approximate_neighbours(data, k, n_jobs, seed):
+    n = data.shape[0]
+    index = NNDescent(data, n_neighbors=k + 1, n_jobs=n_jobs, random_state=seed)
+    neighbours, distances = index.neighbor_graph
+    # drop each point itself, or the farthest neighbour if it wasn't found
+    drop = neighbours == np.arange(n)[:, None]
+    drop[~drop.any(axis=1), -1] = True
+    neighbours = neighbours[~drop].reshape((n, k))
+    distances = distances[~drop].reshape((n, k)).astype(data.dtype)
+    return neighbours, distances ** 2
+
+
+def nearest_neighbours(data, k, n_jobs=None, approximate=False, dtype=np.float32,
+                       block_size=None, seed=0):
+    """The k nearest neighbours of each point (row) of data, without the
+    point itself.
+
+    Returns an (n, k) array with the indices of the neighbours of each
+    point, sorted by distance, and an array with their squared distances.
+    The distances are computed in dtype, float32 is twice as fast but
+    neighbours with almost the same distance may come out in a different
+    order than with float64. n_jobs is the number of worker processes
+    (all cores by default) and block_size the number of rows per task.
+    """
+    data = np.ascontiguousarray(data, dtype=dtype)
+    n = data.shape[0]
+    if not 0 < k < n:
+        raise ValueError("k must be between 1 and the number of points - 1")
+    if n_jobs is None:
+        n_jobs = os.cpu_count()
+    if approximate:
+        if not pynndescent_loaded:
+            raise ImportError("approximate=True requires pynndescent to be installed")
+        return _approximate_neighbours(data, k, n_jobs, seed)
+
+    if block_size is None:
+        block_size = max(1, BLOCK_BYTES // (n * data.itemsize))
+    blocks = [(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+    worker = (data, np.einsum('ij,ij->i', data, data), k)
+    n_jobs = min(n_jobs, len(blocks))
+    if n_jobs > 1:
+        with Pool(n_jobs, initializer=_init_worker, initargs=worker) as pool:
+            results = pool.map(_block_neighbours, blocks)
+    else:
+        _init_worker(*worker)
+        results = [_block_neighbours(block) for block in blocks]
+    neighbours = np.concatenate([neighbours for neighbours, _ in results])
+    distances = np.concatenate([distances for _, distances in results])
+    return neighbours, distances
+
+
+def knn_edges(neighbours, distances, symmetric=True):
+    """Edges (sorted by their first and then their second node) of the kNN
+    graph and their (squared) distances.
+
+    With symmetric=True, i and j are connected by a single edge if either
+    is a neighbour of the other. Otherwise, there is an edge from each
+    point to each of its neighbours, so mutual neighbours are connected
+    twice (which is what sklearn's kneighbors_graph gives).
+    """
+    n, k = neighbours.shape
+    rows = np.repeat(np.arange(n), k)
+    cols = neighbours.ravel().astype(np.int64)
+    distances = distances.ravel()
+    if symmetric:
+        keys = np.minimum(rows, cols) * n + np.maximum(rows, cols)
+        keys, first = np.unique(keys, return_index=True)
+        return np.stack([keys // n, keys % n]), distances[first]
+    order = np.lexsort((cols, rows))
+    return np.stack([rows[order], cols[order]]), distances[order]
+
+
+def write_graph(path, n, edges, distances, betas, seeds=None, chunk_size=2 ** 20,
+                **datasets):
+    """Write a kNN graph file with the weights exp(-beta d / max d) of the
+    squared distances d of its edges.
+
+    betas is either a single beta (the weights are written as "weights")
+    or a dict from names to betas (written as weights/<name>, like the
+    dict of weights of storage.write_graph). The edges and weights are
+    written in chunks, in the layout of storage.write_graph.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Remove the hdf5 file if it exists, to avoid errors from h5py
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    m = edges.shape[1]
+    max_distance = float(np.max(distances))
+    if isinstance(betas, dict):
+        names = {"weights/" + name: beta for name, beta in betas.items()}
+    else:
+        names = {"weights": betas}
+    with h5py.File(path, "w") as f:
+        for name, data in datasets.items():
+            storage.create_dataset(f, name, data)
+        f.create_dataset("n", data=n)
+        if seeds is not None:
+            storage.write_seeds(f, seeds)
+        if isinstance(betas, dict):
+            f.create_dataset("betas", data=np.array(list(betas), dtype="S"))
+        edge_dataset = storage.create_empty_dataset(f, "edges", (2, m), storage.edge_dtype(n))
+        weight_datasets = {name: storage.create_empty_dataset(f, name, (m,),
+                                                              storage.weight_dtype())
+                           for name in names}
+        for start in range(0, m, chunk_size):
+            stop = min(start + chunk_size, m)
+            edge_dataset[:, start:stop] = edges[:, start:stop]
+            chunk = distances[start:stop].astype(np.float64)
+            for name, beta in names.items():
+                weight_datasets[name][start:stop] = np.exp(-beta * chunk / max_distance)
@@ -0,0 +1,99 @@
+"""
+Segmentation metrics computed from contingency tables.
+
+All metrics we report (RAI, VOI and accuracy) only depend on the
+contingency table of the segmentation and the ground truth, so it is built
+once (with a single bincount for all segmentations of an image) and all
+metrics are derived from it, vectorized over the segmentations.
+"""
+
+import numpy as np
+from scipy.special import xlogy
+
+SCORES = ("RAI", "accuracy", "VOI")
+
+
+def contingency_tables(truth, segmentations):
+    """Contingency tables of several segmentations with the ground truth.
+
+    truth is an array of n integer labels, segmentations an (m, n) array
+    (or a single segmentation of length n). Returns an (m, k, k) array where
+    table[s, i, j] is the number of nodes with label i in the ground truth
+    and label j in segmentation s. Labels are shifted to start at 0 but
+    otherwise kept, so that the diagonal contains the nodes whose label is
+    the same in both.
+    """
+    truth = np.asarray(truth).ravel().astype(np.int64)
+    segmentations = np.atleast_2d(segmentations).astype(np.int64)
+    m, n = segmentations.shape
+    low = min(truth.min(), segmentations.min())
+    k = int(max(truth.max(), segmentations.max()) - low + 1)
+    index = (truth - low) * k + (segmentations - low)
+    index += k * k * np.arange(m)[:, None]
+    return np.bincount(index.ravel(), minlength=m * k * k).reshape((m, k, k))
+
+
+def _pairs(x):
+    return x * (x - 1) / 2
+
+
+def _entropy(p, axis):
+    return -np.sum(xlogy(p, p), axis=axis)
+
+
+def scores(tables):
+    """RAI, VOI (in nats) and accuracy from an (m, k, k) array of tables.
+
+    Returns a dict with an array of length m for each score. These are the
+    same as sklearn's adjusted_rand_score, the variation of information
+    H(X) + H(Y) - 2 I(X, Y) and the fraction of equal labels, respectively.
+    """
+    tables = np.asarray(tables, dtype=float)
+    n = tables.sum(axis=(1, 2))
+    rows = tables.sum(axis=2)
+    cols = tables.sum(axis=1)
+
+    index = _pairs(tables).sum(axis=(1, 2))
+    row_pairs = _pairs(rows).sum(axis=1)
+    col_pairs = _pairs(cols).sum(axis=1)
+    expected = row_pairs * col_pairs / _pairs(n)
+    maximum = (row_pairs + col_pairs) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # identical trivial clusterings (e.g. both with a single cluster)
+        # have a RAI of 1, just like in sklearn
+        rai = np.where(maximum == expected, 1.0,
+                       (index - expected) / (maximum - expected))
+
+    p = tables / n[:, None, None]
+    voi = (2 * _entropy(p, axis=(1, 2)) - _entropy(p.sum(axis=2), axis=1)
+           - _entropy(p.sum(axis=1), axis=1))
+    accuracy = np.trace(tables, axis1=1, axis2=2) / n
+    return {"RAI": rai, "VOI": voi, "accuracy": accuracy}
+
+
+class RunningMean:
+    """Mean and standard error of a stream of values (or arrays of values).
+
+    Uses Welford's algorithm, so the values don't need to be kept around.
+    The standard error is the (population) standard deviation divided by
+    sqrt(count), like np.std(values) / np.sqrt(len(values)).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._squares = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean = self.mean + delta / self.count
+        self._squares = self._squares + delta * (value - self.mean)
+
+    @property
+    def std(self):
+        return np.sqrt(self._squares / self.count)
+
+    @property
+    def standard_error(self):
+        return self.std / np.sqrt(self.count)
@@ -0,0 +1,108 @@
+"""
+Geometric multigrid preconditioner for grid graphs (the 'cg_gmg' mode of
+random_walker), which doesn't need pyamg.
+
+The unlabeled nodes of a grid built by graph_from_hed are aggregated in
+2x2 blocks, like coarsen in multiscale.py does with the pixels. Blocks
+are split along weak edges, so that an aggregate never spans a boundary
+of the image (at high beta, the weights across boundaries are many orders
+of magnitude smaller, and aggregating across them would make the coarse
+grid useless there). The matrix of each coarser level is P^T A P, where
+P maps each node to its aggregate, i.e. the weights of the fine edges
+between two aggregates are summed. This is repeated until the grid is
+small enough to be factorized, or until it hardly shrinks any more, which
+happens once the aggregates are the regions between boundaries. Noisy
+weights without clear boundaries can stall the coarsening much earlier,
+in that case the whole blocks are aggregated.
+
+The preconditioner is one V-cycle with damped Jacobi smoothing, which is
+symmetric, so it can be used with CG. It works on blocks of vectors, so
+one hierarchy serves all labels in _block_cg, and in the precision of A
+(float32 for the mixed precision solves of random_walker).
+"""
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+from scipy.sparse.linalg import splu
+
+
+def _aggregate(A, rows, cols, strength):
+    """Aggregate the nodes in 2x2 blocks of (rows, cols), without the weak
+    edges. Returns the prolongation P and the coordinates of the
+    aggregates."""
+    n = A.shape[0]
+    block_rows, block_cols = rows // 2, cols // 2
+    block = block_rows * (block_cols.max(initial=0) + 1) + block_cols
+
+    # edges between nodes in the same block that are at least strength
+    # times as strong as the strongest edge of either node
+    coo = sparse.triu(A, k=1).tocoo()
+    weights = -coo.data
+    strongest = np.zeros(n)
+    np.maximum.at(strongest, coo.row, weights)
+    np.maximum.at(strongest, coo.col, weights)
+    keep = ((block[coo.row] == block[coo.col]) &
+            (weights >= strength * np.maximum(strongest[coo.row], strongest[coo.col])))
+    graph = sparse.coo_matrix((np.ones(keep.sum()), (coo.row[keep], coo.col[keep])),
+                              shape=(n, n))
+    _, aggregates = csgraph.connected_components(graph, directed=False)
+
+    n_coarse = aggregates.max(initial=-1) + 1
+    P = sparse.csr_matrix((np.ones(n, dtype=A.dtype), (np.arange(n), aggregates)),
+                          shape=(n, n_coarse))
+    coarse_rows = np.zeros(n_coarse, dtype=rows.dtype)
+    coarse_cols = np.zeros(n_coarse, dtype=cols.dtype)
+    coarse_rows[aggregates] = block_rows
+    coarse_cols[aggregates] = block_cols
+    return P, coarse_rows, coarse_cols
+
+
+class GridMultigrid:
+    """V-cycle preconditioner for the reduced random walker system A of a
+    grid with the given shape and labels (as built by _build_linear_system
+    with the shape), to pass as M to _block_cg."""
+
+    def __init__(self, A, shape, labels, coarse_size=1000, strength=0.1,
+                 smoothing=2, omega=2 / 3):
+        A = sparse.csr_matrix(A)
+        self.shape = A.shape
+        self.smoothing = smoothing
+        self.omega = omega
+        # grid coordinates of the unlabeled nodes
+        rows, cols = np.divmod(np.flatnonzero(labels.ravel() == 0), shape[1])
+
+        self.levels = []
+        while A.shape[0] > coarse_size:
+            P, coarse_rows, coarse_cols = _aggregate(A, rows, cols, strength)
+            if P.shape[1] > 0.75 * A.shape[0] and A.shape[0] > 20 * coarse_size:
+                # the weights are too noisy to find strong edges, so that
+                # the grid would hardly shrink and the coarsest grid would
+                # be too large to factorize, use the whole blocks instead
+                P, coarse_rows, coarse_cols = _aggregate(A, rows, cols, 0)
+            if P.shape[1] > 0.9 * A.shape[0]:
+                break
+            rows, cols = coarse_rows, coarse_cols
+            self.levels.append((A, 1 / A.diagonal(), P))
+            A = (P.T @ A @ P).tocsr()
+        self.coarse_solve = splu(A.tocsc()).solve
+        self.coarse_shape = A.shape
+
+    def _smooth(self, A, inverse_diagonal, X, B):
+        for _ in range(self.smoothing):
+            X += self.omega * inverse_diagonal[:, None] * (B - A @ X)
+        return X
+
+    def _cycle(self, level, B):
+        if level == len(self.levels):
+            return self.coarse_solve(B).reshape(B.shape)
+        A, inverse_diagonal, P = self.levels[level]
+        X = self._smooth(A, inverse_diagonal, np.zeros(B.shape, dtype=B.dtype), B)
+        X += P @ self._cycle(level + 1, P.T @ (B - A @ X))
+        return self._smooth(A, inverse_diagonal, X, B)
+
+    def __matmul__(self, B):
+        B = np.asarray(B)
+        vector = B.ndim == 1
+        X = self._cycle(0, B.reshape(B.shape[0], -1))
+        return X.ravel() if vector else X
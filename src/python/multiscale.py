@@ -0,0 +1,205 @@
+"""
+Coarse-to-fine random walker and Karger potentials for large grid graphs.
+
+Most pixels of a large image are far away from any boundary and their
+potentials are almost exactly 0 or 1, so solving for them at full
+resolution is wasted work. Here, the weights of a grid graph (as built by
+graph_from_hed) are aggregated into a pyramid of coarser grids, the
+potentials are computed on the coarsest grid, and at each finer level only
+the pixels in a band around the 0.5 level set are computed again. All other
+pixels are fixed to the upsampled potentials of the coarser level, i.e. they
+act as Dirichlet boundary conditions for the band.
+
+For Karger's algorithm, which only works with discrete seeds, the fixed
+pixels around the band become seeds of the label with the highest
+potential instead.
+"""
+
+import numpy as np
+from scipy import sparse
+from scipy.ndimage import binary_dilation
+
+from .random_walker import (random_walker, _build_linear_system,
+                            _solve_linear_system, _grid_weights)
+from .karger import karger_potential
+from .image import _grid_edges
+
+
+def _sum_pairs(a, axis, size):
+    """Sum neighbouring pairs of entries along axis, padding a to 2 * size."""
+    pad = [(0, 0)] * a.ndim
+    pad[axis] = (0, 2 * size - a.shape[axis])
+    a = np.pad(a, pad)
+    shape = list(a.shape)
+    shape[axis:axis + 1] = [size, 2]
+    return a.reshape(shape).sum(axis=axis + 1)
+
+
+def coarsen(shape, weights, labels):
+    """Aggregate a grid graph into one with half the resolution.
+
+    Each coarse pixel is a 2x2 block of fine pixels. The weight between two
+    coarse pixels is the sum of the weights of the fine edges between their
+    blocks (which are parallel edges once the blocks are contracted). A coarse
+    pixel is a seed if its block contains seeds of only one label.
+    Returns the shape, weights and labels of the coarse grid.
+    """
+    n_x, n_y = shape
+    c_x, c_y = (n_x + 1) // 2, (n_y + 1) // 2
+    right, down = _grid_weights(shape, weights)
+    # only edges between different blocks remain
+    coarse_right = _sum_pairs(right[:, 1::2], 0, c_x)
+    coarse_down = _sum_pairs(down[1::2, :], 1, c_y)
+    coarse_weights = np.concatenate((coarse_right.ravel(), coarse_down.ravel()))
+
+    blocks = np.pad(labels.reshape(shape), ((0, 2 * c_x - n_x), (0, 2 * c_y - n_y)))
+    blocks = blocks.reshape((c_x, 2, c_y, 2))
+    highest = blocks.max(axis=(1, 3))
+    lowest = np.where(blocks > 0, blocks, highest.max() + 1).min(axis=(1, 3))
+    coarse_labels = np.where(highest == lowest, highest, 0)
+
+    return (c_x, c_y), coarse_weights, coarse_labels.ravel()
+
+
+def _upsample(potentials, coarse_shape, shape):
+    potentials = potentials.reshape((-1,) + tuple(coarse_shape))
+    potentials = potentials.repeat(2, axis=1).repeat(2, axis=2)
+    return potentials[:, :shape[0], :shape[1]].reshape((potentials.shape[0], -1))
+
+
+def _neighbour_sum(shape, weights, values):
+    """sum_j w_ij values[:, j] over the neighbours j of each node i."""
+    n_x, n_y = shape
+    right, down = _grid_weights(shape, weights)
+    values = values.reshape((-1, n_x, n_y))
+    out = np.zeros_like(values)
+    out[:, :, :-1] += right * values[:, :, 1:]
+    out[:, :, 1:] += right * values[:, :, :-1]
+    out[:, :-1] += down * values[:, 1:]
+    out[:, 1:] += down * values[:, :-1]
+    return out.reshape((values.shape[0], -1))
+
+
+def _refine_rw(shape, weights, potentials, unknown, mode, tol):
+    """Random walker for the unknown nodes, all others fixed to potentials."""
+    fixed = (~unknown).astype(np.int64)
+    lap_sparse, _ = _build_linear_system(None, weights, fixed, 1, shape)
+    B = _neighbour_sum(shape, weights, potentials * fixed)[:, unknown].T
+    if mode in ('cg_mf', 'cg_gmg'):
+        # the band isn't a grid, so use the matrix based version
+        mode = 'cg_block'
+    return _solve_linear_system(lap_sparse, sparse.csr_matrix(B), tol, mode)
+
+
+def _contiguous(labels):
+    """Renumber the labels that have seeds to 1..k, as random_walker and
+    karger_potential expect. Returns the new labels and the original label
+    of each of them."""
+    present = np.unique(labels[labels > 0])
+    relabel = np.zeros(labels.max() + 1, dtype=labels.dtype)
+    relabel[present] = np.arange(1, present.size + 1)
+    return relabel[labels], present
+
+
+def _refine_karger(shape, weights, potentials, unknown, n_samples, seed):
+    """Karger for the unknown nodes, the nodes around them become seeds."""
+    region = binary_dilation(unknown.reshape(shape)).ravel()
+    seeds = np.where(unknown, 0, np.argmax(potentials, axis=0) + 1)[region]
+    edges = _grid_edges(*shape)
+    inside = region[edges[0]] & region[edges[1]]
+    new_index = np.cumsum(region) - 1
+    seeds, present = _contiguous(seeds)
+    pots = karger_potential(seeds.size, new_index[edges[:, inside]],
+                            weights[inside], seeds, n_samples, seed=seed)
+    out = np.zeros((potentials.shape[0], seeds.size))
+    out[present - 1] = pots
+    return out[:, new_index[unknown]]
+
+
+def _full_solve(shape, weights, labels, method, mode, tol, n_samples, seed):
+    n = shape[0] * shape[1]
+    if method == 'rw':
+        return random_walker(n, None, weights, labels, mode=mode, tol=tol,
+                             shape=shape)
+    return karger_potential(n, _grid_edges(*shape), weights, labels, n_samples,
+                            seed=seed)
+
+
+def multiscale_potential(shape, weights, labels, method='rw', levels=2,
+                         band=0.2, compare=False, mode='cg_j', tol=1.e-3,
+                         n_samples=100, seed=0):
+    """Coarse-to-fine random walker (method='rw') or Karger potentials.
+
+    The graph is a grid of the given shape as built by graph_from_hed.
+    The potentials are computed at a resolution reduced by 2 ** levels and
+    then refined level by level for the pixels whose highest potential is
+    below 0.5 + band (i.e. |p - 0.5| < band for two labels) or which lie
+    at the border of the segmentation, plus a margin of one coarse pixel.
+    mode and tol are used for the random walker, n_samples and seed for
+    Karger.
+
+    Returns the (nlabels, n) potentials and a dict with the number of unknown
+    nodes at each level (coarsest first). If compare is True, the potentials
+    are also computed directly at full resolution, and the dict contains the
+    maximum and mean absolute error as well as the fraction of pixels that
+    are segmented differently, which helps to choose the band width.
+    """
+    labels = labels.ravel()
+    pyramid = [(tuple(shape), weights, labels)]
+    for _ in range(levels):
+        pyramid.append(coarsen(*pyramid[-1]))
+
+    coarse_shape, coarse_weights, coarse_labels = pyramid[-1]
+    # labels whose seeds all disappeared at the coarse level (because all
+    # their blocks also contain seeds of other labels) are left out of the
+    # coarse solve, their potential is 0 until the finer levels
+    solve_labels, present = _contiguous(coarse_labels)
+    coarse_potentials = _full_solve(coarse_shape, coarse_weights,
+                                    solve_labels, method, mode, tol,
+                                    n_samples, seed)
+    potentials = np.zeros((labels.max(), coarse_potentials.shape[1]))
+    potentials[present - 1] = coarse_potentials
+    report = {"unknowns": [int(np.count_nonzero(coarse_labels == 0))]}
+
+    for level_shape, level_weights, level_labels in reversed(pyramid[:-1]):
+        potentials = _upsample(potentials, coarse_shape, level_shape)
+        coarse_shape = level_shape
+
+        seeded = level_labels > 0
+        potentials[:, seeded] = 0
+        potentials[level_labels[seeded] - 1, seeded] = 1
+
+        uncertain = potentials.max(axis=0) < 0.5 + band
+        # The potentials can jump across the 0.5 level between two coarse
+        # pixels, so pixels at the border of the segmentation are uncertain
+        # as well.
+        segmentation = np.argmax(potentials, axis=0).reshape(level_shape)
+        border = np.zeros(level_shape, dtype=bool)
+        border[1:] |= segmentation[1:] != segmentation[:-1]
+        border[:, 1:] |= segmentation[:, 1:] != segmentation[:, :-1]
+        uncertain |= border.ravel()
+        # one coarse pixel of margin, to make up for the blocky upsampling
+        uncertain = binary_dilation(uncertain.reshape(level_shape),
+                                    iterations=2).ravel()
+        unknown = uncertain & ~seeded
+        report["unknowns"].append(int(np.count_nonzero(unknown)))
+        if not unknown.any():
+            continue
+
+        if method == 'rw':
+            potentials[:, unknown] = _refine_rw(
+                level_shape, level_weights, potentials, unknown, mode, tol)
+        else:
+            potentials[:, unknown] = _refine_karger(
+                level_shape, level_weights, potentials, unknown, n_samples, seed)
+
+    if compare:
+        full = _full_solve(tuple(shape), weights, labels, method, mode, tol,
+                           n_samples, seed)
+        error = np.abs(full - potentials)
+        report["max_error"] = float(error.max())
+        report["mean_error"] = float(error.mean())
+        report["segmentation_change"] = float(np.mean(
+            np.argmax(full, axis=0) != np.argmax(potentials, axis=0)))
+
+    return potentials, report
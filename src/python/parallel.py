@@ -0,0 +1,224 @@
+"""
+Domain decomposition, for solving the random walker of one large graph on
+many cores (the 'cg_dd' mode of random_walker).
+
+The nodes are split into contiguous parts (in the natural order if it has
+a small bandwidth, like the rows of a grid built by graph_from_hed, which
+gives strips of the image, and in reverse Cuthill-McKee order otherwise)
+and each part is grown by a few layers of neighbours into an overlapping
+subdomain. Each worker process owns some parts and their subdomains and
+factorizes the matrices of its subdomains once. Then the system is solved
+with the block CG of random_walker, where the workers compute
+- the product of the matrix with the search directions (each worker for
+  the rows of its parts), and
+- the two-level additive Schwarz preconditioner
+
+      M^-1 r = sum_i R_i^T A_i^-1 R_i r + Z (Z^T A Z)^-1 Z^T r
+
+  where A_i is the matrix restricted to subdomain i and Z has one
+  indicator column per part. The coarse correction is a small dense
+  system, which keeps the number of iterations from growing with the
+  number of parts.
+
+The vectors are exchanged through shared memory, the pipes to the workers
+only carry short commands.
+"""
+
+import os
+from multiprocessing import Pipe, Process
+from multiprocessing import shared_memory
+
+import numpy as np
+import scipy.linalg
+from scipy import sparse
+from scipy.sparse import csgraph
+
+
+def partition(A, n_parts, overlap=2):
+    """Split the nodes of the graph with matrix A into n_parts parts.
+
+    Returns the parts (disjoint arrays of nodes covering all nodes) and
+    the subdomains (each part with all nodes up to overlap edges away).
+    """
+    A = sparse.csr_matrix(A)
+    n = A.shape[0]
+    coo = A.tocoo()
+    bandwidth = np.abs(coo.row - coo.col).max(initial=0)
+    if 4 * bandwidth * n_parts <= n:
+        order = np.arange(n)
+    else:
+        order = csgraph.reverse_cuthill_mckee(A, symmetric_mode=True)
+    parts = np.array_split(order, n_parts)
+
+    adjacency = (A != 0).astype(np.int8)
+    subdomains = []
+    for part in parts:
+        inside = np.zeros(n, dtype=bool)
+        inside[part] = True
+        for _ in range(overlap):
+            inside |= (adjacency @ inside) > 0
+        subdomains.append(np.flatnonzero(inside))
+    return parts, subdomains
+
+
+def _worker(conn, A, names, n, k, total, parts, subdomains):
+    from .random_walker import _factorize
+
+    buffers = [shared_memory.SharedMemory(name=name) for name in names]
+    X = np.ndarray((n, k), dtype=np.float64, buffer=buffers[0].buf)
+    Y = np.ndarray((n, k), dtype=np.float64, buffer=buffers[1].buf)
+    local = np.ndarray((total, k), dtype=np.float64, buffer=buffers[2].buf)
+
+    A = A.tocsr()
+    rows = [A[part] for part in parts]
+    solves = [(nodes, offset, _factorize(A[nodes][:, nodes]))
+              for nodes, offset in subdomains]
+    conn.send(None)
+    while True:
+        command, columns = conn.recv()
+        if command == "matmul":
+            for part, A_part in zip(parts, rows):
+                Y[part, :columns] = A_part @ X[:, :columns]
+        elif command == "precondition":
+            for nodes, offset, solve in solves:
+                local[offset:offset + nodes.size, :columns] = (
+                    solve(X[nodes, :columns]).reshape(nodes.size, columns))
+        else:
+            break
+        conn.send(None)
+    # the arrays have to be released before the shared memory is closed
+    del X, Y, local
+    for buffer in buffers:
+        buffer.close()
+    conn.close()
+
+
+class DomainDecomposition:
+    """Parallel product and additive Schwarz preconditioner for the SPD
+    matrix A, for blocks of up to k vectors.
+
+    Works as the matrix in _block_cg (A @ X) and has a preconditioner
+    attribute to pass as M. The worker processes run until close() is
+    called (or the with block is left).
+    """
+
+    def __init__(self, A, k, n_jobs=None, parts_per_job=1, overlap=8):
+        A = sparse.csr_matrix(A)
+        self.shape = A.shape
+        n = A.shape[0]
+        self.k = k
+        if n_jobs is None:
+            n_jobs = os.cpu_count()
+        n_parts = max(1, min(n_jobs * parts_per_job, n))
+        n_jobs = min(n_jobs, n_parts)
+        parts, subdomains = partition(A, n_parts, overlap)
+        offsets = np.cumsum([0] + [nodes.size for nodes in subdomains])
+        total = int(offsets[-1])
+
+        # sums the (overlapping) local solutions of all subdomains
+        self._assemble = sparse.csr_matrix(
+            (np.ones(total), (np.concatenate(subdomains), np.arange(total))),
+            shape=(n, total))
+        Z = sparse.csr_matrix(
+            (np.ones(n), (np.concatenate(parts),
+                          np.repeat(np.arange(n_parts), [p.size for p in parts]))),
+            shape=(n, n_parts))
+        self._coarse = Z
+        self._coarse_factor = scipy.linalg.cho_factor((Z.T @ A @ Z).toarray())
+
+        self._buffers = []
+        self._workers = []
+        try:
+            for size in (n, n, total):
+                self._buffers.append(shared_memory.SharedMemory(create=True,
+                                                                size=max(1, size * k * 8)))
+            self._X = np.ndarray((n, k), dtype=np.float64, buffer=self._buffers[0].buf)
+            self._Y = np.ndarray((n, k), dtype=np.float64, buffer=self._buffers[1].buf)
+            self._local = np.ndarray((total, k), dtype=np.float64,
+                                     buffer=self._buffers[2].buf)
+
+            names = [buffer.name for buffer in self._buffers]
+            for job in range(n_jobs):
+                mine = range(job, n_parts, n_jobs)
+                conn, child = Pipe()
+                process = Process(target=_worker, daemon=True, args=(
+                    child, A, names, n, k, total, [parts[i] for i in mine],
+                    [(subdomains[i], int(offsets[i])) for i in mine]))
+                process.start()
+                self._workers.append((process, conn))
+            # wait until all subdomains are factorized (a worker that fails,
+            # e.g. because a subdomain is singular, closes its pipe)
+            for _, conn in self._workers:
+                conn.recv()
+        except BaseException:
+            # the other workers would wait for commands forever, and the
+            # shared memory would stay around until the next reboot
+            self._abort()
+            raise
+
+        self.preconditioner = _Preconditioner(self)
+
+    def _run(self, command, X):
+        columns = X.shape[1]
+        self._X[:, :columns] = X
+        for _, conn in self._workers:
+            conn.send((command, columns))
+        for _, conn in self._workers:
+            conn.recv()
+        return columns
+
+    def __matmul__(self, X):
+        X = np.asarray(X)
+        vector = X.ndim == 1
+        columns = self._run("matmul", X.reshape(X.shape[0], -1))
+        Y = np.array(self._Y[:, :columns])
+        return Y.ravel() if vector else Y
+
+    def _precondition(self, R):
+        R = np.asarray(R)
+        vector = R.ndim == 1
+        R = R.reshape(R.shape[0], -1)
+        columns = self._run("precondition", R)
+        Y = self._assemble @ self._local[:, :columns]
+        Y += self._coarse @ scipy.linalg.cho_solve(self._coarse_factor, self._coarse.T @ R)
+        return Y.ravel() if vector else Y
+
+    def close(self):
+        for process, conn in self._workers:
+            conn.send(("close", 0))
+            process.join()
+        self._workers = []
+        self._release()
+
+    def _abort(self):
+        """Stop the workers without waiting for them and release the shared
+        memory, after an error."""
+        for process, conn in self._workers:
+            process.terminate()
+            process.join()
+            conn.close()
+        self._workers = []
+        self._release()
+
+    def _release(self):
+        # the arrays have to be released before the shared memory is closed
+        self._X = self._Y = self._local = None
+        for buffer in self._buffers:
+            buffer.close()
+            buffer.unlink()
+        self._buffers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Preconditioner:
+    def __init__(self, decomposition):
+        self.decomposition = decomposition
+        self.shape = decomposition.shape
+
+    def __matmul__(self, R):
+        return self.decomposition._precondition(R)
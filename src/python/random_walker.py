@@ -52,14 +52,36 @@ Pattern Anal Mach Intell. 2006 Nov;28(11):1768-83.
 
 Installing pyamg and using the 'cg_mg' mode of random_walker improves
 significantly the performance.
+
+The 'cg_gmg' mode does the same for grid graphs without pyamg, with a
+geometric multigrid preconditioner (see multigrid.py).
+
+With precision='mixed' (or 'single', which also returns float32
+potentials), the 'cg_block' and 'cg_gmg' modes run CG in float32 and
+correct the result in float64 (iterative refinement).
+
+The 'cg_dd' mode solves a single large system on all cores, with a
+domain decomposition preconditioner (see parallel.py).
+
+The 'factorized' mode factorizes the system once (with a Cholesky
+decomposition if scikit-sparse is installed, an LU decomposition otherwise)
+and keeps the factorization in a small cache, so that repeated calls on the
+same graph and seeds skip the factorization.
 """
 
 
+import hashlib
+from collections import OrderedDict
+
 import numpy as np
 from scipy import sparse
+from scipy.sparse import csgraph
 
+from . import telemetry
+from .multigrid import GridMultigrid
 
-def warn(message):
+
+def warn(message, stacklevel=1):
     print(message)
 
 
@@ -89,16 +111,26 @@ try:
 except ImportError:
     amg_loaded = False
 
-from scipy.sparse.linalg import cg, spsolve
+try:
+    from sksparse.cholmod import cholesky
+    cholmod_loaded = True
+except ImportError:
+    cholmod_loaded = False
+
+from scipy.sparse.linalg import cg, spsolve, splu, LinearOperator
 import scipy
 import functools
 
 cg = functools.partial(cg, atol=0)
 
+# Maximum number of factorizations kept by the 'factorized' mode
+FACTORIZATION_CACHE_SIZE = 8
+_factorization_cache = OrderedDict()
 
-def _build_laplacian(edges, weights):
+
+def _build_laplacian(edges, weights, n=None):
     # Build the sparse linear system
-    pixel_nb = edges.shape[1]
+    pixel_nb = edges.max() + 1 if n is None else n
     i_indices = edges.ravel()
     j_indices = edges[::-1].ravel()
     data = -np.hstack((weights, weights))
@@ -108,37 +140,304 @@ def _build_laplacian(edges, weights):
     return lap.tocsr()
 
 
-def _build_linear_system(edges, weights, labels, nlabels):
+def _build_linear_system(edges, weights, labels, nlabels, shape=None):
     """
     Build the matrix A and rhs B of the linear system to solve.
     A and B are two block of the laplacian of the image graph.
+
+    Instead of building the full Laplacian and slicing it, the entries
+    between unlabeled nodes are written directly into a CSR matrix and
+    the edges from unlabeled nodes to seeds directly into B.
+    If shape is given, the graph must be a grid as built by graph_from_hed
+    with that shape, which allows an even faster assembly (edges are not
+    used in that case and may be None).
     """
     labels = labels.ravel()
+    n = labels.size
+    with telemetry.stage("reduction"):
+        seeds_mask = labels > 0
+        # index of each node among the unlabeled ones
+        new_index = np.cumsum(~seeds_mask) - 1
+        n_unlabeled = n - np.count_nonzero(seeds_mask)
+
+    if shape is not None:
+        return _build_grid_linear_system(shape, weights, labels, nlabels,
+                                         seeds_mask, new_index, n_unlabeled)
+
+    u, v = edges
+    degrees = (np.bincount(u, weights, minlength=n) +
+               np.bincount(v, weights, minlength=n))
+
+    inner = ~seeds_mask[u] & ~seeds_mask[v] & (u != v)
+    u_inner, v_inner = new_index[u[inner]], new_index[v[inner]]
+    w_inner = -weights[inner]
+    diagonal = np.arange(n_unlabeled)
+    lap_sparse = sparse.csr_matrix(
+        (np.concatenate((w_inner, w_inner, degrees[~seeds_mask])),
+         (np.concatenate((u_inner, v_inner, diagonal)),
+          np.concatenate((v_inner, u_inner, diagonal)))),
+        shape=(n_unlabeled, n_unlabeled))
+
+    # edges from an unlabeled node (first) to a seed (second)
+    to_seed = ~seeds_mask[u] & seeds_mask[v]
+    from_seed = seeds_mask[u] & ~seeds_mask[v]
+    rows = np.concatenate((new_index[u[to_seed]], new_index[v[from_seed]]))
+    cols = np.concatenate((labels[v[to_seed]], labels[u[from_seed]])) - 1
+    data = np.concatenate((weights[to_seed], weights[from_seed]))
+    rhs = sparse.csr_matrix((data, (rows, cols)),
+                            shape=(n_unlabeled, nlabels))
 
-    indices = np.arange(labels.size)
-    seeds_mask = labels > 0
-    unlabeled_indices = indices[~seeds_mask]
-    seeds_indices = indices[seeds_mask]
+    return lap_sparse, rhs
 
-    lap_sparse = _build_laplacian(edges, weights)
 
-    rows = lap_sparse[unlabeled_indices, :]
-    lap_sparse = rows[:, unlabeled_indices]
-    B = -rows[:, seeds_indices]
+def _grid_weights(shape, weights):
+    """Split the weights of a grid graph into the right and down weights.
+
+    weights are ordered as by graph_from_hed, i.e. first all edges to the
+    right neighbour, then all edges to the lower one.
+    """
+    n_x, n_y = shape
+    n_right = n_x * (n_y - 1)
+    if weights.shape[0] != n_right + (n_x - 1) * n_y:
+        raise ValueError("The number of weights doesn't match a grid "
+                         "of shape {}".format(shape))
+    right = weights[:n_right].reshape((n_x, n_y - 1))
+    down = weights[n_right:].reshape((n_x - 1, n_y))
+    return right, down
 
-    seeds = labels[seeds_mask]
-    seeds_mask = sparse.csc_matrix(np.hstack(
-        [np.atleast_2d(seeds == lab).T for lab in range(1, nlabels + 1)]))
-    rhs = B.dot(seeds_mask)
+
+def _stencil(values, fill, dtype=None):
+    """Values of the up, left, center, right and down neighbour of each node.
+
+    Returns an (n_x, n_y, 5) array, neighbours outside the grid get fill.
+    """
+    n_x, n_y = values.shape
+    out = np.full((n_x, n_y, 5), fill, dtype=dtype or values.dtype)
+    out[1:, :, 0] = values[:-1, :]
+    out[:, 1:, 1] = values[:, :-1]
+    out[:, :, 2] = values
+    out[:, :-1, 3] = values[:, 1:]
+    out[:-1, :, 4] = values[1:, :]
+    return out
+
+
+def _build_grid_linear_system(shape, weights, labels, nlabels, seeds_mask,
+                              new_index, n_unlabeled):
+    n_x, n_y = shape
+    right, down = _grid_weights(shape, weights)
+    # signed, because neighbours outside of the grid get the label -1 (seeds
+    # read from images are often uint8)
+    labels = np.asarray(labels, dtype=np.int64)
+
+    # Row of the Laplacian for each node, with columns in the order
+    # up, left, center, right, down. These are increasing column indices,
+    # so the CSR matrix doesn't need any sorting.
+    data = np.zeros((n_x, n_y, 5))
+    data[1:, :, 0] = -down
+    data[:, 1:, 1] = -right
+    data[:, :-1, 3] = -right
+    data[:-1, :, 4] = -down
+    data[:, :, 2] = -data.sum(axis=2)
+
+    # -1 marks neighbours outside of the grid
+    neighbour_labels = _stencil(labels.reshape(shape), -1)
+    neighbour_labels[:, :, 2] = 0
+    unlabeled_rows = ~seeds_mask.reshape(shape)[:, :, None]
+    valid = (neighbour_labels == 0) & unlabeled_rows
+    to_seed = (neighbour_labels > 0) & unlabeled_rows
+
+    indptr = np.zeros(n_unlabeled + 1, dtype=np.int64)
+    np.cumsum(valid.sum(axis=2).ravel()[~seeds_mask], out=indptr[1:])
+    cols = _stencil(new_index.reshape(shape), 0)
+    lap_sparse = sparse.csr_matrix((data[valid], cols[valid], indptr),
+                                   shape=(n_unlabeled, n_unlabeled))
+
+    rows = np.broadcast_to(new_index.reshape(shape)[:, :, None], data.shape)
+    rhs = sparse.csr_matrix(
+        (-data[to_seed], (rows[to_seed], neighbour_labels[to_seed] - 1)),
+        shape=(n_unlabeled, nlabels))
 
     return lap_sparse, rhs
 
 
-def _solve_linear_system(lap_sparse, B, tol, mode):
+def _system_key(edges, weights, labels, shape=None):
+    """Hash of everything the reduced Laplacian depends on."""
+    h = hashlib.sha1()
+    if shape is not None:
+        # grid graphs don't need to have an edges array
+        edges = np.asarray(shape)
+    for arr in (edges, weights, labels > 0):
+        arr = np.ascontiguousarray(arr)
+        h.update(str((arr.dtype, arr.shape)).encode())
+        h.update(arr.data)
+    return h.hexdigest()
+
+
+def _factorize(lap_sparse, cache_key=None):
+    """Return a function solving lap_sparse X = B, using the cache if possible."""
+    if cache_key is not None and cache_key in _factorization_cache:
+        _factorization_cache.move_to_end(cache_key)
+        return _factorization_cache[cache_key]
+
+    lap_sparse = lap_sparse.tocsc()
+    if cholmod_loaded:
+        solve = cholesky(lap_sparse)
+    else:
+        # the systems are symmetric positive definite, so SuperLU can use a
+        # symmetric ordering without pivoting, which gives about half the fill
+        # (and half the time per solve) of its default
+        solve = splu(lap_sparse, permc_spec='MMD_AT_PLUS_A', diag_pivot_thresh=0,
+                     options=dict(SymmetricMode=True)).solve
+
+    if cache_key is not None:
+        _factorization_cache[cache_key] = solve
+        while len(_factorization_cache) > FACTORIZATION_CACHE_SIZE:
+            _factorization_cache.popitem(last=False)
+    return solve
+
+
+def _block_cg(A, B, tol, M=None, maxiter=None, X0=None, mask=None):
+    """Conjugate gradient for all columns of B at once.
+
+    Each column is an independent CG run (with its own step sizes), but the
+    matrix and the preconditioner are applied to all columns that have not
+    converged yet in a single product, i.e. one SpMM per iteration instead
+    of one SpMV per column.
+
+    mask is an optional boolean array of the same shape as B. If it is
+    given, column j is only solved for the rows where mask[:, j] is True,
+    i.e. with A restricted to these rows and columns, and all other entries
+    of X are kept at X0. This allows solving different subsystems of the
+    same matrix in one go.
+
+    Returns the solution X (same shape as B) and an array with the
+    convergence status of each column, with the same meaning as the info
+    returned by scipy's cg: 0 if the column converged to
+    ||b - Ax|| <= tol * ||b||, otherwise the number of iterations. tol may
+    also be an array with the tolerance of each column.
+    If telemetry is active, the iterations and relative residuals of each
+    column are recorded.
+    """
+    n, k = B.shape
+    if maxiter is None:
+        maxiter = 10 * n
+    # float32 systems are solved in float32
+    dtype = np.result_type(B.dtype, np.float32)
+    X = np.zeros((n, k), dtype=dtype) if X0 is None else np.array(X0, dtype=dtype)
+    if mask is not None:
+        B = B * mask
+    R = B - A @ X if X0 is not None else np.array(B, dtype=dtype)
+    if mask is not None:
+        R *= mask
+    b_norms = np.linalg.norm(B, axis=0)
+    threshold = tol * b_norms
+    active = np.flatnonzero(np.linalg.norm(R, axis=0) > threshold)
+    info = np.zeros(k, dtype=int)
+    record = telemetry.active()
+    if record:
+        iterations = np.zeros(k, dtype=int)
+        # relative residual norms of the active columns in each iteration
+        history = [(active, np.linalg.norm(R[:, active], axis=0))]
+
+    # only the columns that haven't converged yet are kept in X_active
+    # etc., and written back to X when they converge
+    X_active, R_active = X[:, active], R[:, active]
+    if mask is not None:
+        mask_active = mask[:, active].astype(dtype)
+
+    def restrict(Y):
+        if mask is not None:
+            Y *= mask_active
+        return Y
+
+    Z = R_active if M is None else restrict(M @ R_active)
+    P = np.array(Z)
+    rz = np.einsum('ij,ij->j', R_active, Z)
+    for it in range(1, maxiter + 1):
+        if active.size == 0:
+            break
+        AP = restrict(A @ P)
+        alpha = rz / np.einsum('ij,ij->j', P, AP)
+        X_active += alpha * P
+        R_active -= alpha * AP
+
+        norms = np.linalg.norm(R_active, axis=0)
+        if record:
+            iterations[active] = it
+            history.append((active, norms))
+        converged = norms <= threshold[active]
+        if converged.any():
+            X[:, active] = X_active
+            keep = ~converged
+            active, X_active, R_active, P, rz = (
+                active[keep], X_active[:, keep], R_active[:, keep],
+                P[:, keep], rz[keep])
+            if mask is not None:
+                mask_active = mask_active[:, keep]
+        if active.size == 0:
+            break
+
+        Z = R_active if M is None else restrict(M @ R_active)
+        rz_new = np.einsum('ij,ij->j', R_active, Z)
+        P = Z + (rz_new / rz) * P
+        rz = rz_new
+
+    X[:, active] = X_active
+    info[active] = maxiter
+    if record:
+        residuals = [[] for _ in range(k)]
+        scale = np.where(b_norms > 0, b_norms, 1)
+        for columns, norms in history:
+            for column, norm in zip(columns, norms / scale[columns]):
+                residuals[column].append(float(norm))
+        for column in range(k):
+            telemetry.record("cg", solver="block", column=column,
+                             iterations=int(iterations[column]),
+                             info=int(info[column]), residuals=residuals[column])
+    return X, info
+
+
+def _preconditioner(lap_sparse, mode, grid=None):
+    """Build the preconditioner for one of the CG modes (None for 'cg').
+
+    grid is the shape and labels of a grid graph, which the 'cg_gmg' mode
+    requires.
+    """
+    if mode == 'cg':
+        return None
+    if mode == 'cg_gmg':
+        return GridMultigrid(lap_sparse, *grid)
+    if mode == 'cg_mg' and amg_loaded:
+        ml = ruge_stuben_solver(lap_sparse.tocsr())
+        return ml.aspreconditioner(cycle='V')
+    return sparse.diags(1.0 / lap_sparse.diagonal())
+
+
+def _solve_linear_system(lap_sparse, B, tol, mode, cache_key=None,
+                         infer_last_label=False, x0=None, M=None, grid=None,
+                         precision='double'):
+    """Solve lap_sparse X.T = B.
+
+    x0 is an optional initial guess for the CG modes, with the same
+    shape as the returned X. M is a preconditioner built by
+    _preconditioner, which is built here (with grid) if it isn't given.
+    For precision 'mixed' or 'single', see _solve_mixed (M is not used).
+    """
 
     if mode is None:
         mode = 'cg_j'
 
+    if infer_last_label:
+        # The probabilities of all labels sum to one, so we only need
+        # to solve for all but the last one
+        X = _solve_linear_system(lap_sparse, B[:, :-1], tol, mode, cache_key,
+                                 x0=None if x0 is None else x0[:-1], M=M, grid=grid,
+                                 precision=precision)
+        return np.vstack([X, 1 - X.sum(axis=0)])
+
+    if precision != 'double':
+        return _solve_mixed(lap_sparse, B, tol, mode, x0, grid)
+
     if mode == 'cg_mg' and not amg_loaded:
         warn('"cg_mg" not available, it requires pyamg to be installed. '
              'The "cg_j" mode will be used instead.',
@@ -146,7 +445,39 @@ def _solve_linear_system(lap_sparse, B, tol, mode):
         mode = 'cg_j'
 
     if mode == 'bf':
-        X = spsolve(lap_sparse, B.toarray()).T
+        with telemetry.stage("solve", mode=mode):
+            X = spsolve(lap_sparse, B.toarray()).T
+    elif mode == 'factorized':
+        with telemetry.stage("factorization", cached=cache_key in _factorization_cache):
+            solve = _factorize(lap_sparse, cache_key)
+        with telemetry.stage("solve", mode=mode):
+            X = solve(B.toarray()).T
+    elif mode in ('cg_block', 'cg_gmg'):
+        if M is None:
+            with telemetry.stage("preconditioner", mode=mode):
+                M = _preconditioner(lap_sparse, mode, grid)
+        with telemetry.stage("solve", mode=mode):
+            X, info = _block_cg(lap_sparse, B.toarray(), tol, M=M,
+                                X0=None if x0 is None else x0.T)
+        if np.any(info > 0):
+            warn("Conjugate gradient convergence to tolerance not achieved "
+                 "for labels {}. Consider decreasing beta to improve system "
+                 "conditionning.".format(list(np.flatnonzero(info) + 1)),
+                 stacklevel=2)
+        X = X.T
+    elif mode == 'cg_dd':
+        from .parallel import DomainDecomposition
+        with telemetry.stage("preconditioner", mode=mode):
+            decomposition = DomainDecomposition(lap_sparse, B.shape[1])
+        with decomposition, telemetry.stage("solve", mode=mode):
+            X, info = _block_cg(decomposition, B.toarray(), tol,
+                                M=decomposition.preconditioner,
+                                X0=None if x0 is None else x0.T)
+        if np.any(info > 0):
+            warn("Conjugate gradient convergence to tolerance not achieved "
+                 "for labels {}.".format(list(np.flatnonzero(info) + 1)),
+                 stacklevel=2)
+        X = X.T
     else:
         maxiter = None
         if mode == 'cg':
@@ -155,18 +486,17 @@ def _solve_linear_system(lap_sparse, B, tol, mode):
                      'Consider building Scipy with UMFPACK or use a '
                      'preconditioned version of CG ("cg_j" or "cg_mg" modes).',
                      stacklevel=2)
-            M = None
-        elif mode == 'cg_j':
-            M = sparse.diags(1.0 / lap_sparse.diagonal())
-        else:
-            # mode == 'cg_mg'
+        elif mode == 'cg_mg':
             lap_sparse = lap_sparse.tocsr()
-            ml = ruge_stuben_solver(lap_sparse)
-            M = ml.aspreconditioner(cycle='V')
             maxiter = 30
-        cg_out = [
-            cg(lap_sparse, B[:, i].toarray(), tol=tol, M=M, maxiter=maxiter)
-            for i in range(B.shape[1])]
+        if M is None:
+            with telemetry.stage("preconditioner", mode=mode):
+                M = _preconditioner(lap_sparse, mode)
+        cg_out = []
+        for i in range(B.shape[1]):
+            with telemetry.stage("solve", mode=mode, label=i + 1):
+                cg_out.append(_cg(lap_sparse, B[:, i].toarray(), tol, M, maxiter,
+                                  None if x0 is None else x0[i], label=i + 1))
         if np.any([info > 0 for _, info in cg_out]):
             warn("Conjugate gradient convergence to tolerance not achieved. "
                  "Consider decreasing beta to improve system conditionning.",
@@ -176,40 +506,490 @@ def _solve_linear_system(lap_sparse, B, tol, mode):
     return X
 
 
-def random_walker(n, edges, weights, labels, mode='cg_j', tol=1.e-3,
-                  return_full_prob=True):
-    """Random walker algorithm for segmentation from markers."""
-    # Parse input data
-    if mode not in ('cg_mg', 'cg', 'bf', 'cg_j', None):
+def _solve_mixed(lap_sparse, B, tol, mode, x0=None, grid=None, max_refinements=10):
+    """Solve lap_sparse X.T = B with float32 CG and iterative refinement.
+
+    The matrix, the preconditioner and all vectors of the block CG are
+    float32, which halves their memory and the memory traffic of the
+    products. CG only solves for the correction of the current residual,
+    and the residual is then recomputed in float64, which is repeated until
+    it is below tol (float32 CG alone would stall at a relative residual
+    of about 1e-6).
+    """
+    B = B.toarray()
+    lap_single = lap_sparse.astype(np.float32)
+    with telemetry.stage("preconditioner", mode=mode, precision="single"):
+        M = _preconditioner(lap_single, mode, grid)
+    X = np.zeros(B.shape) if x0 is None else np.array(x0.T, dtype=float)
+    R = B - lap_sparse @ X
+    threshold = tol * np.linalg.norm(B, axis=0)
+    for refinement in range(max_refinements):
+        norms = np.linalg.norm(R, axis=0)
+        active = np.flatnonzero(norms > threshold)
+        if active.size == 0:
+            break
+        # each correction only has to reduce the residual to a bit below
+        # the threshold, but float32 can't go much further than 1e-5
+        inner_tol = np.maximum(0.9 * threshold[active] / norms[active], 1e-5)
+        # normalized, so that small residuals don't underflow in float32
+        R_single = (R[:, active] / norms[active]).astype(np.float32)
+        with telemetry.stage("solve", mode=mode, precision="single",
+                             refinement=refinement):
+            D, _ = _block_cg(lap_single, R_single, inner_tol, M=M)
+        X[:, active] += D * norms[active]
+        R[:, active] = B[:, active] - lap_sparse @ X[:, active]
+    else:
+        if np.any(np.linalg.norm(R, axis=0) > threshold):
+            warn("Iterative refinement did not reach the tolerance for labels "
+                 "{}.".format(list(np.flatnonzero(
+                     np.linalg.norm(R, axis=0) > threshold) + 1)),
+                 stacklevel=2)
+    return X.T
+
+
+def _cg(A, b, tol, M, maxiter, x0, **fields):
+    """scipy's cg, recording the iterations and residuals if telemetry is active."""
+    if not telemetry.active():
+        return cg(A, b, tol=tol, M=M, maxiter=maxiter, x0=x0)
+    b = np.ravel(b)
+    b_norm = np.linalg.norm(b) or 1
+    residuals = []
+
+    def callback(xk):
+        # costs one extra product per iteration, but only when recording
+        residuals.append(float(np.linalg.norm(b - A @ xk) / b_norm))
+
+    x, info = cg(A, b, tol=tol, M=M, maxiter=maxiter, x0=x0, callback=callback)
+    telemetry.record("cg", solver="scipy", iterations=len(residuals), info=int(info),
+                     residuals=residuals, **fields)
+    return x, info
+
+
+MODES = ('cg_mg', 'cg', 'cg_j', 'cg_block', 'cg_gmg', 'cg_dd', 'cg_mf', 'bf',
+         'factorized')
+PRECISIONS = ('double', 'mixed', 'single')
+# modes that support the mixed and single precision
+MIXED_PRECISION_MODES = ('cg_block', 'cg_gmg')
+
+
+def _check_mode(mode, shape, precision='double'):
+    if mode not in MODES + (None,):
         raise ValueError(
-            "{mode} is not a valid mode. Valid modes are 'cg_mg',"
-            " 'cg', 'cg_j', 'bf' and None".format(mode=mode))
+            "{mode} is not a valid mode. Valid modes are {modes}"
+            " and None".format(
+                mode=mode, modes=", ".join(repr(m) for m in MODES)))
+    if precision not in PRECISIONS:
+        raise ValueError("{!r} is not a valid precision. Valid precisions are "
+                         "{}".format(precision, ", ".join(repr(p) for p in PRECISIONS)))
+    if precision != 'double' and mode not in MIXED_PRECISION_MODES:
+        raise ValueError("precision={!r} requires one of the modes {}".format(
+            precision, ", ".join(repr(m) for m in MIXED_PRECISION_MODES)))
+    if mode in ('cg_mf', 'cg_gmg') and shape is None:
+        raise ValueError("The {!r} mode requires the shape of the grid".format(mode))
+
+
+def _grid_operator(shape, weights, labels):
+    """Matrix-free Laplacian of a grid graph as built by graph_from_hed.
+
+    The operator acts on vectors over all grid nodes (instead of only the
+    unlabeled ones, which saves index maps). Rows of seeded nodes are
+    replaced by identity rows and their columns are zeroed out, so the
+    solution for the unlabeled nodes is the same as for the reduced system.
+    Returns the operator and the matching Jacobi preconditioner.
+    """
+    n_x, n_y = shape
+    n = n_x * n_y
+    right, down = _grid_weights(shape, weights)
+    right, down = right[:, :, None], down[:, :, None]
+    unlabeled = (labels == 0).reshape((n_x, n_y, 1))
+
+    degrees = np.zeros((n_x, n_y, 1))
+    degrees[:, :-1] += right
+    degrees[:, 1:] += right
+    degrees[:-1] += down
+    degrees[1:] += down
+    diagonal = np.where(unlabeled, degrees, 1)
+
+    def matmat(X):
+        X = X.reshape((n_x, n_y, -1))
+        X_unlabeled = X * unlabeled
+        Y = degrees * X_unlabeled
+        Y[:, :-1] -= right * X_unlabeled[:, 1:]
+        Y[:, 1:] -= right * X_unlabeled[:, :-1]
+        Y[:-1] -= down * X_unlabeled[1:]
+        Y[1:] -= down * X_unlabeled[:-1]
+        Y = np.where(unlabeled, Y, X)
+        return Y.reshape((n, -1))
+
+    def jacobi(X):
+        return (X.reshape((n_x, n_y, -1)) / diagonal).reshape((n, -1))
+
+    A = LinearOperator((n, n), matvec=matmat, matmat=matmat)
+    M = LinearOperator((n, n), matvec=jacobi, matmat=jacobi)
+    return A, M
+
+
+def _grid_rhs(shape, weights, labels, nlabels):
+    """Right hand side for _grid_operator, of shape (n, nlabels)."""
+    n_x, n_y = shape
+    right, down = _grid_weights(shape, weights)
+    labels = labels.reshape((n_x, n_y))
+    B = np.zeros((n_x, n_y, nlabels))
+    for lab in range(1, nlabels + 1):
+        seeded = labels == lab
+        B[:, :-1, lab - 1] += right * seeded[:, 1:]
+        B[:, 1:, lab - 1] += right * seeded[:, :-1]
+        B[:-1, :, lab - 1] += down * seeded[1:]
+        B[1:, :, lab - 1] += down * seeded[:-1]
+    B[labels > 0] = 0
+    return B.reshape((n_x * n_y, nlabels))
+
+
+def _solve_matrix_free(shape, weights, labels, nlabels, tol,
+                       infer_last_label=False, x0=None):
+    """Solve the random walker system of a grid graph with the 'cg_mf' mode.
+
+    Returns X for the unlabeled nodes like _solve_linear_system.
+    """
+    A, M = _grid_operator(shape, weights, labels)
+    nsolve = nlabels - 1 if infer_last_label else nlabels
+    B = _grid_rhs(shape, weights, labels, nsolve)
+    unlabeled = labels == 0
+    X0 = None
+    if x0 is not None:
+        X0 = np.zeros(B.shape)
+        X0[unlabeled] = x0[:nsolve].T
+    X, info = _block_cg(A, B, tol, M=M, X0=X0)
+    if np.any(info > 0):
+        warn("Conjugate gradient convergence to tolerance not achieved "
+             "for labels {}. Consider decreasing beta to improve system "
+             "conditionning.".format(list(np.flatnonzero(info) + 1)),
+             stacklevel=2)
+    X = X[unlabeled].T
+    if infer_last_label:
+        X = np.vstack([X, 1 - X.sum(axis=0)])
+    return X
 
-    labels_dtype = labels.dtype
+
+def random_walker(n, edges, weights, labels, mode='cg_j', tol=1.e-3,
+                  return_full_prob=True, infer_last_label=False, x0=None,
+                  shape=None, precision='double'):
+    """Random walker algorithm for segmentation from markers.
+
+    If infer_last_label is True, the probabilities of the last label are
+    computed as one minus the sum of the others instead of solving for them.
+    This requires every node to be connected to some seed.
+
+    x0 is an optional initial guess for the probabilities, with the same
+    (nlabels, n) shape as the output for return_full_prob=True. It is only
+    used by the CG modes.
+
+    If the graph is a grid built by graph_from_hed, passing its shape
+    makes building the linear system faster (and edges may be None).
+    The 'cg_mf' mode requires the shape: it never builds a matrix and
+    applies the Laplacian directly from the weights of the grid. So does
+    the 'cg_gmg' mode, which coarsens the grid for its preconditioner.
+
+    precision='mixed' runs the CG of the 'cg_block' and 'cg_gmg' modes in
+    float32, with iterative refinement in float64 up to tol, and
+    precision='single' additionally returns float32 probabilities.
+    """
+    # Parse input data
+    _check_mode(mode, shape, precision)
 
     label_vals = np.unique(labels)
     if not (label_vals == 0).any():
         warn("No unlabelled nodes! Unlabelled nodes should have label 0")
-    nlabels = len(np.unique(labels)) - 1
+    nlabels = np.count_nonzero(label_vals)
+
+    if x0 is not None:
+        x0 = x0[:, labels == 0]
+
+    if mode == 'cg_mf':
+        with telemetry.stage("solve", mode=mode):
+            X = _solve_matrix_free(shape, weights, labels, nlabels, tol,
+                                   infer_last_label, x0)
+        with telemetry.stage("scatter"):
+            return _scatter(n, labels, X, return_full_prob)
 
     # Build the linear system (lap_sparse, B)
-    lap_sparse, B = _build_linear_system(edges, weights, labels, nlabels)
+    with telemetry.stage("assembly", grid=shape is not None):
+        lap_sparse, B = _build_linear_system(edges, weights, labels, nlabels,
+                                             shape)
 
     # Solve the linear system lap_sparse X = B
     # where X[i, j] is the probability that a marker of label i arrives
     # first at pixel j by anisotropic diffusion.
-    X = _solve_linear_system(lap_sparse, B, tol, mode)
+    cache_key = None
+    if mode == 'factorized':
+        with telemetry.stage("cache_key"):
+            cache_key = _system_key(edges, weights, labels, shape)
+    X = _solve_linear_system(lap_sparse, B, tol, mode, cache_key,
+                             infer_last_label, x0, grid=(shape, labels),
+                             precision=precision)
+
+    with telemetry.stage("scatter"):
+        return _scatter(n, labels, X, return_full_prob,
+                        np.float32 if precision == 'single' else np.float64)
 
+
+def _scatter(n, labels, X, return_full_prob, dtype=np.float64):
+    """Turn the solution for the unlabeled nodes into the output."""
     if return_full_prob:
         mask = labels == 0
 
-        out = np.zeros((nlabels, n))
-        for lab, (label_prob, prob) in enumerate(zip(out, X), start=1):
-            label_prob[mask] = prob
-            label_prob[labels == lab] = 1
+        out = np.zeros((X.shape[0], n), dtype=dtype)
+        out[:, mask] = X
+        seeded = np.flatnonzero(~mask)
+        out[labels[seeded] - 1, seeded] = 1
     else:
         X = np.argmax(X, axis=0) + 1
-        out = labels.astype(labels_dtype)
+        out = labels.astype(labels.dtype)
         out[labels == 0] = X
 
     return out
+
+
+def random_walker_stream(n, edges, weights, labels, mode='factorized', tol=1.e-3,
+                         shape=None, sink=None):
+    """Random walker for one label at a time, in O(n) memory for any number
+    of labels.
+
+    Returns the segmentation, i.e. the label with the highest probability
+    for each node (the same as 1 + argmax of the output of random_walker),
+    which is updated after each label. The probabilities of each label are
+    passed to sink(label, probabilities) as soon as they are solved (e.g.
+    to write them to a file) and are then overwritten by the next label, so
+    sink has to copy them if it keeps them. The factorization or the
+    preconditioner is built only once for all labels.
+
+    The other parameters are the same as for random_walker, except that
+    the 'cg_dd' and 'cg_mf' modes aren't supported.
+    """
+    _check_mode(mode, shape)
+    if mode in ('cg_dd', 'cg_mf'):
+        raise ValueError("The {!r} mode is not supported by "
+                         "random_walker_stream".format(mode))
+    if mode is None:
+        mode = 'cg_j'
+
+    mask = labels == 0
+    nlabels = np.count_nonzero(np.unique(labels))
+    with telemetry.stage("assembly", grid=shape is not None):
+        lap_sparse, B = _build_linear_system(edges, weights, labels, nlabels,
+                                             shape)
+    B = B.tocsc()
+
+    if mode in ('bf', 'factorized'):
+        # the same factorization is used for all labels, so 'bf' factorizes
+        # as well, but without the cache
+        cache_key = None
+        if mode == 'factorized':
+            with telemetry.stage("cache_key"):
+                cache_key = _system_key(edges, weights, labels, shape)
+        with telemetry.stage("factorization", cached=cache_key in _factorization_cache):
+            factorization = _factorize(lap_sparse, cache_key)
+
+        def solve(b):
+            return factorization(b.toarray()).ravel()
+    else:
+        with telemetry.stage("preconditioner", mode=mode):
+            M = _preconditioner(lap_sparse, mode, (shape, labels))
+
+        def solve(b):
+            return _solve_linear_system(lap_sparse, b, tol, mode, M=M)[0]
+
+    # the seeds of each label, to avoid comparing all labels for each label
+    seeded = np.flatnonzero(~mask)
+    seeded = seeded[np.argsort(labels[seeded], kind='stable')]
+    bounds = np.searchsorted(labels[seeded], np.arange(1, nlabels + 2))
+
+    potential = np.zeros(n)
+    highest = np.full(n, -np.inf)
+    segmentation = np.zeros(n, dtype=np.int64)
+    for lab in range(1, nlabels + 1):
+        with telemetry.stage("solve", mode=mode, label=lab):
+            x = solve(B[:, lab - 1])
+        with telemetry.stage("scatter"):
+            potential[~mask] = 0
+            potential[mask] = x
+            potential[seeded[bounds[lab - 1]:bounds[lab]]] = 1
+            # strictly higher, so that ties go to the first label like argmax
+            higher = potential > highest
+            highest[higher] = potential[higher]
+            segmentation[higher] = lab
+        if sink is not None:
+            sink(lab, potential)
+    return segmentation
+
+
+def random_walker_sequence(n, edges, weights, labels, mode='cg_j', tol=1.e-3,
+                           return_full_prob=True, init=None, reuse_tol=0.1,
+                           shape=None):
+    """Random walker for a sequence of weights on the same graph and seeds.
+
+    weights is a sequence of weight vectors, typically for increasing beta
+    values, which are solved in order. The solution for each one is the
+    initial guess for the next one, and the preconditioner is reused as
+    long as the diagonal of the Laplacian changed by less than reuse_tol
+    (relative to its norm) since the preconditioner was built.
+    For the first system, init can be None (start from zero), 'watershed'
+    (start from the watershed segmentation) or an initial guess as for
+    random_walker.
+
+    Returns a list with the output of random_walker for each weight vector.
+    """
+    _check_mode(mode, shape)
+    if mode is None:
+        mode = 'cg_j'
+
+    nlabels = np.count_nonzero(np.unique(labels))
+    mask = labels == 0
+
+    x0 = init
+    if isinstance(init, str):
+        if init != 'watershed':
+            raise ValueError("init must be None, 'watershed' or an array")
+        from .karger import watershed
+        from .image import _grid_edges
+        if edges is None:
+            edges = _grid_edges(*shape)
+        segmentation = watershed(n, edges, weights[0], labels)
+        x0 = (segmentation[None, :] ==
+              np.arange(1, nlabels + 1)[:, None]).astype(float)
+    if x0 is not None:
+        x0 = x0[:, mask]
+
+    outputs = []
+    M = None
+    diagonal = None
+    for w in weights:
+        if mode == 'cg_mf':
+            x0 = _solve_matrix_free(shape, w, labels, nlabels, tol, x0=x0)
+            outputs.append(_scatter(n, labels, x0, return_full_prob))
+            continue
+
+        lap_sparse, B = _build_linear_system(edges, w, labels, nlabels,
+                                             shape)
+
+        if mode.startswith('cg'):
+            new_diagonal = lap_sparse.diagonal()
+            if (diagonal is None or
+                    np.linalg.norm(new_diagonal - diagonal) >
+                    reuse_tol * np.linalg.norm(diagonal)):
+                M = _preconditioner(lap_sparse, mode, (shape, labels))
+                diagonal = new_diagonal
+
+        cache_key = None
+        if mode == 'factorized':
+            cache_key = _system_key(edges, w, labels, shape)
+        X = _solve_linear_system(lap_sparse, B, tol, mode, cache_key,
+                                 x0=x0, M=M)
+        x0 = X
+        outputs.append(_scatter(n, labels, X, return_full_prob))
+
+    return outputs
+
+
+def _grounded_factorization(lap):
+    """Factorize the Laplacian with one node of each component removed.
+
+    Returns a function computing G[:, nodes], where G is the inverse of
+    the grounded Laplacian, padded with zeros for the removed nodes,
+    as well as the component of each node.
+    """
+    n = lap.shape[0]
+    _, components = csgraph.connected_components(lap, directed=False)
+    _, ground = np.unique(components, return_index=True)
+    keep = np.ones(n, dtype=bool)
+    keep[ground] = False
+    new_index = np.cumsum(keep) - 1
+    solve = _factorize(lap[keep][:, keep])
+
+    def columns(nodes):
+        rhs = np.zeros((new_index[-1] + 1, nodes.size))
+        kept = keep[nodes]
+        rhs[new_index[nodes[kept]], np.flatnonzero(kept)] = 1
+        G = np.zeros((n, nodes.size))
+        G[keep] = solve(rhs)
+        return G
+
+    return columns, components
+
+
+def _solve_schur(columns, components, seeds, Y):
+    """Random walker probabilities of all nodes from the grounded inverse G.
+
+    The potentials x satisfy L x = E f for some flows f out of the seeds
+    that sum to 0 in each component, so x = G[:, seeds] f + c with a
+    constant c per component. The small system for f and c follows from
+    the boundary condition x[seeds] = Y.
+    """
+    n_seeds = seeds.size
+    n_components = components.max() + 1
+    G = columns(seeds)
+    C = np.zeros((n_seeds, n_components))
+    C[np.arange(n_seeds), components[seeds]] = 1
+    # components without seeds don't have a solution, their potentials
+    # are set to 0 (by c = 0) just like with the other modes
+    no_seeds = C.sum(axis=0) == 0
+    system = np.block([[G[seeds], C], [C.T, np.diag(no_seeds * 1.0)]])
+    rhs = np.vstack([Y, np.zeros((n_components, Y.shape[1]))])
+    solution = np.linalg.solve(system, rhs)
+    return G @ solution[:n_seeds] + solution[n_seeds:][components]
+
+
+def random_walker_seed_sets(n, edges, weights, seed_sets, mode='factorized',
+                            tol=1.e-3):
+    """Random walker on one graph for many different sets of seeds.
+
+    seed_sets is an (S, n) array with one labelling (as for random_walker)
+    per row. Returns the (S, nlabels, n) probabilities, where nlabels is the
+    highest label over all seed sets.
+
+    The default 'factorized' mode factorizes the Laplacian of the whole
+    graph (grounded at one node per component) only once, and then only
+    needs a solve for each seed and a small dense system per seed set (a
+    Schur complement for the seeds). So solving many small seed sets costs
+    little more than a single one.
+
+    In the 'cg_block' mode, the Laplacian is built once and all seed sets
+    are solved together: each of the S * nlabels columns is restricted to
+    the unlabeled nodes of its seed set by a mask, so that one block CG
+    iteration needs only a single product with the shared Laplacian
+    instead of slicing it for every seed set.
+    """
+    if mode not in ('cg_block', 'factorized'):
+        raise ValueError("{mode} is not a valid mode. Valid modes are "
+                         "'cg_block' and 'factorized'".format(mode=mode))
+    seed_sets = np.asarray(seed_sets)
+    n_sets = seed_sets.shape[0]
+    nlabels = int(seed_sets.max())
+    lap = _build_laplacian(edges, weights, n)
+    unlabeled = (seed_sets == 0).T
+
+    # seed indicators Y[j, s, k] = 1 if node j is a seed with label k + 1
+    # in seed set s
+    Y = (seed_sets.T[:, :, None] == np.arange(1, nlabels + 1)).astype(float)
+    out = Y.transpose((1, 2, 0)).copy()
+
+    if mode == 'factorized':
+        columns, components = _grounded_factorization(lap)
+        for s in range(n_sets):
+            seeds = np.flatnonzero(~unlabeled[:, s])
+            X = _solve_schur(columns, components, seeds, Y[seeds, s])
+            out[s][:, unlabeled[:, s]] = X[unlabeled[:, s]].T
+        return out
+
+    # one column per seed set and label, each restricted to the unlabeled
+    # nodes of its seed set
+    mask = np.repeat(unlabeled, nlabels, axis=1)
+    B = -(lap @ Y.reshape((n, -1)))
+    M = sparse.diags(1.0 / lap.diagonal())
+    X, info = _block_cg(lap, B, tol, M=M, mask=mask)
+    if np.any(info > 0):
+        warn("Conjugate gradient convergence to tolerance not achieved "
+             "for {} of the {} columns.".format(
+                 np.count_nonzero(info), info.size))
+    X = X.reshape((n, n_sets, nlabels)).transpose((1, 2, 0))
+    return np.where(unlabeled.T[:, None, :], X, out)
@@ -0,0 +1,182 @@
+"""
+Reduction of seeded graphs before solving.
+
+reduce_graph shrinks a graph without changing the solution, the solvers
+run on the reduced graph and Reduction.expand maps their result back to
+all nodes of the original graph:
+- all seeds of a label are collapsed into a single node (parallel edges
+  are combined, see below)
+- components without seeds are dropped, their nodes get potential 0 (or
+  label 0), just like the nodes that Karger never connects to a seed
+- unseeded leaves (degree 1) are eliminated repeatedly, they always end
+  up with the value of their neighbour
+- with series=True, unseeded nodes of degree 2 are eliminated as well and
+  their two edges are replaced by one with weight w1 w2 / (w1 + w2). This
+  is only exact for the random walker (it is the Schur complement of the
+  Laplacian), the potential of the node is the weighted mean of its
+  neighbours'.
+
+Parallel edges are combined by summing their weights, which is exact for
+the random walker and for Karger (the minimum of exponential scores with
+rates w1 and w2 is exponential with rate w1 + w2). For the watershed, the
+order of the weights matters instead, so use combine="max" there.
+
+contract is an optional weight threshold: edges at least as strong are
+contracted, unless that would merge different seeds. This is not exact,
+but a good approximation if the threshold is much larger than all other
+weights.
+"""
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+
+def _coalesce(i, j, w, combine):
+    """Edges with i < j, no self-loops and parallel edges combined."""
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    keep = i != j
+    i, j, w = i[keep], j[keep], w[keep]
+    pairs, index = np.unique(np.stack([i, j]), axis=1, return_inverse=True)
+    index = index.ravel()
+    if combine == "max":
+        combined = np.full(pairs.shape[1], -np.inf)
+        np.maximum.at(combined, index, w)
+    else:
+        combined = np.bincount(index, weights=w, minlength=pairs.shape[1])
+    return pairs[0], pairs[1], combined
+
+
+class Reduction:
+    """The reduced graph (n, edges, weights, seeds, with the same meaning
+    as for the solvers) and what is needed to expand results."""
+
+    def __init__(self, n_original, representative, kept, eliminations,
+                 edges, weights, seeds):
+        self.n_original = n_original
+        self.n = kept.size
+        self.edges = edges
+        self.weights = weights
+        self.seeds = seeds
+        self._representative = representative
+        self._kept = kept
+        self._eliminations = eliminations
+
+    def expand(self, values):
+        """Map values of the nodes of the reduced graph, an (k, n) array of
+        potentials or an array of n labels, to the nodes of the original
+        graph."""
+        values = np.asarray(values)
+        full = np.zeros(values.shape[:-1] + (self.n_original,))
+        full[..., self._kept] = values
+        # eliminated nodes get the weighted mean of the neighbours they had
+        # when they were eliminated, which are expanded before them
+        for nodes, neighbours, weights in reversed(self._eliminations):
+            total = sum(weights)
+            full[..., nodes] = sum(w * full[..., nbrs]
+                                   for nbrs, w in zip(neighbours, weights)) / total
+        full = full[..., self._representative]
+        if values.dtype.kind in "iu":
+            full = np.rint(full).astype(values.dtype)
+        return full
+
+
+def reduce_graph(n, edges, weights, seeds, series=False, contract=None, combine="sum"):
+    """Reduce a seeded graph, see the module docstring. Returns a Reduction."""
+    n = int(n)
+    edges = np.asarray(edges, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    seeds = np.asarray(seeds, dtype=np.int64).ravel()
+
+    # representative of each node: the first seed of each label for seeds,
+    # the node itself otherwise (unless it is contracted)
+    representative = np.arange(n)
+    if contract is not None:
+        strong = weights >= contract
+        graph = sparse.coo_matrix((np.ones(strong.sum()), tuple(edges[:, strong])),
+                                  shape=(n, n))
+        num, component = csgraph.connected_components(graph, directed=False)
+        # contract only components with at most one seed label
+        seeded = seeds > 0
+        low = np.full(num, np.iinfo(np.int64).max)
+        high = np.zeros(num, dtype=np.int64)
+        np.minimum.at(low, component[seeded], seeds[seeded])
+        np.maximum.at(high, component[seeded], seeds[seeded])
+        contractible = (high == 0) | (low == high)
+        # the representative is a seed of the component if it has one
+        first = np.full(num, -1)
+        first[component[seeded][::-1]] = np.flatnonzero(seeded)[::-1]
+        _, first_node = np.unique(component, return_index=True)
+        first = np.where(first >= 0, first, first_node)
+        merge = contractible[component]
+        representative[merge] = first[component[merge]]
+        seeds = seeds.copy()
+        np.maximum.at(seeds, representative[merge], seeds[merge])
+    labels, first_seed = np.unique(seeds[representative], return_index=True)
+    if labels.size and labels[0] == 0:
+        labels, first_seed = labels[1:], first_seed[1:]
+    seed_rep = np.zeros(labels.max(initial=0) + 1, dtype=np.int64)
+    seed_rep[labels] = representative[first_seed]
+    node_seeds = seeds[representative]
+    representative = np.where(node_seeds > 0, seed_rep[node_seeds], representative)
+    seeds = np.zeros(n, dtype=np.int64)
+    seeds[representative] = node_seeds
+
+    i, j, w = _coalesce(representative[edges[0]], representative[edges[1]],
+                        weights, combine)
+
+    # drop components without seeds
+    alive = representative == np.arange(n)
+    graph = sparse.coo_matrix((np.ones(i.size), (i, j)), shape=(n, n))
+    num, component = csgraph.connected_components(graph, directed=False)
+    has_seed = np.bincount(component, weights=seeds > 0, minlength=num) > 0
+    alive &= has_seed[component]
+    keep = alive[i]
+    i, j, w = i[keep], j[keep], w[keep]
+
+    eliminations = []
+    rng = np.random.default_rng(0)
+    priority = rng.permutation(n)
+    while True:
+        degree = np.bincount(i, minlength=n) + np.bincount(j, minlength=n)
+        free = alive & (seeds == 0)
+        # leaves first, series nodes only if there are none
+        for d in (1, 2) if series else (1,):
+            candidates = free & (degree == d)
+            if candidates.any():
+                break
+        else:
+            break
+        if d == 2:
+            # an independent set of candidates, so that no eliminated node
+            # is the neighbour of another one: the candidates whose
+            # priority is lower than that of all neighbouring candidates
+            lowest = np.where(candidates, priority, n)
+            neighbour_min = np.full(n, n)
+            np.minimum.at(neighbour_min, i, lowest[j])
+            np.minimum.at(neighbour_min, j, lowest[i])
+            candidates &= priority < neighbour_min
+        # the edges of the candidates, as (node, neighbour, weight)
+        at_i, at_j = candidates[i], candidates[j]
+        nodes = np.concatenate([i[at_i], j[at_j]])
+        nbrs = np.concatenate([j[at_i], i[at_j]])
+        ws = np.concatenate([w[at_i], w[at_j]])
+        order = np.argsort(nodes, kind="stable")
+        nodes, nbrs, ws = nodes[order], nbrs[order], ws[order]
+        keep = ~(at_i | at_j)
+        i, j, w = i[keep], j[keep], w[keep]
+        if d == 1:
+            eliminations.append((nodes, [nbrs], [ws]))
+        else:
+            a, b = nbrs[0::2], nbrs[1::2]
+            wa, wb = ws[0::2], ws[1::2]
+            eliminations.append((nodes[0::2], [a, b], [wa, wb]))
+            i, j, w = _coalesce(np.concatenate([i, a]), np.concatenate([j, b]),
+                                np.concatenate([w, wa * wb / (wa + wb)]), "sum")
+        alive[nodes] = False
+
+    kept = np.flatnonzero(alive)
+    index = np.full(n, -1)
+    index[kept] = np.arange(kept.size)
+    return Reduction(n, representative, kept, eliminations,
+                     np.stack([index[i], index[j]]), w, seeds[kept])
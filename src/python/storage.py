@@ -0,0 +1,289 @@
+"""
+Reading and writing graph and result files.
+
+There are two layouts. The plain one (the default, and the only one the
+older scripts know) stores edges and seeds as dense int64 arrays and all
+floats as float64, uncompressed, and result files of Karger and the
+watersheds contain a copy of their graph.
+
+With COMPACT_STORAGE=1 (environment variable), files are written in the
+compact layout instead:
+- edges are int32, seeds are stored sparsely as seeds/nodes and
+  seeds/labels, and with FLOAT32_WEIGHTS=1 the weights are float32
+- potentials are quantized to uint16 (with a "scale" attribute, the
+  error is below 1e-5) and segmentations use the smallest unsigned type
+- all arrays are chunked and compressed with gzip
+- result files don't contain their graph, only its path (relative to the
+  result file) in the "graph" attribute
+
+The readers handle both layouts, so the two can be mixed. File gives
+lazy access to the datasets: nothing is read until a dataset is sliced,
+and uncompressed datasets are memory-mapped.
+"""
+
+import os
+import shutil
+
+import h5py
+import numpy as np
+
+GRAPH_ATTRIBUTE = "graph"
+QUANTIZATION = np.uint16
+
+
+def compact():
+    return os.environ.get("COMPACT_STORAGE", "0") not in ("", "0")
+
+
+def float32_weights():
+    return compact() and os.environ.get("FLOAT32_WEIGHTS", "0") not in ("", "0")
+
+
+def create_dataset(f, name, data):
+    """Create a dataset, chunked and compressed in the compact layout."""
+    data = np.asarray(data)
+    if compact() and data.ndim > 0 and data.size > 0:
+        return f.create_dataset(name, data=data, chunks=True,
+                                compression="gzip", shuffle=True)
+    return f.create_dataset(name, data=data)
+
+
+def create_empty_dataset(f, name, shape, dtype):
+    """Create a dataset that is filled in slices later (like
+    create_dataset, chunked and compressed in the compact layout)."""
+    if compact() and np.prod(shape) > 0:
+        return f.create_dataset(name, shape=shape, dtype=dtype, chunks=True,
+                                compression="gzip", shuffle=True)
+    return f.create_dataset(name, shape=shape, dtype=dtype)
+
+
+def edge_dtype(n):
+    """Type of the edges of a graph with n nodes in the current layout."""
+    return np.int32 if compact() and n < np.iinfo(np.int32).max else np.int64
+
+
+def weight_dtype():
+    """Type of the weights in the current layout."""
+    return np.float32 if float32_weights() else np.float64
+
+
+def _remove(path):
+    # Remove the hdf5 file if it exists, to avoid errors from h5py
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _write_edges(f, edges, n):
+    if compact() and n < np.iinfo(np.int32).max:
+        edges = edges.astype(np.int32)
+    create_dataset(f, "edges", edges)
+
+
+def _write_weights(f, name, weights):
+    if float32_weights():
+        weights = weights.astype(np.float32)
+    create_dataset(f, name, weights)
+
+
+def write_seeds(f, seeds):
+    seeds = np.asarray(seeds).ravel()
+    if not compact():
+        create_dataset(f, "seeds", seeds)
+        return
+    nodes = np.flatnonzero(seeds)
+    create_dataset(f, "seeds/nodes", nodes.astype(np.int32))
+    create_dataset(f, "seeds/labels", _smallest(seeds[nodes]))
+    f["seeds"].attrs["n"] = seeds.size
+
+
+def write_graph(path, n, edges, weights, seeds=None, **datasets):
+    """Write a graph file.
+
+    weights is either an array or a dict from beta (as a string) to
+    weights, which are written as weights/<beta> together with the list
+    of betas. datasets are additional arrays, like the image or the
+    ground truth.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    _remove(path)
+    with h5py.File(path, "w") as f:
+        for name, data in datasets.items():
+            create_dataset(f, name, data)
+        f.create_dataset("n", data=n)
+        _write_edges(f, edges, n)
+        if seeds is not None:
+            write_seeds(f, seeds)
+        if isinstance(weights, dict):
+            f.create_dataset("betas", data=np.array(list(weights), dtype="S"))
+            for beta, w in weights.items():
+                _write_weights(f, "weights/" + beta, w)
+        else:
+            _write_weights(f, "weights", weights)
+
+
+def start_result(result_path, graph_path):
+    """Create the result file of a method whose results include the graph.
+
+    In the plain layout, the graph is copied (just like the Julia scripts
+    do), in the compact layout, only a reference to it is written.
+    """
+    os.makedirs(os.path.dirname(result_path) or ".", exist_ok=True)
+    if not compact():
+        shutil.copyfile(graph_path, result_path)
+        return
+    _remove(result_path)
+    with h5py.File(result_path, "w") as f:
+        f.attrs[GRAPH_ATTRIBUTE] = os.path.relpath(
+            graph_path, os.path.dirname(os.path.abspath(result_path)))
+
+
+def _smallest(labels):
+    labels = np.asarray(labels)
+    return labels.astype(np.min_scalar_type(max(int(labels.max(initial=0)), 0)))
+
+
+def write_potential(f, name, potential):
+    if compact():
+        # potentials are probabilities, so they are quantized over [0, 1]
+        scale = 1 / np.iinfo(QUANTIZATION).max
+        dataset = create_dataset(
+            f, name, np.round(np.clip(potential, 0, 1) / scale).astype(QUANTIZATION))
+        dataset.attrs["scale"] = scale
+    else:
+        create_dataset(f, name, potential)
+
+
+def write_labels(f, name, labels):
+    """Write labels (e.g. a segmentation) with the smallest type that fits
+    in the compact layout and as they are otherwise."""
+    create_dataset(f, name, _smallest(labels) if compact() else labels)
+
+
+def write_potentials(path, pots, multi=None):
+    """Write potentials like calculate_rw_potential.py (only the potential of
+    the first label) or calculate_all_rw_potentials.py (the potentials of
+    all labels and the segmentation). multi defaults to the latter for more
+    than two labels. The file is appended to, if it exists."""
+    if multi is None:
+        multi = pots.shape[0] > 2
+    with h5py.File(path, "a") as f:
+        if multi:
+            for i in range(pots.shape[0]):
+                write_potential(f, "potential/" + str(i + 1), pots[i])
+            write_labels(f, "segmentation", 1 + np.argmax(pots, axis=0))
+        else:
+            write_potential(f, "potential", pots[0])
+
+
+class _View:
+    """Lazily sliced dataset, with a function applied to each slice."""
+
+    def __init__(self, dataset, transform, shape=None, dtype=None):
+        self.dataset = dataset
+        self.transform = transform
+        self.shape = dataset.shape if shape is None else shape
+        self.dtype = dtype
+
+    def __getitem__(self, index):
+        return self.transform(self.dataset, index)
+
+    def __len__(self):
+        return self.shape[0]
+
+
+def _dequantize(dataset, index):
+    return dataset[index] * dataset.attrs["scale"]
+
+
+def _as_int64(dataset, index):
+    return np.asarray(dataset[index]).astype(np.int64)
+
+
+def _dense_seeds(group, index):
+    seeds = np.zeros(group.attrs["n"], dtype=np.int64)
+    seeds[group["nodes"][()]] = group["labels"][()]
+    return seeds[index]
+
+
+def _mmap(dataset):
+    """Memory-map the dataset if it is stored contiguously and uncompressed."""
+    if (dataset.chunks is not None or dataset.ndim == 0 or dataset.size == 0
+            or dataset.dtype.kind not in "biuf"):
+        return None
+    offset = dataset.id.get_offset()
+    if offset is None:
+        return None
+    return np.memmap(dataset.file.filename, mode="r", dtype=dataset.dtype,
+                     shape=dataset.shape, offset=offset)
+
+
+class File:
+    """Read-only view of a graph or result file in either layout.
+
+    f[name] is a lazy, sliceable dataset (use f[name][()] to read it) that
+    is the same in both layouts: potentials are dequantized, sparse seeds
+    and labels are returned as dense int64 arrays, and datasets that are
+    missing from a result file are read from its graph. Use as a context
+    manager, or close() it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = h5py.File(path, "r")
+        self.graph = None
+        reference = self.file.attrs.get(GRAPH_ATTRIBUTE)
+        if reference is not None:
+            self.graph = File(os.path.join(os.path.dirname(os.path.abspath(path)),
+                                           reference))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+        if self.graph is not None:
+            self.graph.close()
+
+    def __contains__(self, name):
+        return name in self.file or (self.graph is not None and name in self.graph)
+
+    @property
+    def attrs(self):
+        return self.file.attrs
+
+    def __getitem__(self, name):
+        if name not in self.file and self.graph is not None:
+            return self.graph[name]
+        item = self.file[name]
+        if isinstance(item, h5py.Group):
+            if "nodes" in item and "labels" in item:
+                return _View(item, _dense_seeds, shape=(int(item.attrs["n"]),),
+                             dtype=np.int64)
+            return item
+        if "scale" in item.attrs:
+            return _View(item, _dequantize, dtype=np.float64)
+        if item.dtype.kind == "u" and item.dtype != np.uint64:
+            # compact labels, which would overflow in e.g. labels - 1
+            return _View(item, _as_int64, dtype=np.int64)
+        mapped = _mmap(item)
+        return item if mapped is None else mapped
+
+
+def read_graph(path, beta=None):
+    """n, edges, weights, seeds and shape (of the image, None for graphs
+    that aren't images) of a graph file, with the types the solvers
+    expect. beta selects the weights of a file with several betas."""
+    with File(path) as f:
+        n = int(f["n"][()])
+        edges = np.asarray(f["edges"][()]).astype(np.int64)
+        weights = np.asarray(f["weights" if beta is None else "weights/" + beta][()])
+        weights = weights.astype(np.float64)
+        seeds = np.asarray(f["seeds"][()]).astype(np.int64) if "seeds" in f else None
+        # graphs of images are grids, which can be assembled faster
+        shape = f["image"].shape[:2] if "image" in f else None
+    return n, edges, weights, seeds, shape
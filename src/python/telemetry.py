@@ -0,0 +1,129 @@
+"""
+Opt-in instrumentation of the solvers.
+
+Nothing is recorded unless a Recorder is active:
+
+    with Recorder(graph="grabcut/banana1/10") as recorder:
+        random_walker(...)
+    recorder.records
+
+Each stage of a computation (loading, assembly, preconditioner setup,
+solves, ...) wrapped in stage() adds a record with its wall time and the
+memory it allocated (as traced by tracemalloc), and the CG solvers add
+records with their iteration counts, residual histories and info codes.
+Records are plain dicts, so that they can be sent between processes and
+written as JSON. The fields given to the Recorder (e.g. the graph name)
+are added to all records, and summarize() aggregates records from many
+runs into a profile.
+"""
+
+import time
+import tracemalloc
+from contextlib import contextmanager
+from collections import defaultdict
+
+# the active recorder, if any
+_recorder = None
+
+
+def active():
+    return _recorder is not None
+
+
+class Recorder:
+    """Collects the records of everything run while it is active.
+
+    fields are added to every record. If trace_memory is True, tracemalloc
+    is started (unless it already runs), which slows down the computation
+    a bit, otherwise only times are recorded.
+    """
+
+    def __init__(self, trace_memory=True, **fields):
+        self.fields = fields
+        self.trace_memory = trace_memory
+        self.records = []
+        # peak memory of the currently running stages (innermost last)
+        self._peaks = []
+
+    def __enter__(self):
+        global _recorder
+        self._previous = _recorder
+        _recorder = self
+        self._started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc):
+        global _recorder
+        _recorder = self._previous
+        if self._started_tracing:
+            tracemalloc.stop()
+
+    def record(self, stage, **fields):
+        self.records.append(dict(self.fields, stage=stage, **fields))
+
+
+def record(stage, **fields):
+    """Add a record to the active recorder (if any)."""
+    if _recorder is not None:
+        _recorder.record(stage, **fields)
+
+
+@contextmanager
+def stage(name, **fields):
+    """Record the time and memory of the code in the with block as a stage."""
+    recorder = _recorder
+    if recorder is None:
+        yield
+        return
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        # the peak of the enclosing stage so far has to be saved before
+        # resetting the peak for this stage
+        current, peak = tracemalloc.get_traced_memory()
+        if recorder._peaks:
+            recorder._peaks[-1] = max(recorder._peaks[-1], peak)
+        tracemalloc.reset_peak()
+        recorder._peaks.append(current)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        memory = {}
+        if tracing:
+            end, peak = tracemalloc.get_traced_memory()
+            peak = max(recorder._peaks.pop(), peak)
+            if recorder._peaks:
+                recorder._peaks[-1] = max(recorder._peaks[-1], peak)
+            memory = {"allocated": end - current, "peak": peak - current}
+        recorder.record(name, time=elapsed, **memory, **fields)
+
+
+def summarize(records, by=("stage",)):
+    """Aggregate records by the given fields.
+
+    Returns a list of dicts with the values of the fields in by, the number
+    of records, the total and maximum time and the maximum peak memory,
+    and for CG records the total number of iterations and the number of
+    solves that didn't converge. Sorted by total time, descending.
+    """
+    groups = defaultdict(list)
+    for r in records:
+        groups[tuple(r.get(field) for field in by)].append(r)
+
+    summary = []
+    for values, group in groups.items():
+        times = [r["time"] for r in group if "time" in r]
+        entry = dict(zip(by, values), count=len(group), time=sum(times),
+                     max_time=max(times, default=0.0))
+        peaks = [r["peak"] for r in group if "peak" in r]
+        if peaks:
+            entry["peak"] = max(peaks)
+        iterations = [r["iterations"] for r in group if "iterations" in r]
+        if iterations:
+            entry["iterations"] = sum(iterations)
+            entry["not_converged"] = sum(1 for r in group if r.get("info", 0) > 0)
+        summary.append(entry)
+    return sorted(summary, key=lambda entry: entry["time"], reverse=True)
@@ -0,0 +1,81 @@
+import os
+import argparse
+from multiprocessing import Pool
+from python import cache, figures
+
+parser = argparse.ArgumentParser(
+    description='Render the potential or segmentation figures of many Grabcut images at once')
+parser.add_argument('figure', type=str, choices=["potentials", "segmentations"],
+                    help='which figures to render')
+parser.add_argument('images', type=str, nargs='*',
+                    help='names of the images (default: all images in data/images)')
+parser.add_argument('--betas', type=str, nargs='+', default=["0", "1", "2", "5", "10", "20"],
+                    help='beta values of the potential figures')
+parser.add_argument('--karger-beta', type=str, default="10",
+                    help='beta value of the Karger segmentation')
+parser.add_argument('--rw-beta', type=str, default="20",
+                    help='beta value of the RW segmentation')
+parser.add_argument('--watershed-beta', type=str, default="10",
+                    help='beta value of the watershed segmentation')
+parser.add_argument('--pw-beta', type=str, default="10",
+                    help='beta value of the power watershed segmentation')
+parser.add_argument('-j', type=int, default=None,
+                    help='number of worker processes (default: all cores)')
+parser.add_argument('--force', action='store_true',
+                    help='render all figures, even if they are up to date')
+args = parser.parse_args()
+
+# The figure of each worker process, which is reused for all its images
+_figure = None
+
+
+def _init_worker(figure, betas):
+    global _figure
+    if figure == "potentials":
+        _figure = figures.PotentialFigure(betas)
+    else:
+        _figure = figures.SegmentationFigure()
+
+
+def task(image):
+    """Inputs, load function, output and cache key of the figure of an image."""
+    if args.figure == "potentials":
+        paths = (f"results/karger_potentials/grabcut/{image}",
+                 f"results/rw_potentials/grabcut/{image}",
+                 f"results/watershed/grabcut/{image}",
+                 args.betas)
+        inputs = figures.potential_inputs(*paths)
+        load = figures.load_potentials
+        output = f"fig/potentials/{image}.png"
+        params = {"betas": args.betas}
+    else:
+        paths = (f"results/karger_potentials/grabcut/{image}/{args.karger_beta}",
+                 f"results/rw_potentials/grabcut/{image}/{args.rw_beta}",
+                 f"results/watershed/grabcut/{image}/{args.watershed_beta}",
+                 f"results/power_watershed/grabcut/{image}/{args.pw_beta}",
+                 f"data/hed/{image}.jpg")
+        inputs = figures.segmentation_inputs(*paths)
+        load = figures.load_segmentations
+        output = f"fig/segmentations/{image}.png"
+        params = {}
+    return paths, load, output, cache.key(args.figure + "_plot", inputs, **params)
+
+
+def render(image):
+    paths, load, output, key = task(image)
+    if not args.force and figures.up_to_date(output, key):
+        return output, False
+    _figure.render(load(*paths), output, key)
+    return output, True
+
+
+if __name__ == "__main__":
+    images = args.images
+    if not images:
+        images = sorted(os.path.splitext(file)[0] for file in os.listdir("data/images")
+                        if file.endswith(".jpg"))
+
+    with Pool(args.j, initializer=_init_worker, initargs=(args.figure, args.betas)) as pool:
+        for i, (output, rendered) in enumerate(pool.imap_unordered(render, images), start=1):
+            status = "" if rendered else " (up to date)"
+            print(f"[{i}/{len(images)}] {output}{status}")
@@ -1,28 +1,38 @@
 import os
 import sys
+import argparse
 import h5py
 import numpy as np
-from sklearn.neighbors import kneighbors_graph
 import scipy
+from python import cache, storage, knn
+
+parser = argparse.ArgumentParser(description='Create the USPS kNN graphs')
+parser.add_argument('betas', type=float, nargs='+',
+                    help='beta values to compute the weights for')
+parser.add_argument('--compact', action='store_true',
+                    help='write the graph and all seed sets into a single file '
+                         '(results/graphs/usps_seed_sets.h5) instead of one '
+                         'graph per seed set and beta')
+parser.add_argument('-j', type=int, default=None,
+                    help='number of worker processes for the kNN search (default: all cores)')
+parser.add_argument('--approximate', action='store_true',
+                    help='find the neighbours with pynndescent instead of exactly')
+args = parser.parse_args()
 
 np.random.seed(0)
-os.makedirs("results/graphs/usps", exist_ok=True)
 
-n = 7291
-beta = float(sys.argv[1])
+# the kNN graph is the same for all beta values, so we compute it only once
+# and then write the graphs for all betas given as arguments
+betas = np.array(args.betas)
 with h5py.File("data/usps.h5", "r") as f:
     data = f["data"][:] * 255
     labels = f["labels"][:].astype(np.int64)
     # Ugly hack: we want to use the 0 label later as "no seed"
     labels += 1
+n = data.shape[0]
 
-graph = kneighbors_graph(data, 10, mode="distance", include_self=False)
-rows, cols, vals = scipy.sparse.find(graph)
-vals = vals ** 2
-max_dist = np.max(vals)
-edges = np.stack([rows, cols], axis=0)
-weights = np.exp(-beta * vals / max_dist)
-
+names = []
+seed_sets = []
 for l in [20, 40, 100, 200]:
     for i in range(20):
         mask = np.full(n, False)
@@ -33,17 +43,59 @@ for l in [20, 40, 100, 200]:
             np.random.shuffle(mask)
         seeds = np.zeros(n, dtype=np.int64)
         seeds[mask] = labels[mask]
+        names.append(f"{l}_{i}")
+        seed_sets.append(seeds)
+
+
+def key(*params):
+    # everything is determined by the data and the random seed above,
+    # apart from which seed set and beta a graph is for
+    if args.approximate:
+        params += ("approximate",)
+    return cache.key("usps_graph", ["data/usps.h5"], params=params)
+
+
+if args.compact:
+    outputs = {"results/graphs/usps_seed_sets.h5": key("compact", list(betas))}
+else:
+    outputs = {f"results/graphs/usps/{name}/{int(beta)}.h5": key(name, beta)
+               for name in names for beta in betas}
+outputs = {path: k for path, k in outputs.items() if not cache.fetch(path, k)}
+if not outputs:
+    print("USPS graphs are up to date")
+    sys.exit()
+
+# the same graph as sklearn's kneighbors_graph, i.e. mutual neighbours are
+# connected by two edges, and the same distances (in float64), so that
+# the graphs don't change
+neighbours, distances = knn.nearest_neighbours(data, 10, n_jobs=args.j,
+                                               approximate=args.approximate,
+                                               dtype=np.float64)
+edges, distances = knn.knn_edges(neighbours, distances, symmetric=False)
+# scipy.sparse.find used to drop the edges between duplicate images,
+# because their distance is an explicit zero in the sparse matrix
+edges, distances = edges[:, distances > 0], distances[distances > 0]
 
-        os.makedirs(f"results/graphs/usps/{l}_{i}", exist_ok=True)
-        # Remove the hdf5 file if it exists, to avoid errors from h5py
-        try:
-            os.remove(f"results/graphs/usps/{l}_{i}/{int(beta)}.h5")
-        except OSError:
-            pass
-
-        with h5py.File(f"results/graphs/usps/{l}_{i}/{int(beta)}.h5", "w") as f:
-            f.create_dataset("n", data=n)
-            f.create_dataset("edges", data=edges)
-            f.create_dataset("weights", data=weights)
-            f.create_dataset("seeds", data=seeds)
-            f.create_dataset("ground_truth", data=labels)
+if args.compact:
+    # All seed sets share the graph, so it is only stored once. The seeds
+    # are stored like a CSR matrix: the seeds of set s are the nodes
+    # seeds/indices[indptr[s]:indptr[s + 1]] with labels seeds/labels[...]
+    path = "results/graphs/usps_seed_sets.h5"
+    seed_sets = scipy.sparse.csr_matrix(np.array(seed_sets))
+    knn.write_graph(path, n, edges, distances, {str(int(beta)): beta for beta in betas},
+                    ground_truth=labels)
+    with h5py.File(path, "a") as f:
+        f.create_dataset("seeds/names", data=np.array(names, dtype="S"))
+        storage.create_dataset(f, "seeds/indptr", seed_sets.indptr)
+        storage.create_dataset(f, "seeds/indices", seed_sets.indices)
+        storage.create_dataset(f, "seeds/labels", seed_sets.data)
+    cache.store(path, outputs[path])
+else:
+    for name, seeds in zip(names, seed_sets):
+        os.makedirs(f"results/graphs/usps/{name}", exist_ok=True)
+        for beta in betas:
+            path = f"results/graphs/usps/{name}/{int(beta)}.h5"
+            if path not in outputs:
+                continue
+            knn.write_graph(path, n, edges, distances, beta, seeds, ground_truth=labels)
+            cache.store(path, outputs[path])
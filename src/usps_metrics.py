@@ -1,16 +1,18 @@
 import os
 import json
-import h5py
+import argparse
+from multiprocessing import Pool
 import numpy as np
-from scipy.special import xlogy
-from sklearn import metrics
-from sklearn.metrics.cluster import pair_confusion_matrix
+from python import cache, storage
+from python.metrics import SCORES, contingency_tables, scores, RunningMean
 
-scores = {
-    "accuracy": (lambda x, y: np.sum(x == y) / len(x)),
-    }
-
-methods = ["karger", "RW", "watershed", "power_watershed"]
+# directory inside results/ and the dataset with the segmentation for each method
+methods = {
+    "karger": ("karger_potentials", "segmentation"),
+    "RW": ("rw_potentials", "segmentation"),
+    "watershed": ("watershed", "potential"),
+    "power_watershed": ("power_watershed", "segmentation"),
+}
 ls = [20, 40, 100, 200]
 betas = {
     "karger": 2,
@@ -19,41 +21,83 @@ betas = {
     "power_watershed": 10,
 }
 N = 20
-data = {l:
-        {method:
-         {score: [] for score in scores}
-         for method in methods}
-        for l in ls}
-error = {l:
-         {method:
-          {score: [] for score in scores}
-          for method in methods}
-         for l in ls}
-
-segmentations = {}
-
-for l in ls:
-    for i in range(N):
-        path = f"{l}_{i}"
-        with h5py.File(f"results/karger_potentials/usps/{path}/{betas['karger']}.h5", "r") as f:
-            segmentations["karger"] = f["segmentation"][()]
-        with h5py.File(f"results/graphs/usps/{path}/{betas['watershed']}.h5", "r") as f:
-            seeds = f["seeds"][()]
+
+
+def result_file(method, path, beta):
+    return f"results/{methods[method][0]}/usps/{path}/{beta}.h5"
+
+
+def evaluate(task):
+    """Scores of all (method, beta) runs for one seed set, like
+    evaluate in grabcut_metrics.py."""
+    path, runs = task
+    runs = [(method, beta) for method, beta in runs
+            if os.path.exists(result_file(method, path, beta))]
+    # seeds and ground truth are the same for all betas
+    graph_files = [f"results/graphs/usps/{path}/{beta}.h5" for _, beta in runs]
+    graph_file = next((f for f in graph_files if os.path.exists(f)), None)
+    if graph_file is None:
+        return {}
+    keys = [cache.key("usps_metrics", [result_file(method, path, beta), graph_file])
+            for method, beta in runs]
+
+    def compute():
+        with storage.File(graph_file) as f:
+            mask = (f["seeds"][()] == 0)
             gt = f["ground_truth"][()]
-        with h5py.File(f"results/rw_potentials/usps/{path}/{betas['RW']}.h5", "r") as f:
-            segmentations["RW"] = f["segmentation"][()]
-        with h5py.File(f"results/watershed/usps/{path}/{betas['watershed']}.h5", "r") as f:
-            segmentations["watershed"] = f["potential"][()]
-        with h5py.File(f"results/power_watershed/usps/{path}/{betas['power_watershed']}.h5", "r") as f:
-            segmentations["power_watershed"] = f["segmentation"][()]
-
-        mask = (seeds == 0)
-        for method, seg in segmentations.items():
-            for score, func in scores.items():
-                data[l][method][score].append(func(gt[mask], seg[mask]))
-
-    error[l] = {k: {k_: np.std(v_)/np.sqrt(N) for k_, v_ in v.items()} for k, v in data[l].items()}
-    data[l] = {k: {k_: np.mean(v_) for k_, v_ in v.items()} for k, v in data[l].items()}
-
-with open('results/power_watershed_usps.json', 'w', encoding='utf-8') as f:
-    json.dump({"data": data, "errors": error}, f, ensure_ascii=False, indent=4)
+        segmentations = []
+        for method, beta in runs:
+            with storage.File(result_file(method, path, beta)) as f:
+                segmentations.append(f[methods[method][1]][()][mask])
+        values = scores(contingency_tables(gt[mask], segmentations))
+        return [{score: float(values[score][i]) for score in SCORES}
+                for i in range(len(runs))]
+
+    return dict(zip(runs, cache.memoize_all(keys, compute)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Calculate the metrics for the USPS dataset')
+    parser.add_argument('--betas', type=str, nargs='+',
+                        help='evaluate all methods for all of these beta values '
+                             '(default: only the optimal beta of each method)')
+    parser.add_argument('--scores', type=str, nargs='+', default=["accuracy"],
+                        choices=SCORES, help='scores to report')
+    parser.add_argument('-j', type=int, default=None,
+                        help='number of worker processes (default: all cores)')
+    parser.add_argument('-o', type=str, default=None, metavar='PATH',
+                        help='output file (default: results/power_watershed_usps.json, '
+                             'or results/usps_betas.json with --betas)')
+    args = parser.parse_args()
+
+    if args.betas:
+        runs = [(method, beta) for method in methods for beta in args.betas]
+        output = args.o or 'results/usps_betas.json'
+    else:
+        runs = [(method, str(beta)) for method, beta in betas.items()]
+        output = args.o or 'results/power_watershed_usps.json'
+
+    tasks = [(f"{l}_{i}", runs) for l in ls for i in range(N)]
+    stats = {(l, run): RunningMean() for l in ls for run in runs}
+    with Pool(args.j) as pool:
+        # imap keeps the order of the tasks, so l is known for each result
+        for (path, _), result in zip(tasks, pool.imap(evaluate, tasks)):
+            l = int(path.split("_")[0])
+            for run, values in result.items():
+                stats[l, run].add(np.array([values[score] for score in args.scores]))
+
+    data = {l: {} for l in ls}
+    error = {l: {} for l in ls}
+    for (l, (method, beta)), stat in stats.items():
+        if stat.count == 0:
+            continue
+        mean = dict(zip(args.scores, stat.mean.tolist()))
+        se = dict(zip(args.scores, stat.standard_error.tolist()))
+        if args.betas:
+            data[l].setdefault(method, {})[beta] = mean
+            error[l].setdefault(method, {})[beta] = se
+        else:
+            data[l][method], error[l][method] = mean, se
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({"data": data, "errors": error}, f, ensure_ascii=False, indent=4)
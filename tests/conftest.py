@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules are imported as python.<module>, like the scripts in src/ do
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
@@ -0,0 +1,41 @@
+import os
+
+from python import cache
+
+
+def test_memoize_all_survives_eviction(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.delenv("NO_CACHE", raising=False)
+    keys = [cache.key("metric", run=i) for i in range(3)]
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return [10, 11, 12]
+
+    assert cache.memoize_all(keys, compute) == [10, 11, 12]
+    assert cache.memoize_all(keys, compute) == [10, 11, 12]
+    assert len(calls) == 1
+
+    # another process evicts an entry right before it is read
+    touch = cache._touch
+
+    def evict_then_touch(path):
+        if path == cache._entry(keys[1], ".json"):
+            os.remove(path)
+        touch(path)
+
+    monkeypatch.setattr(cache, "_touch", evict_then_touch)
+    assert cache.memoize_all(keys, compute) == [10, 11, 12]
+    assert len(calls) == 2
+    monkeypatch.setattr(cache, "_touch", touch)
+    assert cache.memoize_all(keys, compute) == [10, 11, 12]
+    assert len(calls) == 2
+
+
+def test_memoize(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.delenv("NO_CACHE", raising=False)
+    key = cache.key("metric", run=0)
+    assert cache.memoize(key, lambda: {"accuracy": 0.5}) == {"accuracy": 0.5}
+    assert cache.memoize(key, lambda: None) == {"accuracy": 0.5}
@@ -0,0 +1,13 @@
+import numpy as np
+
+from calculate_potentials import quantize_weights
+
+
+def test_quantize_weights_like_julia():
+    # julia/calculate_power_watershed_multi.jl: min 2, max 6, so
+    # [2, 4, 6] / 4 .+ 2 = [2.5, 3, 3.5], times 255 = [637.5, 765, 892.5],
+    # rounded (ties to even, like numpy) = [638, 765, 892]
+    weights = np.array([2., 4., 6.])
+    np.testing.assert_array_equal(quantize_weights(weights), [638, 765, 892])
+    # the input isn't modified
+    np.testing.assert_array_equal(weights, [2, 4, 6])
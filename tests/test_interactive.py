@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from python.image import graph_from_hed
+from python.interactive import RandomWalkerSession
+from python.random_walker import random_walker
+
+
+def _graph(shape=(24, 32)):
+    rng = np.random.default_rng(0)
+    hed = 0.1 * rng.random(shape)
+    # a boundary across the image
+    hed[:, shape[1] // 2] = 1
+    return graph_from_hed(hed, beta=10)
+
+
+def _seeds(shape, changes):
+    labels = np.zeros(shape, dtype=np.int64)
+    for rows, cols, label in changes:
+        labels[rows, cols] = label
+    return labels.ravel()
+
+
+# each step changes the seeds of the step before: new seeds, a new label,
+# relabeled seeds and removed seeds
+STEPS = [
+    [(0, slice(None), 1), (-1, slice(None), 2)],
+    [(0, slice(None), 1), (-1, slice(None), 2), (12, slice(2, 8), 1)],
+    [(0, slice(None), 1), (-1, slice(None), 2), (12, slice(2, 8), 1), (12, slice(20, 28), 3)],
+    [(0, slice(None), 1), (-1, slice(None), 2), (12, slice(2, 8), 2), (12, slice(20, 28), 3)],
+    [(0, slice(None), 1), (-1, slice(None), 2), (12, slice(20, 28), 3)],
+]
+
+
+@pytest.mark.parametrize("max_iterations", [20, 1])
+def test_full_updates_are_exact(max_iterations):
+    # with max_iterations=1, most updates factorize the system again
+    shape = (24, 32)
+    n, edges, weights = _graph(shape)
+    session = RandomWalkerSession(n, edges, weights, _seeds(shape, STEPS[0]),
+                                  tol=1e-10, max_iterations=max_iterations)
+    for step in STEPS:
+        labels = _seeds(shape, step)
+        potentials = session.update_seeds(labels)
+        expected = random_walker(n, edges, weights, labels, mode='bf')
+        np.testing.assert_allclose(potentials[:expected.shape[0]], expected, atol=1e-7)
+
+
+def test_local_updates_trade_accuracy_for_time():
+    shape = (24, 32)
+    n, edges, weights = _graph(shape)
+    old, new = _seeds(shape, STEPS[1]), _seeds(shape, STEPS[2])
+    expected = random_walker(n, edges, weights, new, mode='bf')
+    errors = []
+    for radius in [1, 4, 16, 64]:
+        session = RandomWalkerSession(n, edges, weights, old, tol=1e-10)
+        potentials = session.update_seeds(new, radius=radius)
+        errors.append(np.abs(potentials - expected).max())
+    # a small neighbourhood is far off, as the new label spreads over its
+    # whole side of the boundary, and a neighbourhood that covers the whole
+    # graph is exact
+    assert errors[0] > 0.3
+    assert all(np.diff(errors) <= 1e-9)
+    assert errors[-1] < 1e-7
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from python import karger
+from python.image import graph_from_hed
+
+
+def _graph():
+    rng = np.random.default_rng(0)
+    n, edges, weights = graph_from_hed(rng.random((12, 15)), beta=5)
+    seeds = np.zeros(n, dtype=np.int64)
+    seeds[:15] = 1
+    seeds[-15:] = 2
+    seeds[90] = 3
+    return n, edges, weights, seeds
+
+
+@pytest.fixture(params=["numba", "lockstep"])
+def contract(request, monkeypatch):
+    if request.param == "numba":
+        if not karger.numba_loaded:
+            pytest.skip("numba is not installed")
+    else:
+        monkeypatch.setattr(karger, "_contract", karger._contract_lockstep)
+
+
+def test_potentials_sum_to_one(contract):
+    n, edges, weights, seeds = _graph()
+    pots = karger.karger_potential(n, edges, weights, seeds, 32, n_jobs=1)
+    assert pots.shape == (3, n)
+    np.testing.assert_allclose(pots.sum(axis=0), 1)
+    np.testing.assert_array_equal(pots[seeds - 1, np.arange(n)][seeds > 0], 1)
+
+
+def test_labels_with_gaps(contract):
+    # labels 1 and 4 only: the sampling has to stop at two clusters, like
+    # with the labels 1 and 2, and gives the same samples
+    n, edges, weights, seeds = _graph()
+    seeds[seeds == 3] = 0
+    gaps = np.where(seeds == 2, 4, seeds)
+    pots = karger.karger_potential(n, edges, weights, seeds, 32, n_jobs=1)
+    gap_pots = karger.karger_potential(n, edges, weights, gaps, 32, n_jobs=1)
+    assert gap_pots.shape == (4, n)
+    np.testing.assert_array_equal(gap_pots[[0, 3]], pots)
+    np.testing.assert_array_equal(gap_pots[1:3], 0)
+
+    segmentation = karger.watershed(n, edges, weights, seeds)
+    gap_segmentation = karger.watershed(n, edges, weights, gaps)
+    assert (segmentation > 0).all()
+    np.testing.assert_array_equal(gap_segmentation, np.where(segmentation == 2, 4, 1))
+
+
+def test_samples_do_not_depend_on_workers_or_engine(monkeypatch):
+    n, edges, weights, seeds = _graph()
+    pots = karger.karger_potential(n, edges, weights, seeds, 24, n_jobs=1, seed=3)
+    np.testing.assert_array_equal(
+        karger.karger_potential(n, edges, weights, seeds, 24, n_jobs=2, seed=3), pots)
+    monkeypatch.setattr(karger, "_contract", karger._contract_lockstep)
+    np.testing.assert_array_equal(
+        karger.karger_potential(n, edges, weights, seeds, 24, n_jobs=1, seed=3), pots)
+    # a different seed gives different samples
+    assert not np.array_equal(
+        karger.karger_potential(n, edges, weights, seeds, 24, n_jobs=1, seed=4), pots)
+
+
+@pytest.mark.parametrize("tol, stability", [(0.05, None), (1e-4, 0.02), (1e-4, None)])
+def test_adaptive_matches_fixed_samples(tol, stability):
+    n, edges, weights, seeds = _graph()
+    pots, info = karger.karger_potential_adaptive(
+        n, edges, weights, seeds, tol=tol, stability=stability, min_samples=16,
+        max_samples=200, n_jobs=1, batch_size=8, seed=2)
+    samples = info["samples"]
+    assert 16 <= samples <= 200 and samples % 8 == 0
+    if stability is None and tol < 0.01:
+        assert samples == 200
+    else:
+        # stopped early, by the standard error or by the labels
+        assert samples < 200
+        assert info["standard_error"] <= tol or info["changed"] <= stability
+    np.testing.assert_allclose(info["standard_error"],
+                               karger.standard_error(pots, samples).max())
+    np.testing.assert_array_equal(
+        pots, karger.karger_potential(n, edges, weights, seeds, samples, n_jobs=1,
+                                      batch_size=8, seed=2))
+
+
+def test_power_watershed_limits():
+    from python.random_walker import random_walker
+
+    n, edges, weights, seeds = _graph()
+    # with distinct weights there are no plateaus: the watershed
+    distinct = np.random.default_rng(1).permutation(weights.size) + 1.0
+    pots = karger.power_watershed(n, edges, distinct, seeds)
+    segmentation = karger.watershed(n, edges, distinct, seeds)
+    np.testing.assert_array_equal(pots, np.eye(3)[:, segmentation - 1])
+
+    # with equal weights the whole graph is one plateau: the random walker
+    equal = np.full(weights.size, 0.5)
+    pots = karger.power_watershed(n, edges, equal, seeds, tol=1e-10)
+    np.testing.assert_allclose(pots, random_walker(n, edges, equal, seeds, mode='bf'),
+                               atol=1e-8)
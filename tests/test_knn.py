@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from python import knn, storage
+
+
+def _data():
+    return np.random.default_rng(0).random((300, 8))
+
+
+@pytest.mark.parametrize("n_jobs, block_size", [(1, None), (2, 64)])
+def test_matches_kneighbors_graph(n_jobs, block_size):
+    neighbors = pytest.importorskip("sklearn.neighbors")
+    data = _data()
+    graph = neighbors.kneighbors_graph(data, 10, mode='distance')
+    rows, cols, expected = sparse.find(graph)
+    order = np.lexsort((cols, rows))
+
+    neighbours, distances = knn.nearest_neighbours(data, 10, n_jobs=n_jobs,
+                                                   dtype=np.float64, block_size=block_size)
+    assert neighbours.shape == distances.shape == (300, 10)
+    assert np.all(np.diff(distances, axis=1) >= 0)
+    edges, edge_distances = knn.knn_edges(neighbours, distances, symmetric=False)
+    np.testing.assert_array_equal(edges, np.stack([rows[order], cols[order]]))
+    np.testing.assert_allclose(edge_distances, expected[order] ** 2)
+
+    # symmetric: one edge for each pair that is connected in either direction
+    edges, edge_distances = knn.knn_edges(neighbours, distances, symmetric=True)
+    upper = sparse.triu(graph + graph.T).tocoo()
+    order = np.lexsort((upper.col, upper.row))
+    np.testing.assert_array_equal(edges, np.stack([upper.row[order], upper.col[order]]))
+    np.testing.assert_allclose(edge_distances, (graph.maximum(graph.T)[tuple(edges)].A1) ** 2)
+
+
+def test_write_graph(tmp_path):
+    neighbours, distances = knn.nearest_neighbours(_data(), 5, n_jobs=1)
+    edges, distances = knn.knn_edges(neighbours, distances)
+    seeds = np.zeros(300, dtype=np.int64)
+    seeds[:3] = [1, 2, 3]
+    path = str(tmp_path / "graph.h5")
+    knn.write_graph(path, 300, edges, distances, {"1": 1.0, "5": 5.0}, seeds=seeds,
+                    chunk_size=100)
+    for name, beta in [("1", 1.0), ("5", 5.0)]:
+        n, read_edges, weights, read_seeds, shape = storage.read_graph(path, name)
+        assert n == 300 and shape is None
+        np.testing.assert_array_equal(read_edges, edges)
+        np.testing.assert_array_equal(read_seeds, seeds)
+        np.testing.assert_allclose(weights, np.exp(-beta * distances / distances.max()),
+                                   rtol=1e-6)
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from python.image import graph_from_hed
+from python.multigrid import GridMultigrid
+from python.random_walker import _build_linear_system, random_walker
+
+
+def _grid(beta, shape=(60, 60)):
+    rng = np.random.default_rng(0)
+    n, edges, weights = graph_from_hed(rng.random(shape), beta=beta)
+    labels = np.zeros(n, dtype=np.int64)
+    labels[:shape[1]] = 1
+    labels[-shape[1]:] = 2
+    labels[n // 2 + shape[1] // 2] = 3
+    return n, edges, weights, labels
+
+
+@pytest.mark.parametrize("beta", [5, 50])
+def test_cg_gmg_matches_bf(beta):
+    n, edges, weights, labels = _grid(beta)
+    expected = random_walker(n, edges, weights, labels, mode='bf')
+    pots = random_walker(n, edges, weights, labels, mode='cg_gmg', tol=1e-10,
+                         shape=(60, 60))
+    np.testing.assert_allclose(pots, expected, atol=1e-7)
+    # the grid is assembled from the shape if the edges aren't given
+    pots = random_walker(n, None, weights, labels, mode='cg_gmg', tol=1e-10,
+                         shape=(60, 60))
+    np.testing.assert_allclose(pots, expected, atol=1e-7)
+
+
+def test_noisy_grid_is_coarsened():
+    # on noise with a large beta hardly any edge is strong, the blocks are
+    # aggregated as a whole instead, which at least halves the grid
+    n, edges, weights, labels = _grid(50)
+    A = _build_linear_system(edges, weights, labels, 3, shape=(60, 60))[0]
+    multigrid = GridMultigrid(A, (60, 60), labels, coarse_size=50)
+    sizes = [level[0].shape[0] for level in multigrid.levels] + [multigrid.coarse_shape[0]]
+    assert sizes[0] == n - 121
+    assert sizes[1] < sizes[0] / 2
+    assert sizes[-1] <= 50
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from python.multiscale import coarsen, multiscale_potential
+
+
+@pytest.mark.parametrize("method", ["rw", "karger"])
+def test_label_without_coarse_seeds(method):
+    # the only seed of label 2 shares its 2x2 block with a seed of label 1,
+    # so label 2 has no seeds at the coarse level, while label 3 does
+    shape = (16, 16)
+    rng = np.random.default_rng(0)
+    weights = rng.random(2 * 16 * 15) + 0.1
+    labels = np.zeros(shape, dtype=np.int64)
+    labels[0] = 1
+    labels[4, 5] = 1
+    labels[5, 5] = 2
+    labels[-1] = 3
+    _, _, coarse_labels = coarsen(shape, weights, labels.ravel())
+    assert set(np.unique(coarse_labels)) == {0, 1, 3}
+
+    potentials, _ = multiscale_potential(shape, weights, labels, method=method,
+                                         levels=1, mode='bf', n_samples=10)
+    assert potentials.shape == (3, 16 * 16)
+    seeded = labels.ravel() > 0
+    np.testing.assert_array_equal(np.argmax(potentials[:, seeded], axis=0) + 1,
+                                  labels.ravel()[seeded])
+    # the bottom rows only see label 3, which was solved at the coarse level
+    assert potentials[2, -16:].min() == 1
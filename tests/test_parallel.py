@@ -0,0 +1,47 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+from multiprocessing import shared_memory
+from scipy import sparse
+
+from python import parallel
+from python.random_walker import _build_laplacian
+
+
+def _path_laplacian(n):
+    edges = np.array([np.arange(n - 1), np.arange(1, n)])
+    return _build_laplacian(edges, np.ones(n - 1), n)
+
+
+def test_solve_matches_direct_solve():
+    n = 200
+    A = _path_laplacian(n) + 0.1 * np.eye(n)
+    B = np.random.default_rng(0).random((n, 3))
+    with parallel.DomainDecomposition(A, 3, n_jobs=2, overlap=2) as dd:
+        np.testing.assert_allclose(dd @ B, A @ B)
+        Z = dd.preconditioner @ B
+    assert Z.shape == B.shape
+
+
+def test_failed_factorization_releases_everything(monkeypatch):
+    created = []
+
+    class Tracked(shared_memory.SharedMemory):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            if kwargs.get("create"):
+                created.append(self.name)
+
+    monkeypatch.setattr(parallel.shared_memory, "SharedMemory", Tracked)
+    # the second half of the matrix is the (singular) matrix of ones, so the
+    # worker that gets it as its subdomain can't factorize it, while the
+    # other one can (and the coarse system is still fine)
+    A = sparse.block_diag([sparse.identity(50), np.ones((50, 50))]).tocsr()
+    with pytest.raises(EOFError):
+        parallel.DomainDecomposition(A, 2, n_jobs=2, overlap=0)
+    assert len(created) == 3
+    for name in created:
+        assert not os.path.exists(os.path.join("/dev/shm", name.lstrip("/")))
+    assert not multiprocessing.active_children()
@@ -0,0 +1,154 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from python.random_walker import random_walker, random_walker_sequence
+
+
+@pytest.mark.parametrize("labels", [[1, 0, 2, 0, 3], [1, 2, 3, 2, 1]])
+def test_sequence_agrees_with_random_walker(labels):
+    # the second graph has no unlabeled nodes at all, as can happen
+    # after the seeds of a graph have been collapsed by reduce_graph
+    labels = np.array(labels)
+    edges = np.array([[0, 1, 2, 3], [1, 2, 3, 4]])
+    weights = [np.array([1., 2., 3., 4.]), np.array([4., 3., 2., 1.])]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        outputs = random_walker_sequence(5, edges, weights, labels, mode='bf')
+        for w, output in zip(weights, outputs):
+            expected = random_walker(5, edges, w, labels, mode='bf')
+            assert output.shape == (3, 5)
+            np.testing.assert_allclose(output, expected)
+
+
+def test_grid_assembly_with_uint8_seeds():
+    from python.image import graph_from_hed
+
+    rng = np.random.default_rng(0)
+    n, edges, weights = graph_from_hed(rng.random((10, 12)), beta=5)
+    labels = np.zeros(n, dtype=np.uint8)
+    labels[:12] = 1
+    labels[-12:] = 2
+    expected = random_walker(n, edges, weights, labels.astype(np.int64), mode='bf')
+    grid = random_walker(n, None, weights, labels, mode='bf', shape=(10, 12))
+    np.testing.assert_allclose(grid, expected)
+
+
+def _grid(shape=(10, 12), nlabels=3):
+    from python.image import graph_from_hed
+
+    rng = np.random.default_rng(0)
+    n, edges, weights = graph_from_hed(rng.random(shape), beta=5)
+    labels = np.zeros(n, dtype=np.int64)
+    labels[:shape[1]] = 1
+    labels[-shape[1]:] = 2
+    if nlabels > 2:
+        labels[n // 2] = 3
+    return n, edges, weights, labels
+
+
+def test_factorized_matches_bf():
+    from python import random_walker as rw
+
+    n, edges, weights, labels = _grid()
+    expected = random_walker(n, edges, weights, labels, mode='bf')
+    rw._factorization_cache.clear()
+    np.testing.assert_allclose(random_walker(n, edges, weights, labels, mode='factorized'),
+                               expected)
+    assert len(rw._factorization_cache) == 1
+    # the second solve reuses the factorization
+    np.testing.assert_allclose(random_walker(n, edges, weights, labels, mode='factorized'),
+                               expected)
+    assert len(rw._factorization_cache) == 1
+    # other weights need a new one
+    random_walker(n, edges, 2 * weights, labels, mode='factorized')
+    assert len(rw._factorization_cache) == 2
+
+
+def test_cg_block_matches_bf():
+    n, edges, weights, labels = _grid()
+    expected = random_walker(n, edges, weights, labels, mode='bf')
+    np.testing.assert_allclose(random_walker(n, edges, weights, labels, mode='cg_block',
+                                             tol=1e-10),
+                               expected, atol=1e-7)
+
+
+def test_block_cg_masked_columns():
+    from python.random_walker import _block_cg, _build_linear_system
+
+    n, edges, weights, labels = _grid()
+    A, B = _build_linear_system(edges, weights, labels, 3)
+    B = B.toarray()
+    # the second column is only solved on the first half of the rows
+    mask = np.ones(B.shape, dtype=bool)
+    mask[A.shape[0] // 2:, 1] = False
+    X, info = _block_cg(A, B, 1e-10, mask=mask)
+    assert not info.any()
+    np.testing.assert_allclose(X[:, 0], np.linalg.solve(A.toarray(), B[:, 0]), atol=1e-7)
+    half = A.shape[0] // 2
+    np.testing.assert_allclose(X[:half, 1],
+                               np.linalg.solve(A.toarray()[:half, :half], B[:half, 1]),
+                               atol=1e-7)
+    np.testing.assert_array_equal(X[half:, 1], 0)
+
+
+@pytest.mark.parametrize("mode", ["factorized", "cg_block"])
+def test_seed_sets_match_single_solves(mode):
+    from python.random_walker import random_walker_seed_sets
+
+    n, edges, weights, _ = _grid()
+    rng = np.random.default_rng(1)
+    seed_sets = np.zeros((4, n), dtype=np.int64)
+    for seeds, nlabels in zip(seed_sets, [3, 3, 2, 3]):
+        nodes = rng.choice(n, 3 * nlabels, replace=False)
+        seeds[nodes] = np.repeat(np.arange(1, nlabels + 1), 3)
+    pots = random_walker_seed_sets(n, edges, weights, seed_sets, mode=mode, tol=1e-10)
+    assert pots.shape == (4, 3, n)
+    for seeds, set_pots in zip(seed_sets, pots):
+        expected = random_walker(n, edges, weights, seeds, mode='bf')
+        np.testing.assert_allclose(set_pots[:expected.shape[0]], expected, atol=1e-7)
+        np.testing.assert_array_equal(set_pots[expected.shape[0]:], 0)
+
+
+@pytest.mark.parametrize("mode", ['cg_block', 'cg_gmg'])
+def test_mixed_precision_matches_bf(mode):
+    n, edges, weights, labels = _grid((30, 40))
+    expected = random_walker(n, edges, weights, labels, mode='bf')
+    # the refinement goes well below the accuracy of float32
+    mixed = random_walker(n, edges, weights, labels, mode=mode, tol=1e-10,
+                          shape=(30, 40), precision='mixed')
+    assert mixed.dtype == np.float64
+    np.testing.assert_allclose(mixed, expected, atol=1e-7)
+    single = random_walker(n, edges, weights, labels, mode=mode, tol=1e-10,
+                           shape=(30, 40), precision='single')
+    assert single.dtype == np.float32
+    np.testing.assert_allclose(single, expected, atol=1e-6)
+
+
+def test_mixed_precision_requires_a_block_mode():
+    n, edges, weights, labels = _grid()
+    with pytest.raises(ValueError):
+        random_walker(n, edges, weights, labels, mode='bf', precision='mixed')
+    with pytest.raises(ValueError):
+        random_walker(n, edges, weights, labels, mode='cg_block', precision='half')
+
+
+@pytest.mark.parametrize("mode", ['bf', 'factorized', 'cg_block', 'cg_gmg'])
+def test_stream_matches_random_walker(mode):
+    from python.random_walker import random_walker_stream
+
+    n, edges, weights, labels = _grid()
+    labels[[30, 31, 80]] = [4, 5, 5]
+    expected = random_walker(n, edges, weights, labels, mode='bf')
+    received = {}
+
+    def sink(label, potential):
+        received[label] = potential.copy()
+
+    segmentation = random_walker_stream(n, edges, weights, labels, mode=mode, tol=1e-10,
+                                        shape=(10, 12), sink=sink)
+    np.testing.assert_array_equal(segmentation, 1 + np.argmax(expected, axis=0))
+    assert sorted(received) == [1, 2, 3, 4, 5]
+    for label, potential in received.items():
+        np.testing.assert_allclose(potential, expected[label - 1], atol=1e-7)
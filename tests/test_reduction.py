@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from python.image import graph_from_hed
+from python.karger import watershed
+from python.random_walker import random_walker
+from python.reduction import reduce_graph
+
+
+def _graph():
+    """A 12x15 grid with seeds, a path hanging off it (leaves and nodes of
+    degree 2) and a component without seeds."""
+    rng = np.random.default_rng(0)
+    n, edges, weights = graph_from_hed(rng.random((12, 15)), beta=5)
+    path = np.arange(n, n + 6)
+    extra = np.array([[100, *path[:-1], n + 6, n + 7], [*path, n + 7, n + 8]])
+    edges = np.hstack([edges, extra])
+    weights = np.r_[weights, rng.random(extra.shape[1]) + 0.1]
+    seeds = np.zeros(n + 9, dtype=np.int64)
+    seeds[:15] = 1
+    seeds[[20, 21, 35]] = 2
+    seeds[165:180] = 3
+    return n + 9, edges, weights, seeds, n
+
+
+@pytest.mark.parametrize("series", [False, True])
+def test_random_walker_on_reduced_graph(series):
+    n, edges, weights, seeds, seeded_nodes = _graph()
+    # the random walker of the component with seeds, 0 for the other one
+    connected = edges.max(axis=0) < seeded_nodes + 6
+    expected = np.zeros((3, n))
+    expected[:, :seeded_nodes + 6] = random_walker(
+        seeded_nodes + 6, edges[:, connected], weights[connected],
+        seeds[:seeded_nodes + 6], mode='bf')
+
+    reduction = reduce_graph(n, edges, weights, seeds, series=series)
+    assert reduction.n < seeded_nodes
+    pots = random_walker(reduction.n, reduction.edges, reduction.weights,
+                         reduction.seeds, mode='bf')
+    np.testing.assert_allclose(reduction.expand(pots), expected, atol=1e-10)
+
+
+def test_watershed_on_reduced_graph():
+    n, edges, weights, seeds, _ = _graph()
+    reduction = reduce_graph(n, edges, weights, seeds, combine="max")
+    labels = watershed(reduction.n, reduction.edges, reduction.weights, reduction.seeds)
+    expanded = reduction.expand(labels)
+    assert expanded.dtype == labels.dtype
+    np.testing.assert_array_equal(expanded, watershed(n, edges, weights, seeds))
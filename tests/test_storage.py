@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from python import storage
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_graph_and_potentials_round_trip(tmp_path, monkeypatch, compact):
+    monkeypatch.setenv("COMPACT_STORAGE", "1" if compact else "0")
+    monkeypatch.delenv("FLOAT32_WEIGHTS", raising=False)
+    rng = np.random.default_rng(0)
+    n = 50
+    edges = np.stack([np.arange(n - 1), np.arange(1, n)])
+    weights = {"0": np.ones(n - 1), "10": rng.random(n - 1)}
+    seeds = np.zeros(n, dtype=np.int64)
+    seeds[[0, 7]] = 1
+    seeds[[30, 49]] = 300
+    image = rng.integers(0, 256, (5, 10, 3), dtype=np.uint8)
+    path = str(tmp_path / "graph.h5")
+    storage.write_graph(path, n, edges, weights, seeds, image=image)
+
+    for beta, w in weights.items():
+        n_read, edges_read, weights_read, seeds_read, shape = storage.read_graph(path, beta)
+        assert n_read == n
+        assert edges_read.dtype == np.int64 and seeds_read.dtype == np.int64
+        np.testing.assert_array_equal(edges_read, edges)
+        np.testing.assert_array_equal(weights_read, w)
+        np.testing.assert_array_equal(seeds_read, seeds)
+        assert shape == (5, 10)
+
+    result = str(tmp_path / "result.h5")
+    storage.start_result(result, path)
+    pots = rng.random((3, n))
+    pots /= pots.sum(axis=0)
+    storage.write_potentials(result, pots)
+    with storage.File(result) as f:
+        np.testing.assert_array_equal(f["seeds"][()], seeds)
+        np.testing.assert_array_equal(f["image"][()], image)
+        for i in range(3):
+            np.testing.assert_allclose(f["potential/" + str(i + 1)][()], pots[i],
+                                       atol=1e-5 if compact else 0)
+        segmentation = f["segmentation"][()]
+        np.testing.assert_array_equal(segmentation, 1 + np.argmax(pots, axis=0))
+        assert (segmentation - 1).min() == 0
+        assert ("graph" in f.attrs) == compact
+
+
+def test_float32_weights(tmp_path, monkeypatch):
+    monkeypatch.setenv("COMPACT_STORAGE", "1")
+    monkeypatch.setenv("FLOAT32_WEIGHTS", "1")
+    weights = np.random.default_rng(0).random(9)
+    path = str(tmp_path / "graph.h5")
+    storage.write_graph(path, 10, np.stack([np.arange(9), np.arange(1, 10)]), weights)
+    _, _, weights_read, seeds, shape = storage.read_graph(path)
+    assert weights_read.dtype == np.float64
+    np.testing.assert_array_equal(weights_read, weights.astype(np.float32))
+    assert seeds is None and shape is None